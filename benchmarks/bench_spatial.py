@@ -0,0 +1,16 @@
+from climtools import spatial
+from . import fixtures
+
+
+class Sellonlatbox:
+    params = ([10, 30], [10, 5], [None, 365], [False, True])
+    param_names = ["n_year", "lonlat_resolution", "chunks", "drop"]
+
+    def setup(self, n_year, lonlat_resolution, chunks, drop):
+        self.data = fixtures.load_daily_dataset(n_year, lonlat_resolution, chunks)
+
+    def time_sellonlatbox(self, n_year, lonlat_resolution, chunks, drop):
+        spatial.sellonlatbox(self.data, -30, 60, 20, 70, drop = drop).compute()
+
+    def peakmem_sellonlatbox(self, n_year, lonlat_resolution, chunks, drop):
+        spatial.sellonlatbox(self.data, -30, 60, 20, 70, drop = drop).compute()
@@ -0,0 +1,31 @@
+from climtools import stat
+from . import fixtures
+
+
+class WeightedMean:
+    params = ([10, 30], [10, 5], [None, 365])
+    param_names = ["n_year", "lonlat_resolution", "chunks"]
+
+    def setup(self, n_year, lonlat_resolution, chunks):
+        self.data = fixtures.load_daily_dataset(n_year, lonlat_resolution, chunks)
+        self.weights = fixtures.gen_area_weights(self.data)
+
+    def time_cal_weighted_mean(self, n_year, lonlat_resolution, chunks):
+        stat.cal_weighted_mean(self.data, self.weights).compute()
+
+    def peakmem_cal_weighted_mean(self, n_year, lonlat_resolution, chunks):
+        stat.cal_weighted_mean(self.data, self.weights).compute()
+
+
+class AnomalyDim:
+    params = ([10, 30], [10, 5], [None, 365])
+    param_names = ["n_year", "lonlat_resolution", "chunks"]
+
+    def setup(self, n_year, lonlat_resolution, chunks):
+        self.data = fixtures.load_daily_dataset(n_year, lonlat_resolution, chunks)
+
+    def time_cal_anomaly_dim(self, n_year, lonlat_resolution, chunks):
+        stat.cal_anomaly_dim(self.data, ["time"]).compute()
+
+    def peakmem_cal_anomaly_dim(self, n_year, lonlat_resolution, chunks):
+        stat.cal_anomaly_dim(self.data, ["time"]).compute()
@@ -0,0 +1,46 @@
+from climtools import temporal
+from climtools import utils
+from . import fixtures
+
+
+class TemporalDownsampling:
+    params = ([10, 30], [10, 5], [None, 365], ["month", "year"])
+    param_names = ["n_year", "lonlat_resolution", "chunks", "target_resolution"]
+
+    def setup(self, n_year, lonlat_resolution, chunks, target_resolution):
+        self.data = fixtures.load_daily_dataset(n_year, lonlat_resolution, chunks)
+
+    def time_temporal_downsampling(self, n_year, lonlat_resolution, chunks, target_resolution):
+        temporal.temporal_downsampling(self.data, target_resolution).compute()
+
+    def peakmem_temporal_downsampling(self, n_year, lonlat_resolution, chunks, target_resolution):
+        temporal.temporal_downsampling(self.data, target_resolution).compute()
+
+
+class RollingTimeMean:
+    params = ([10, 30], [10, 5], [None, 365])
+    param_names = ["n_year", "lonlat_resolution", "chunks"]
+
+    def setup(self, n_year, lonlat_resolution, chunks):
+        self.data = fixtures.load_daily_dataset(n_year, lonlat_resolution, chunks)
+
+    def time_cal_rolling_time_mean(self, n_year, lonlat_resolution, chunks):
+        temporal.cal_rolling_time_mean(self.data, window = 31).compute()
+
+    def peakmem_cal_rolling_time_mean(self, n_year, lonlat_resolution, chunks):
+        temporal.cal_rolling_time_mean(self.data, window = 31).compute()
+
+
+class TemporalResolution:
+    params = ([10, 30], [False, True])
+    param_names = ["n_year", "full_validation"]
+
+    def setup(self, n_year, full_validation):
+        self.data = fixtures.load_daily_dataset(n_year, 10)
+
+    def time_get_temporal_resolution(self, n_year, full_validation):
+        utils.clear_object_cache()
+        temporal.get_temporal_resolution(self.data, full_validation = full_validation)
+
+    def time_get_temporal_resolution_cached(self, n_year, full_validation):
+        temporal.get_temporal_resolution(self.data, full_validation = full_validation)
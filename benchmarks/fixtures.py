@@ -0,0 +1,87 @@
+import os
+import logging
+import cftime
+import numpy as np
+import xarray as xr
+
+from climtools import stat
+from climtools import spatial_datagenerator
+
+fixture_dir = os.environ.get("CLIMTOOLS_BENCHMARK_DATA", os.path.join(os.path.expanduser("~"), ".cache", "climtools", "benchmarks"))
+fixture_version = 1
+
+
+def gen_daily_dataset(n_year, lonlat_resolution, seed=0):
+    """Generates a daily dataset of a seasonal cycle with a trend modulated by a spatially correlated random field
+
+    Args:
+        n_year (int): Number of years starting in 1850
+        lonlat_resolution (float): Resolution of the regular grid in degree
+        seed (int, optional): Seed of the random field. Defaults to 0.
+
+    Returns:
+        xarray.Dataset: Dataset with the variables tas (time, lat, lon), orog (lat, lon) and time_bnds
+    """
+    start = cftime.datetime(1850, 1, 1, calendar = "proleptic_gregorian")
+    end = cftime.datetime(1850 + n_year, 1, 1, calendar = "proleptic_gregorian")
+    seasonal_cycle = stat.gen_seasonal_cycle(start, end, "day")
+    trend = stat.gen_test_mono_timeseries(start, end)["values"]
+
+    field = spatial_datagenerator.xarray_spatial_correlated_distance_regular_grid(n_sample = 2, lonlat_resolution = lonlat_resolution, method = "fft",
+                                                                                   rng = np.random.default_rng(seed))["data"]
+    field = field.transpose("sample", "lat", "lon").astype(float)
+
+    data = seasonal_cycle[["time_bnds"]]
+    data["tas"] = (seasonal_cycle["seasonal_cycle"]*(1 + field.isel(sample = 0, drop = True)) + trend/trend.max()).transpose("time", "lat", "lon")
+    data["orog"] = field.isel(sample = 1, drop = True)
+    return data.assign_attrs(table_id = "day", variable_id = "tas")
+
+
+def get_fixture_path(n_year, lonlat_resolution):
+    """Returns the path of a cached fixture
+
+    Args:
+        n_year (int): Number of years
+        lonlat_resolution (float): Resolution of the grid in degree
+
+    Returns:
+        str: Path of the netcdf file
+    """
+    return os.path.join(fixture_dir, "daily_v{}_{}y_{}deg.nc".format(fixture_version, n_year, lonlat_resolution))
+
+
+def load_daily_dataset(n_year, lonlat_resolution, chunks=None):
+    """Loads a daily dataset from the fixture cache and generates it on the first use
+
+    Args:
+        n_year (int): Number of years
+        lonlat_resolution (float): Resolution of the grid in degree
+        chunks (int, optional): Number of time steps of a dask chunk, None loads the dataset into memory. Defaults to None.
+
+    Returns:
+        xarray.Dataset: Daily dataset
+    """
+    path = get_fixture_path(n_year, lonlat_resolution)
+    if not os.path.exists(path):
+        logging.info("Generating benchmark fixture {}".format(path))
+        os.makedirs(fixture_dir, exist_ok = True)
+        tmp_path = path + ".{}.tmp".format(os.getpid())
+        gen_daily_dataset(n_year, lonlat_resolution).to_netcdf(tmp_path)
+        os.replace(tmp_path, path)
+
+    if chunks is None:
+        with xr.open_dataset(path, use_cftime = True) as data:
+            return data.load()
+    return xr.open_dataset(path, use_cftime = True, chunks = {"time": chunks})
+
+
+def gen_area_weights(data):
+    """Generates cosine of latitude weights on the grid of a dataset
+
+    Args:
+        data (xarray.Dataset): Dataset with the dimensions lat and lon
+
+    Returns:
+        xarray.DataArray: Weights
+    """
+    return (np.cos(np.deg2rad(data.lat))*xr.ones_like(data.lon)).rename("areacella")
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+import logging
+import datetime
+import functools
+import numpy as np
+import xarray as xr
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "climtools")
+file_block_size = 2**20
+
+def hash_file(path, checksum=False):
+    """Hashes an input file either by its metadata or by its content
+
+    Args:
+        path (str): Path of the file
+        checksum (bool, optional): If True the content of the file is hashed, otherwise its absolute path, modification time and size. Defaults to False.
+
+    Returns:
+        str: Hex digest of the file
+    """
+    hash_object = hashlib.sha256()
+    if checksum:
+        with open(path, "rb") as handle:
+            for block in iter(functools.partial(handle.read, file_block_size), b""):
+                hash_object.update(block)
+    else:
+        stat = os.stat(path)
+        hash_object.update(repr((os.path.abspath(path), stat.st_mtime_ns, stat.st_size)).encode())
+    return hash_object.hexdigest()
+
+
+def hash_func(func):
+    """Hashes a function by its qualified name and its source code. Partial functions are hashed together with their arguments.
+
+    Args:
+        func (function): Function to hash
+
+    Returns:
+        str: Hex digest of the function
+    """
+    if isinstance(func, functools.partial):
+        return hash_object(("partial", hash_func(func.func), func.args, func.keywords))
+
+    name = "{}.{}".format(getattr(func, "__module__", None), getattr(func, "__qualname__", repr(func)))
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = getattr(func, "__code__", None)
+        source = repr(code.co_code) if code is not None else ""
+    return hashlib.sha256((name + source).encode()).hexdigest()
+
+
+def hash_array(array):
+    """Hashes the values of an array. Arrays of objects, e.g. cftime dates, are hashed by the representations of their elements.
+
+    Args:
+        array (numpy.ndarray): Array to hash
+
+    Returns:
+        str: Hex digest of the values
+    """
+    if array.dtype == object:
+        return hashlib.sha256("\n".join(repr(value) for value in array.ravel()).encode()).hexdigest()
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+def normalize_object(obj):
+    """Converts an object into a representation which is stable between interpreter sessions. Arrays and xarray objects are represented
+    by their metadata and a hash of their values.
+
+    Args:
+        obj (object): Object to normalize
+
+    Raises:
+        TypeError: If the object has no stable representation
+
+    Returns:
+        object: Json serializable representation of the object
+    """
+    if isinstance(obj, dict):
+        return {str(key): normalize_object(value) for key, value in sorted(obj.items(), key=lambda item: str(item[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [normalize_object(value) for value in obj]
+    if isinstance(obj, (np.ndarray, np.generic)):
+        obj = np.asarray(obj)
+        return [str(obj.dtype), list(obj.shape), hash_array(obj)]
+    if isinstance(obj, xr.Variable):
+        return ["Variable", list(obj.dims), normalize_object(obj.attrs), normalize_object(obj.values)]
+    if isinstance(obj, xr.DataArray):
+        return ["DataArray", normalize_object(obj.name), normalize_object(obj.variable),
+                normalize_object({name: coord.variable for name, coord in obj.coords.items()})]
+    if isinstance(obj, xr.Dataset):
+        return ["Dataset", normalize_object(dict(obj.variables)), normalize_object(obj.attrs)]
+    if isinstance(obj, slice):
+        return ["slice", normalize_object(obj.start), normalize_object(obj.stop), normalize_object(obj.step)]
+    if isinstance(obj, (datetime.date, datetime.timedelta)):
+        return repr(obj)
+    if callable(obj) and not isinstance(obj, type):
+        return hash_func(obj)
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    raise TypeError("Objects of type {} have no stable representation for the cache key".format(type(obj).__name__))
+
+
+def hash_object(obj):
+    """Hashes an object based on its normalized representation
+
+    Args:
+        obj (object): Object to hash
+
+    Returns:
+        str: Hex digest of the object
+    """
+    return hashlib.sha256(json.dumps(normalize_object(obj)).encode()).hexdigest()
+
+
+def gen_cache_key(input_path, func, func_args=(), func_kwargs=None, checksum=False, **key_kwargs):
+    """Generates the content addressed key of a processing result
+
+    Args:
+        input_path (str): Input file
+        func (function): Function applied to the input
+        func_args (tuple, optional): Positional arguments of func. Defaults to ().
+        func_kwargs (dict, optional): Keyword arguments of func. Defaults to None.
+        checksum (bool, optional): If True the input is hashed by its content instead of its metadata. Defaults to False.
+        key_kwargs: Further quantities the result depends on, e.g. the version id
+
+    Returns:
+        str: Key of the result
+    """
+    func_kwargs = {} if func_kwargs is None else func_kwargs
+    return hash_object([hash_file(input_path, checksum=checksum), hash_func(func), func_args, func_kwargs, key_kwargs])
+
+
+class ResultCache():
+    """On-disk cache mapping content addressed keys to the output files of processing steps. Each entry is stored in its own json file so that
+    several processes can use the same cache. Entries are evicted by age and, least recently used first, by the total size of their outputs.
+    """
+
+    def __init__(self, cache_dir=default_cache_dir, max_size=None, max_age=None, checksum=False, delete_outputs=False):
+        """
+        Args:
+            cache_dir (str, optional): Directory of the cache entries. Defaults to default_cache_dir.
+            max_size (int, optional): Maximum total size of the cached outputs in bytes. Defaults to None.
+            max_age (float, optional): Maximum age of entries in seconds. Defaults to None.
+            checksum (bool, optional): If True inputs are hashed by their content instead of their metadata. Defaults to False.
+            delete_outputs (bool, optional): If True the output files of evicted entries are deleted as well. Defaults to False.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        self.checksum = checksum
+        self.delete_outputs = delete_outputs
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def gen_key(self, input_path, func, func_args=(), func_kwargs=None, **key_kwargs):
+        """Generates the key of a processing result, see gen_cache_key
+        """
+        return gen_cache_key(input_path, func, func_args, func_kwargs, checksum=self.checksum, **key_kwargs)
+
+    def get_entry_path(self, key):
+        """Returns the path of the json file of an entry
+        """
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def write_entry(self, key, entry):
+        """Atomically writes an entry
+        """
+        path = self.get_entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        path_tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(path_tmp, "w") as handle:
+            json.dump(entry, handle)
+        os.replace(path_tmp, path)
+
+    def load_entry(self, key):
+        """Loads an entry, returns None if it does not exist
+        """
+        try:
+            with open(self.get_entry_path(key), "r") as handle:
+                return json.load(handle)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get(self, key):
+        """Returns the output file of a cached result
+
+        Args:
+            key (str): Key of the result
+
+        Returns:
+            str: Output file or None if the result is not cached or its output does not exist anymore or was overwritten since it was cached
+        """
+        entry = self.load_entry(key)
+        if entry is None or not os.path.exists(entry["output"]):
+            return None
+        if self.max_age is not None and time.time() - entry["created"] > self.max_age:
+            return None
+        output_stat = os.stat(entry["output"])
+        if (entry.get("mtime_ns"), entry["size"]) != (output_stat.st_mtime_ns, output_stat.st_size):
+            logging.info("Result cache entry {} is stale, its output {} was overwritten".format(key, entry["output"]))
+            # the output belongs to another result now, so only the entry is removed
+            self.remove(key, entry, delete_output=False)
+            return None
+        entry["accessed"] = time.time()
+        self.write_entry(key, entry)
+        logging.info("Result cache hit {}: {}".format(key, entry["output"]))
+        return entry["output"]
+
+    def put(self, key, output_path, **entry_kwargs):
+        """Adds the output file of a result to the cache and evicts entries afterwards
+
+        Args:
+            key (str): Key of the result
+            output_path (str): Output file of the result
+            entry_kwargs: Further information stored in the entry
+        """
+        now = time.time()
+        output_stat = os.stat(output_path)
+        entry = dict(entry_kwargs, output=os.path.abspath(output_path), size=output_stat.st_size, mtime_ns=output_stat.st_mtime_ns, created=now, accessed=now)
+        self.write_entry(key, entry)
+        self.evict()
+
+    def list_entries(self):
+        """Lists all entries of the cache
+
+        Returns:
+            dict: Entries for each key
+        """
+        entries = {}
+        for subdir in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(path):
+                continue
+            for filename in os.listdir(path):
+                if filename.endswith(".json"):
+                    key = filename[:-len(".json")]
+                    entry = self.load_entry(key)
+                    if entry is not None:
+                        entries[key] = entry
+        return entries
+
+    def remove(self, key, entry=None, delete_output=True):
+        """Removes an entry from the cache and, if delete_outputs is set, its output file
+
+        Args:
+            key (str): Key of the result
+            entry (dict, optional): Entry of the key if already loaded. Defaults to None.
+            delete_output (bool, optional): If False the output file is kept even if delete_outputs is set. Defaults to True.
+        """
+        entry = self.load_entry(key) if entry is None else entry
+        if entry is not None and delete_output and self.delete_outputs and os.path.exists(entry["output"]):
+            os.remove(entry["output"])
+        if os.path.exists(self.get_entry_path(key)):
+            os.remove(self.get_entry_path(key))
+
+    def evict(self):
+        """Evicts entries which are older than max_age and the least recently used entries until the outputs are smaller than max_size
+        """
+        if self.max_age is None and self.max_size is None:
+            return
+        entries = self.list_entries()
+        now = time.time()
+        for key, entry in list(entries.items()):
+            if (self.max_age is not None and now - entry["created"] > self.max_age) or not os.path.exists(entry["output"]):
+                self.remove(key, entry)
+                del entries[key]
+
+        if self.max_size is None:
+            return
+        size = sum(entry["size"] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["accessed"]):
+            if size <= self.max_size:
+                break
+            self.remove(key, entry)
+            size = size - entry["size"]
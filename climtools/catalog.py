@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import logging
+import contextlib
+from . import cmor
+
+default_index_filename = ".cmor_index.sqlite"
+file_columns = ["path", "directory"] + cmor.cmor_path_facets + ["time_range", "time_start", "time_end"]
+
+
+def parse_cmor_file(root, path):
+    """Parses the facets of a file in a cmor directory tree from its relative path and its filename
+
+    Args:
+        root (str): Path to the parent folder where the CMIP-folder structure starts
+        path (str): Full path of the file
+
+    Returns:
+        dict: Facets and time range of the file or None if the file does not follow the cmor structure
+    """
+    directory, filename = os.path.split(path)
+    facets = cmor.parse_cmor_path(os.path.relpath(directory, root))
+    facets_filename = cmor.parse_cmor_filename(filename)
+    if facets is None or facets_filename is None:
+        return None
+
+    time_start, time_end = cmor.parse_time_range_string(facets_filename["time_range"])
+    facets.update(path = path, directory = directory, time_range = facets_filename["time_range"], time_start = time_start, time_end = time_end)
+    return facets
+
+
+class CmorIndex:
+    """Persistent SQLite index of the files of a cmor directory tree. The index maps the facets of the cmor path and the time range of the filename to the files.
+    Refreshing is incremental: directories whose modification time did not change are not listed again, only their known subdirectories are checked.
+    """
+
+    def __init__(self, root, index_path=None):
+        """
+        Args:
+            root (str): Path to the parent folder where the CMIP-folder structure starts
+            index_path (str, optional): Path of the SQLite database. Defaults to default_index_filename in root.
+        """
+        self.root = os.path.abspath(root)
+        self.index_path = os.path.join(self.root, default_index_filename) if index_path is None else index_path
+        with self.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, parent TEXT, mtime REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS files ({}, PRIMARY KEY (path))".format(", ".join(file_columns)))
+            connection.execute("CREATE INDEX IF NOT EXISTS files_facets ON files (variable_id, table_id, experiment_id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS files_directory ON files (directory)")
+            connection.execute("CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent)")
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Opens a connection to the SQLite database which commits the changes and is closed afterwards
+        """
+        connection = sqlite3.connect(self.index_path)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def refresh(self):
+        """Updates the index with the changes of the directory tree since the last refresh
+
+        Returns:
+            dict: Number of scanned and unchanged directories
+        """
+        time_start = time.perf_counter()
+        statistics = {"scanned": 0, "unchanged": 0}
+        with self.connect() as connection:
+            known = {path: (parent, mtime) for path, parent, mtime in connection.execute("SELECT path, parent, mtime FROM directories")}
+            children = {}
+            for path, (parent, mtime) in known.items():
+                children.setdefault(parent, []).append(path)
+
+            directories = [self.root]
+            while len(directories) > 0:
+                directory = directories.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except FileNotFoundError:
+                    self.remove_directory(connection, directory)
+                    continue
+
+                if directory in known and known[directory][1] == mtime:
+                    statistics["unchanged"] += 1
+                    directories.extend(children.get(directory, []))
+                    continue
+
+                statistics["scanned"] += 1
+                subdirectories = self.scan_directory(connection, directory)
+                for subdirectory in set(children.get(directory, [])) - set(subdirectories):
+                    self.remove_directory(connection, subdirectory)
+                parent = os.path.dirname(directory) if directory != self.root else None
+                connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?)", (directory, parent, mtime))
+                directories.extend(subdirectories)
+
+        logging.info("Refreshed cmor index {} in {:.3f}s: {}".format(self.index_path, time.perf_counter() - time_start, statistics))
+        return statistics
+
+    def scan_directory(self, connection, directory):
+        """Lists a directory and replaces the indexed files of this directory
+
+        Returns:
+            list: Subdirectories of the directory
+        """
+        subdirectories = []
+        rows = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                is_zarr = entry.name.endswith(".zarr")
+                if entry.is_dir() and not is_zarr:
+                    subdirectories.append(entry.path)
+                elif entry.path != self.index_path:
+                    facets = parse_cmor_file(self.root, entry.path)
+                    if facets is not None:
+                        rows.append(tuple(facets[column] for column in file_columns))
+
+        connection.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        connection.executemany("INSERT OR REPLACE INTO files VALUES ({})".format(", ".join("?"*len(file_columns))), rows)
+        return subdirectories
+
+    def remove_directory(self, connection, directory):
+        """Removes a directory, its subdirectories and their files from the index
+        """
+        pattern = os.path.join(directory.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"), "%")
+        connection.execute("DELETE FROM files WHERE directory = ? OR directory LIKE ? ESCAPE '\\'", (directory, pattern))
+        connection.execute("DELETE FROM directories WHERE path = ? OR path LIKE ? ESCAPE '\\'", (directory, pattern))
+
+    def query(self, period_start=None, period_end=None, **facets):
+        """Returns the files matching the given facets
+
+        Args:
+            period_start (str, optional): Only files whose time range ends after this time of the form YYYY[MM[DD]] are returned. Defaults to None.
+            period_end (str, optional): Only files whose time range starts before this time of the form YYYY[MM[DD]] are returned. Defaults to None.
+            facets: Values of the facets (e.g. variable_id="tas"), a list of values matches any of them
+
+        Returns:
+            list: Sorted full paths of the matching files, e.g. for xr.open_mfdataset
+        """
+        conditions = []
+        values = []
+        if period_start is not None:
+            conditions.append("time_end >= ?")
+            values.append(cmor.parse_time_string(period_start))
+        if period_end is not None:
+            conditions.append("time_start <= ?")
+            values.append(cmor.parse_time_string(period_end, end = True))
+        for facet, value in facets.items():
+            assert facet in file_columns, "Facet must be one of the following: {}".format(file_columns)
+            value = [value] if isinstance(value, str) else list(value)
+            conditions.append("{} IN ({})".format(facet, ", ".join("?"*len(value))))
+            values.extend(value)
+
+        statement = "SELECT path FROM files"
+        if len(conditions) > 0:
+            statement = statement + " WHERE " + " AND ".join(conditions)
+        with self.connect() as connection:
+            paths = [row[0] for row in connection.execute(statement + " ORDER BY path", values)]
+        return paths
+
+    def get_facet_values(self, facet):
+        """Returns the distinct values of a facet in the index
+
+        Args:
+            facet (str): Name of the facet
+
+        Returns:
+            list: Sorted values of the facet
+        """
+        assert facet in file_columns, "Facet must be one of the following: {}".format(file_columns)
+        with self.connect() as connection:
+            return [row[0] for row in connection.execute("SELECT DISTINCT {0} FROM files ORDER BY {0}".format(facet))]
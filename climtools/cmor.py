@@ -1,11 +1,20 @@
 
 from ast import If
+import xarray as xr
 import logging
 import os
+import re
 from . import temporal
+from . import writer
+from . import provenance
+from . import profiling
 
 necessary_cmor_attrs = ["mip_era","activity_id","institution_id", "model_id", "experiment_id","table_id","variable_id","grid_label","variant_label"]
 necessary_cmor_coords = []
+cmor_path_facets = ["mip_era", "activity_id", "institution_id", "model_id", "experiment_id", "variant_label", "table_id", "variable_id", "grid_label", "version_id"]
+cmor_filename_facets = ["variable_id", "table_id", "model_id", "experiment_id", "variant_label", "grid_label", "time_range"]
+cmor_extensions = (".nc", ".zarr")
+time_range_pattern = re.compile(r"^(\d{4}|\d{6}|\d{8})-(\d{4}|\d{6}|\d{8})$")
 
 
 def check_neccessary_cmor(data):
@@ -27,6 +36,7 @@ def check_neccessary_cmor(data):
     assert len(non_existent_attrs) == 0, "Attributes {} missing in data".format(non_existent_attrs)
     assert len(non_existent_coords)== 0, "Coordinates {} missing in data".format(non_existent_coords)
     
+@profiling.profiled
 def gen_cmor_path_and_filename(data, version_id):
     """ Generates a cmor compliant path and filename for a given dataset. Data must have the neccessary attributes
 
@@ -36,6 +46,7 @@ def gen_cmor_path_and_filename(data, version_id):
 
     Returns: A tuple (path, file) where path is the relative path and file the cmor filename.
     """
+    data = provenance.render(data)
     check_neccessary_cmor(data)
     
     mip_era = data.mip_era
@@ -107,19 +118,27 @@ def gen_cmor_full_filename(mip_era, activity_id, institution_id, model_id, exper
     return full_filename
 
 
-def cmor_save(data, parent_directory):
-    """ Save a dataarray or dataset in conform with cmor regulations under the parent directory
+@profiling.profiled
+def cmor_save(data, parent_directory, version_id, encoding_preset = None, engine = "netcdf", compute = True):
+    """ Save a dataarray or dataset in conform with cmor regulations under the parent directory. The recorded processing steps are rendered into history and table_id.
 
     Args:
         data (xarray.DataArray or xarray.Dataset): Data to be saved
         parent_directory (string): Path to the parent folder where the CMIP-folder structure starts 
-    """
+        version_id (str): String indicating the version id used for this dataset
+        encoding_preset (str or dict, optional): Encoding preset of writer.encoding_presets. Defaults to None.
+        engine (str, optional): "netcdf" or "zarr". Defaults to "netcdf".
+        compute (bool, optional): If False a dask.delayed write is returned. Defaults to True.
 
-    cmor_path, cmor_file = gen_cmor_path_and_filename(data)
+    Returns:
+        str or dask.delayed.Delayed: Full filename or delayed write
+    """
+    data = provenance.render(data)
+    cmor_path, cmor_file = gen_cmor_path_and_filename(data, version_id = version_id)
     comp_path = os.path.join(parent_directory, cmor_path)
     
     os.makedirs(comp_path, exist_ok=True)
-    data.to_netcdf(os.path.join(comp_path, cmor_file))
+    return writer.save_dataset(data, os.path.join(comp_path, writer.set_extension(cmor_file, engine)), preset = encoding_preset, engine = engine, compute = compute)
 
     
 def update_process_id(data, process_string):
@@ -162,9 +181,13 @@ def get_time_string(time, temporal_resolution):
         return year+month+day
     if temporal_resolution == "multiyear":
         return year
+    if temporal_resolution.startswith("season"):
+        return year+month
 
+@profiling.profiled
 def get_time_range_string(data):
-    """Returns a time_range string for a given dataset
+    """Returns a time_range string for a given dataset. The temporal resolution is taken from the cache of temporal.get_temporal_resolution
+    or the CMIP frequency attribute and only detected from time_bnds if neither is available. Only the first and last timestamp are read from the time index.
 
     Args:
         data (xarray.Dataset or xarray.DataArray): Dataset for which the time_range string will be created.
@@ -172,13 +195,159 @@ def get_time_range_string(data):
     Returns:
         str: time_range string 
     """
-    temporal_resolution = temporal.get_temporal_resolution(data)
+    temporal_resolution = temporal.get_cached_temporal_resolution(data)
+    if temporal_resolution is None:
+        temporal_resolution = temporal.get_frequency_temporal_resolution(data)
+    if temporal_resolution is None:
+        temporal_resolution = temporal.get_temporal_resolution(data)
     
-    time_min = data.time.isel(time=0).item()
-    time_max = data.time.isel(time=-1).item()
+    time_index = data.indexes["time"]
+    time_min = time_index[0]
+    time_max = time_index[-1]
     
     time_min_string = get_time_string(time_min, temporal_resolution)
     time_max_string = get_time_string(time_max, temporal_resolution)
     
     return "-".join([time_min_string, time_max_string])
     
+
+
+def parse_cmor_path(cmor_path):
+    """Parses the facets of a relative cmor path as generated by gen_cmor_path
+
+    Args:
+        cmor_path (str): Relative cmor path
+
+    Returns:
+        dict: Facets of the path or None if the path does not follow the cmor structure
+    """
+    parts = os.path.normpath(cmor_path).split(os.sep)
+    if len(parts) != len(cmor_path_facets):
+        return None
+    return dict(zip(cmor_path_facets, parts))
+
+
+def parse_cmor_filename(filename):
+    """Parses the facets of a cmor filename as generated by gen_cmor_filename. Since processed table ids can contain underscores the facets after the table id
+    are parsed from the end of the filename. Files without time range (e.g. fixed fields) are supported as well.
+
+    Args:
+        filename (str): cmor filename
+
+    Returns:
+        dict: Facets of the filename or None if the filename does not follow the cmor structure
+    """
+    name, extension = os.path.splitext(os.path.basename(filename))
+    if extension not in cmor_extensions:
+        return None
+
+    parts = name.split("_")
+    time_range = None
+    if time_range_pattern.match(parts[-1]):
+        time_range = parts.pop()
+    if len(parts) < 6:
+        return None
+
+    facets = dict(zip(["model_id", "experiment_id", "variant_label", "grid_label"], parts[-4:]))
+    facets.update(variable_id = parts[0], table_id = "_".join(parts[1:-4]), time_range = time_range)
+    return facets
+
+
+def parse_time_range_string(time_range_string):
+    """Parses a time_range string as generated by get_time_range_string into integers of the form YYYYMMDD. Missing months and days are
+    filled with the beginning of the period for the start and with the end of the period for the end, so that the integers can be compared.
+
+    Args:
+        time_range_string (str): time_range string e.g. 185001-190012
+
+    Returns:
+        tuple: Start and end of the time range or (None, None) if the string is None
+    """
+    if time_range_string is None:
+        return None, None
+    match = time_range_pattern.match(time_range_string)
+    assert match is not None, "Time range string {} must have the form YYYY[MM[DD]]-YYYY[MM[DD]]".format(time_range_string)
+
+    time_start, time_end = match.groups()
+    return parse_time_string(time_start), parse_time_string(time_end, end = True)
+
+
+def parse_time_string(time_string, end = False):
+    """Parses a time string of the form YYYY[MM[DD]] as generated by get_time_string into an integer of the form YYYYMMDD
+
+    Args:
+        time_string (str): Time string
+        end (bool, optional): If True missing months and days are filled with the end of the period instead of its beginning. Defaults to False.
+
+    Returns:
+        int: Time as YYYYMMDD
+    """
+    time_string = str(time_string)
+    assert time_string.isdigit() and len(time_string) in [4, 6, 8], "Time string {} must have the form YYYY[MM[DD]]".format(time_string)
+    fill = "1231" if end else "0101"
+    return int(time_string + fill[len(time_string) - 4:])
+
+
+def select_files_in_period(files, period_start = None, period_end = None):
+    """Selects the cmor files whose time range overlaps a period. Files without time range in their filename are not selected.
+
+    Args:
+        files (list): cmor files
+        period_start (str, optional): Start of the period of the form YYYY[MM[DD]], None for an open start. Defaults to None.
+        period_end (str, optional): End of the period of the form YYYY[MM[DD]], None for an open end. Defaults to None.
+
+    Returns:
+        list: Selected files sorted by the start of their time range
+    """
+    period_start = -1 if period_start is None else parse_time_string(period_start)
+    period_end = 10**9 if period_end is None else parse_time_string(period_end, end = True)
+
+    selected_files = []
+    for filename in files:
+        facets = parse_cmor_filename(filename)
+        if facets is None or facets["time_range"] is None:
+            logging.info("Skipping {} without time range".format(filename))
+            continue
+        time_start, time_end = parse_time_range_string(facets["time_range"])
+        if time_start <= period_end and time_end >= period_start:
+            selected_files.append((time_start, filename))
+    return [filename for time_start, filename in sorted(selected_files)]
+
+
+def format_time_string(time_string):
+    """Converts a time string of the form YYYY[MM[DD]] into the partial date string YYYY[-MM[-DD]] used for selections with xarray
+
+    Args:
+        time_string (str): Time string
+
+    Returns:
+        str: Partial date string
+    """
+    time_string = str(time_string)
+    return "-".join([time_string[:4]] + [time_string[i:i+2] for i in range(4, len(time_string), 2)])
+
+
+@profiling.profiled
+def open_cmor_period(files, period_start = None, period_end = None, chunks = None, parallel = True):
+    """Lazily opens only the cmor files overlapping a period and concatenates them along time. Coordinates other than time are taken from the first file
+    without comparing them between the files, so all files must be on the same grid.
+
+    Args:
+        files (list): cmor files of one variable, e.g. from catalog.CmorIndex.query
+        period_start (str, optional): Start of the period of the form YYYY[MM[DD]]. Defaults to None.
+        period_end (str, optional): End of the period of the form YYYY[MM[DD]]. Defaults to None.
+        chunks (dict, optional): Chunks used for every file. Defaults to None, which uses one chunk per variable and file.
+        parallel (bool, optional): Open the files in parallel with dask.delayed. Defaults to True.
+
+    Returns:
+        xarray.Dataset: Dataset restricted to the period
+    """
+    selected_files = select_files_in_period(files, period_start, period_end)
+    assert len(selected_files) > 0, "No file overlaps the period {} - {}".format(period_start, period_end)
+    logging.info("Opening {} of {} files".format(len(selected_files), len(files)))
+
+    data = xr.open_mfdataset(selected_files, combine = "nested", concat_dim = "time", data_vars = "minimal", coords = "minimal", compat = "override",
+                             join = "override", combine_attrs = "override", chunks = {} if chunks is None else chunks, parallel = parallel, use_cftime = True)
+
+    time_slice = slice(None if period_start is None else format_time_string(period_start), None if period_end is None else format_time_string(period_end))
+    return data.sel(time = time_slice)
@@ -1,31 +1,567 @@
 import xarray as xr
 import numpy as np
+import pandas as pd
 import os
+import json
 import pickle
+import time
+import socket
+import logging
+import contextlib
+from . import utils
+
+store_format_version = 1
+default_lock_timeout = 60
+default_lock_stale_age = 3600
+
+def encode_coordinate_values(values):
+    """Converts coordinate values to an array which can be stored without pickling if possible
+
+    Args:
+        values (array-like): Coordinate values
+
+    Returns:
+        np.array: Values as unicode array if all values are strings, otherwise unchanged
+    """
+    values = np.asarray(values)
+    if values.dtype == object and all(isinstance(value, str) for value in values.ravel()):
+        values = values.astype(str)
+    return values
+
+
+def decode_coordinate_values(values):
+    """Converts stored coordinate values back to the representation used by pandas indexes
+
+    Args:
+        values (np.array): Stored coordinate values
+
+    Returns:
+        np.array: Values, unicode arrays are converted to object arrays
+    """
+    if values.dtype.kind == "U":
+        values = values.astype(object)
+    return values
+
+
+def gen_coordinate_sidecar(data):
+    """Generates a compact description of all coordinates of a DataArray. Pandas MultiIndexes are stored as levels and codes instead of their expanded tuples.
+
+    Args:
+        data (xr.DataArray): DataArray whose coordinates are described
+
+    Returns:
+        dict: Json serializable metadata for each coordinate
+        dict: Arrays which belong to the coordinates
+    """
+    metadata = {}
+    arrays = {}
+    for name, coord in data.coords.items():
+        if name in data.dims:
+            index = data.indexes[name]
+            if isinstance(index, pd.MultiIndex):
+                metadata[name] = {"type": "multiindex", "dims": [name], "names": list(index.names)}
+                for i_level, (level, codes) in enumerate(zip(index.levels, index.codes)):
+                    arrays["{}__level_{}".format(name, i_level)] = encode_coordinate_values(level.values)
+                    arrays["{}__codes_{}".format(name, i_level)] = np.asarray(codes)
+                continue
+            metadata[name] = {"type": "index", "dims": [name]}
+        else:
+            metadata[name] = {"type": "coordinate", "dims": list(coord.dims)}
+        arrays["{}__values".format(name)] = encode_coordinate_values(coord.values)
+    return metadata, arrays
+
+
+def load_coordinate_sidecar(metadata, arrays):
+    """Rebuilds coordinates from the description generated by gen_coordinate_sidecar
+
+    Args:
+        metadata (dict): Metadata for each coordinate
+        arrays (dict-like): Arrays which belong to the coordinates
+
+    Returns:
+        dict: Coordinates which can be passed to the DataArray constructor
+    """
+    coords = {}
+    for name, coord_metadata in metadata.items():
+        if coord_metadata["type"] == "multiindex":
+            n_level = len(coord_metadata["names"])
+            levels = [decode_coordinate_values(arrays["{}__level_{}".format(name, i_level)]) for i_level in range(n_level)]
+            codes = [arrays["{}__codes_{}".format(name, i_level)] for i_level in range(n_level)]
+            coords[name] = pd.MultiIndex(levels = levels, codes = codes, names = coord_metadata["names"])
+        else:
+            coords[name] = (coord_metadata["dims"], decode_coordinate_values(arrays["{}__values".format(name)]))
+    return coords
+
+
+def write_values(values, target):
+    """Writes values into a (memory mapped) target array. Dask arrays are stored chunk by chunk.
+
+    Args:
+        values (np.array or dask.array): Values to write
+        target (np.array): Target array with the same shape
+    """
+    if utils.is_dask_array(values):
+        import dask.array as da
+        da.store(values, target, lock = False)
+    elif target.size > 0:
+        target[...] = values
+
+
+def write_array(data, path):
+    """Writes the values of a DataArray into a npy file without loading dask arrays into memory at once
+
+    Args:
+        data (xr.DataArray): DataArray to write
+        path (str): Path of the npy file
+    """
+    target = np.lib.format.open_memmap(path, mode = "w+", dtype = data.dtype, shape = data.shape)
+    write_values(data.data, target)
+    target.flush()
+    del target
+
+
+def read_lock(lock_path):
+    """Reads the owner of a lock file
+
+    Args:
+        lock_path (str): Path of the lock file
+
+    Returns:
+        dict: Process id, host and creation time of the lock or None if the lock file does not exist or is incomplete
+    """
+    try:
+        with open(lock_path, "r") as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def is_lock_stale(lock_path, owner, stale_age = default_lock_stale_age):
+    """Checks if a lock was left behind by a crashed process. A lock is stale if it is older than stale_age or if it was created on this host
+    by a process which does not exist anymore.
+
+    Args:
+        lock_path (str): Path of the lock file
+        owner (dict): Owner of the lock (see read_lock) or None if it is unknown
+        stale_age (float, optional): Seconds after which a lock is considered stale. Defaults to default_lock_stale_age.
+
+    Returns:
+        bool: True if the lock can be reclaimed
+    """
+    try:
+        created = owner["time"] if owner is not None else os.path.getmtime(lock_path)
+    except FileNotFoundError:
+        return False
+    if time.time() - created > stale_age:
+        return True
+    if owner is None or owner["host"] != socket.gethostname() or os.name != "posix":
+        return False
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def reclaim_lock(lock_path, owner):
+    """Removes a stale lock. The lock file is first moved away and only removed if it still belongs to the stale owner,
+    so that a lock acquired by another process in the meantime is put back.
+
+    Args:
+        lock_path (str): Path of the lock file
+        owner (dict): Owner of the stale lock (see read_lock)
+    """
+    stale_path = "{}.{}.stale".format(lock_path, os.getpid())
+    try:
+        os.rename(lock_path, stale_path)
+    except FileNotFoundError:
+        return
+    if read_lock(stale_path) != owner:
+        os.rename(stale_path, lock_path)
+        return
+    logging.warning("Reclaimed stale lock {} of {}".format(lock_path, owner))
+    os.remove(stale_path)
+
+
+@contextlib.contextmanager
+def lock_store(folder, timeout = default_lock_timeout, poll_interval = 0.05, stale_age = default_lock_stale_age):
+    """Acquires an exclusive lock on a multiindex store by creating a lock file. Used to serialize changes of the store metadata between processes.
+    The lock file records the process id, host and creation time of its owner, so that locks of crashed processes are reclaimed (see is_lock_stale).
+
+    Args:
+        folder (str): Folder of the store
+        timeout (float, optional): Seconds after which acquiring the lock is given up. Defaults to default_lock_timeout.
+        poll_interval (float, optional): Seconds between attempts to acquire the lock. Defaults to 0.05.
+        stale_age (float, optional): Seconds after which a lock is reclaimed even if its owner may still exist. Defaults to default_lock_stale_age.
+    """
+    lock_path = os.path.join(folder, "store.lock")
+    time_start = time.monotonic()
+    while True:
+        try:
+            handle = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            owner = read_lock(lock_path)
+            if is_lock_stale(lock_path, owner, stale_age):
+                reclaim_lock(lock_path, owner)
+                continue
+            if time.monotonic() - time_start > timeout:
+                raise TimeoutError("Could not acquire lock {} held by {}".format(lock_path, owner))
+            time.sleep(poll_interval)
+    try:
+        os.write(handle, json.dumps({"pid": os.getpid(), "host": socket.gethostname(), "time": time.time()}).encode())
+        os.close(handle)
+        yield
+    finally:
+        os.remove(lock_path)
+
+
+def write_metadata(folder, metadata):
+    """Atomically replaces the metadata of a multiindex store so that readers either see the previous or the new state
+
+    Args:
+        folder (str): Folder of the store
+        metadata (dict): Metadata of the store
+    """
+    path_tmp = os.path.join(folder, "metadata.json.{}.tmp".format(os.getpid()))
+    with open(path_tmp, "w") as handle:
+        json.dump(metadata, handle)
+    os.replace(path_tmp, os.path.join(folder, "metadata.json"))
+
+
+def write_coordinates(coords, folder, filename):
+    """Writes the coordinate sidecar of a multiindex store
+
+    Args:
+        coords (xr.DataArray or xr.Dataset): Object whose coordinates are written
+        folder (str): Folder of the store
+        filename (str): Name of the sidecar file
+
+    Returns:
+        dict: Metadata of the coordinates
+    """
+    coords_metadata, coords_arrays = gen_coordinate_sidecar(coords)
+    with open(os.path.join(folder, filename), "wb") as handle:
+        np.savez(handle, **coords_arrays)
+    return coords_metadata
+
+
+def get_store_files(metadata):
+    """Returns the files of a multiindex store which are referenced by its metadata
+
+    Args:
+        metadata (dict): Metadata of the store
+
+    Returns:
+        list: Names of the data and coordinate files
+    """
+    return [part["file"] for part in get_parts(metadata)] + [get_coordinates_file(metadata)]
+
+
+def get_parts(metadata):
+    """Returns the data files of a multiindex store. Stores which were not appended to consist of a single part.
+
+    Args:
+        metadata (dict): Metadata of the store
+
+    Returns:
+        list: Dictionaries with file name and shape of each part
+    """
+    return metadata.get("parts", [{"file": "data.npy", "shape": metadata["shape"]}])
+
+
+def get_coordinates_file(metadata):
+    """Returns the name of the current coordinate sidecar of a multiindex store
+
+    Args:
+        metadata (dict): Metadata of the store
+
+    Returns:
+        str: Name of the coordinate sidecar
+    """
+    return metadata.get("coordinates", "coordinates.npz")
+
+
+def remove_obsolete_files(folder, metadata):
+    """Removes the files of a multiindex store which were superseded by the previous write. Superseded files are only removed by the next locked write,
+    so that readers which loaded the metadata before the previous write can still read them.
+
+    Args:
+        folder (str): Folder of the store
+        metadata (dict): Metadata of the store, the list of obsolete files is emptied
+    """
+    for filename in metadata.pop("obsolete", []):
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_store(folder, coords, dims, shape, dtype, name = None, data = None):
+    """Writes a complete multiindex store. Files of a previous store in the folder which are not referenced anymore are removed afterwards.
+
+    Args:
+        folder (str): Folder of the store
+        coords (xr.DataArray or xr.Dataset): Object holding the coordinates of the store
+        dims (list): Dimensions of the values
+        shape (tuple): Shape of the values
+        dtype (np.dtype): Data type of the values
+        name (str, optional): Name of the DataArray. Defaults to None.
+        data (xr.DataArray, optional): Values to write, if None the values are only allocated. Defaults to None.
+    """
+    metadata_path = os.path.join(folder, "metadata.json")
+    files_previous = []
+    if os.path.exists(metadata_path):
+        metadata_previous = load_metadata(folder)
+        files_previous = get_store_files(metadata_previous) + metadata_previous.get("obsolete", [])
+        os.remove(metadata_path)
+
+    if data is None:
+        target = np.lib.format.open_memmap(os.path.join(folder, "data.npy"), mode = "w+", dtype = dtype, shape = tuple(shape))
+        del target
+    else:
+        write_array(data, os.path.join(folder, "data.npy"))
+    coords_metadata = write_coordinates(coords, folder, "coordinates.npz")
+
+    metadata = {"version": store_format_version, "name": name, "dims": list(dims), "shape": list(shape), "dtype": np.dtype(dtype).str, "coords": coords_metadata,
+                "append_dim": None, "parts": [{"file": "data.npy", "shape": list(shape)}], "coordinates": "coordinates.npz"}
+    write_metadata(folder, metadata)
+
+    for filename in set(files_previous) - set(get_store_files(metadata)):
+        os.remove(os.path.join(folder, filename))
+
 
 def xarray_save_multiindex(data, folder):
+    """Saves a DataArray with (multi)index coordinates into a folder. The values are written into a npy file which can be memory mapped on loading and the coordinates into a compact sidecar.
+    The metadata file is written last and marks the store as complete.
+
+    Args:
+        data (xr.DataArray): DataArray to save
+        folder (str): Folder of the store
+    """
     os.makedirs(folder, exist_ok=True)
 
-    dict_coords = {}
-    for dim in data.dims:
-        coords = data[dim].coords.to_dataset()[dim]
-        dict_coords[dim] = coords
-    
-    np.save(os.path.join(folder, "data.npy"), data.values)
-    with open(os.path.join(folder,'coordinates.pickle'), 'wb') as handle:
-        pickle.dump(dict_coords, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    with lock_store(folder):
+        write_store(folder, data, data.dims, data.shape, data.dtype, name = data.name, data = data)
+
+
+def xarray_append_multiindex(data, folder, dim):
+    """Appends slices along a dimension to a multiindex store. The values are written into a new part file so that existing data on disk is left untouched,
+    the coordinate sidecar is written to a new file and switched to together with the metadata in one atomic replace. If the store does not exist yet it is created.
+    The previous coordinate sidecar is kept for readers of the previous metadata and only removed by the next locked write.
+
+    Args:
+        data (xr.DataArray): DataArray to append, all dimensions except dim have to match the store
+        folder (str): Folder of the store
+        dim (str): Dimension along which data is appended
+    """
+    os.makedirs(folder, exist_ok=True)
+
+    with lock_store(folder):
+        if not os.path.exists(os.path.join(folder, "metadata.json")):
+            write_store(folder, data, data.dims, data.shape, data.dtype, name = data.name, data = data)
+            return
+
+        metadata = load_metadata(folder)
+        remove_obsolete_files(folder, metadata)
+        dims = metadata["dims"]
+        assert list(data.dims) == dims, "Dimensions {} do not match the store dimensions {}".format(data.dims, dims)
+        assert metadata.get("append_dim") in [None, dim], "Store was appended along {}".format(metadata["append_dim"])
+        assert np.dtype(metadata["dtype"]) == data.dtype, "Data type {} does not match the store data type {}".format(data.dtype, metadata["dtype"])
+
+        axis = dims.index(dim)
+        shape = list(metadata["shape"])
+        assert [size for i, size in enumerate(data.shape) if i != axis] == [size for i, size in enumerate(shape) if i != axis], "Shape {} does not match the store shape {}".format(data.shape, shape)
+
+        coords_stored = xr.Dataset(coords = load_sidecar(folder, metadata))
+        coords = xr.concat([coords_stored, xr.Dataset(coords = data.coords)], dim = dim, coords = "minimal", compat = "override")
+
+        parts = get_parts(metadata)
+        coordinates_file_previous = get_coordinates_file(metadata)
+        part_file = "data_{}.npy".format(len(parts))
+        coordinates_file = "coordinates_{}.npz".format(len(parts))
+
+        write_array(data, os.path.join(folder, part_file))
+        coords_metadata = write_coordinates(coords, folder, coordinates_file)
+
+        shape[axis] = shape[axis] + data.shape[axis]
+        metadata.update({"shape": shape, "coords": coords_metadata, "append_dim": dim, "parts": parts + [{"file": part_file, "shape": list(data.shape)}], "coordinates": coordinates_file,
+                         "obsolete": [coordinates_file_previous]})
+        write_metadata(folder, metadata)
+
+
+def xarray_allocate_multiindex(coords, dims, folder, dtype = np.float64, name = None):
+    """Pre-allocates a multiindex store whose values can afterwards be filled region by region with xarray_write_region_multiindex, e.g. by parallel worker processes
+
+    Args:
+        coords (dict): Coordinates of the store, every dimension needs a coordinate
+        dims (list): Dimensions of the store
+        folder (str): Folder of the store
+        dtype (np.dtype, optional): Data type of the values. Defaults to np.float64.
+        name (str, optional): Name of the DataArray. Defaults to None.
+    """
+    os.makedirs(folder, exist_ok=True)
+
+    coords = xr.Dataset(coords = coords)
+    assert all(dim in coords.dims for dim in dims), "Every dimension of {} needs a coordinate".format(dims)
+    shape = [coords.dims[dim] for dim in dims]
+
+    with lock_store(folder):
+        write_store(folder, coords, dims, shape, dtype, name = name)
+
+
+def xarray_write_region_multiindex(data, folder, region, timeout = default_lock_timeout):
+    """Writes data into a region of an existing multiindex store. Each write only touches the bytes of its region in the memory mapped files,
+    so that several processes can fill disjoint regions of a pre-allocated store. The store is locked during the write so that the metadata and parts
+    cannot be replaced by a concurrent save or append.
+
+    Args:
+        data (xr.DataArray): Values of the region
+        folder (str): Folder of the store
+        region (dict): Slices along the dimensions of the store, dimensions which are not given are written completely
+        timeout (float, optional): Seconds after which acquiring the lock of the store is given up. Defaults to default_lock_timeout.
+    """
+    with lock_store(folder, timeout = timeout):
+        write_region(data, folder, region)
+
 
+def write_region(data, folder, region):
+    """Writes data into a region of an existing multiindex store without locking it (see xarray_write_region_multiindex)
 
-def xarray_load_multiindex(folder):
-    dict_coords = load_coordinates(folder)
-    data = np.load(os.path.join(folder,"data.npy"))
-    
-    data = xr.DataArray(data, dims = list(dict_coords.keys()), coords = dict_coords)
+    Args:
+        data (xr.DataArray): Values of the region
+        folder (str): Folder of the store
+        region (dict): Slices along the dimensions of the store, dimensions which are not given are written completely
+    """
+    metadata = load_metadata(folder)
+    dims = metadata["dims"]
+    shape = metadata["shape"]
+    values = data.transpose(*dims).data
+
+    region = [region.get(dim, slice(None)).indices(size) for dim, size in zip(dims, shape)]
+    assert all(step == 1 for start, stop, step in region), "Only contiguous regions can be written"
+    assert tuple(stop - start for start, stop, step in region) == values.shape, "Shape {} does not match the region {}".format(values.shape, region)
+
+    append_dim = metadata.get("append_dim")
+    axis = dims.index(append_dim) if append_dim is not None else 0
+
+    offset = 0
+    for part in get_parts(metadata):
+        size = part["shape"][axis]
+        start = max(region[axis][0], offset)
+        stop = min(region[axis][1], offset + size)
+        if start < stop:
+            target_region = [slice(start_region, stop_region) for start_region, stop_region, step in region]
+            values_region = [slice(None)] * len(dims)
+            target_region[axis] = slice(start - offset, stop - offset)
+            values_region[axis] = slice(start - region[axis][0], stop - region[axis][0])
+
+            target = np.load(os.path.join(folder, part["file"]), mmap_mode = "r+")
+            write_values(values[tuple(values_region)], target[tuple(target_region)])
+            target.flush()
+            del target
+        offset = offset + size
+
+
+def load_values(folder, metadata):
+    """Memory maps the values of a multiindex store. Stores consisting of several parts are concatenated lazily with dask if it is available.
+
+    Args:
+        folder (str): Folder of the store
+        metadata (dict): Metadata of the store
+
+    Returns:
+        np.array or dask.array: Values of the store
+    """
+    parts = [np.load(os.path.join(folder, part["file"]), mmap_mode = "r") for part in get_parts(metadata)]
+    if len(parts) == 1:
+        return parts[0]
+
+    axis = metadata["dims"].index(metadata["append_dim"])
+    try:
+        import dask.array as da
+    except ImportError:
+        return np.concatenate(parts, axis = axis)
+    return da.concatenate([da.from_array(part, chunks = part.shape) for part in parts], axis = axis)
+
+
+def xarray_load_multiindex(folder, chunks = None):
+    """Loads a DataArray saved with xarray_save_multiindex. The values are memory mapped so that selections only read the matching bytes from disk.
+
+    Args:
+        folder (str): Folder of the store
+        chunks (dict, optional): If given the memory mapped values are wrapped into a dask array with these chunks. Defaults to None.
+
+    Returns:
+        xr.DataArray: DataArray backed by the memory mapped values
+    """
+    if os.path.exists(os.path.join(folder, "metadata.json")):
+        metadata = load_metadata(folder)
+        data = load_values(folder, metadata)
+        dims = metadata["dims"]
+        name = metadata["name"]
+        dict_coords = load_sidecar(folder, metadata)
+    else:
+        data = np.load(os.path.join(folder,"data.npy"), mmap_mode = "r")
+        dict_coords = load_coordinates(folder)
+        dims = list(dict_coords.keys())
+        name = None
+
+    data = xr.DataArray(data, dims = dims, coords = dict_coords)
+    # Set the name afterwards since xarray takes the name of dask arrays otherwise
+    data.name = name
+
+    if chunks is not None:
+        data = data.chunk(chunks)
 
     return data
 
+
+def load_metadata(folder):
+    """Loads the metadata of a multiindex store
+
+    Args:
+        folder (str): Folder of the store
+
+    Returns:
+        dict: Metadata of the store
+    """
+    with open(os.path.join(folder, "metadata.json"), "r") as handle:
+        metadata = json.load(handle)
+    return metadata
+
+
+def load_sidecar(folder, metadata):
+    """Loads the coordinate sidecar of a multiindex store
+
+    Args:
+        folder (str): Folder of the store
+        metadata (dict): Metadata of the store
+
+    Returns:
+        dict: Coordinates which can be passed to the DataArray constructor
+    """
+    with np.load(os.path.join(folder, get_coordinates_file(metadata)), allow_pickle = True) as arrays:
+        coords = load_coordinate_sidecar(metadata["coords"], arrays)
+    return coords
+
+
 def load_coordinates(folder):
-    with open(os.path.join(folder,'coordinates.pickle'), 'rb') as handle:
-        dict_coords = pickle.load(handle)
-    return dict_coords
+    """Loads the coordinates of a multiindex store. Stores written with the former pickle format are supported as well.
 
+    Args:
+        folder (str): Folder of the store
+
+    Returns:
+        dict: Coordinates for each dimension
+    """
+    if not os.path.exists(os.path.join(folder, "metadata.json")):
+        with open(os.path.join(folder,'coordinates.pickle'), 'rb') as handle:
+            dict_coords = pickle.load(handle)
+        return dict_coords
+
+    metadata = load_metadata(folder)
+    coords = xr.Dataset(coords = load_sidecar(folder, metadata))
+    dict_coords = {dim: coords[dim] for dim in metadata["dims"] if dim in coords.coords}
+    return dict_coords
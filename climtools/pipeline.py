@@ -0,0 +1,242 @@
+import xarray as xr
+xr.set_options(keep_attrs = True)
+import time
+import logging
+from collections import namedtuple
+from . import provenance
+from . import temporal
+from . import spatial
+from . import stat
+
+Step = namedtuple("Step", ["name", "kind", "dims", "kwargs"])
+Step.__doc__ = """Deferred processing step of a pipeline. kind is one of "temporal", "spatial" or "reduction" and dims are the dimensions the step operates on."""
+
+
+def split_variables(variables, dims):
+    """Splits a dictionary of variables into the variables depending on all given dimensions and the remaining ones
+
+    Args:
+        variables (dict): DataArrays of the variables
+        dims (tuple): Dimensions
+
+    Returns:
+        list: Names of the dependent variables
+        list: Names of the independent variables
+    """
+    dependent = [name for name, variable in variables.items() if set(dims).issubset(variable.dims)]
+    independent = [name for name in variables if name not in dependent]
+    return dependent, independent
+
+
+def run_temporal_downsampling(variables, target_resolution, max_chunk_bytes=temporal.default_max_chunk_bytes):
+    """Downsamples the time dependent variables in place, see temporal.temporal_downsampling. Returns the processing message and id of the step
+    """
+    data = xr.Dataset({name: variables[name] for name in split_variables(variables, ("time",))[0]})
+    temporal_resolution = temporal.get_temporal_resolution(data)
+    data_result, time_bnds = temporal.downsample_variables(data, list(data.data_vars), temporal_resolution, target_resolution, max_chunk_bytes = max_chunk_bytes)
+
+    for name in data.data_vars:
+        del variables[name]
+    variables.update(data_result.data_vars)
+    variables["time_bnds"] = time_bnds
+
+    processing_message = "Temporal downsampling from {} to {}".format(temporal.temporal_resolution_dict[temporal_resolution], temporal.temporal_resolution_dict[target_resolution])
+    return processing_message, temporal.temporal_resolution_dict[target_resolution]
+
+
+def run_anomaly(variables, dimensions):
+    """Replaces the dependent variables by their anomaly in place, see stat.cal_anomaly_dim. Returns the processing message and id of the step
+    """
+    dependent = [name for name in split_variables(variables, dimensions)[0] if name != "time_bnds"]
+    for name in dependent:
+        variables[name] = variables[name] - variables[name].mean(dim=dimensions)
+
+    dimension_name_string = "-".join(dimensions)
+    return "Calculated {} anomaly".format(dimension_name_string), "_".join([dimension_name_string, "anomaly"])
+
+
+def run_apply_mask(variables, mask, drop=False):
+    """Masks the dependent variables in place, with drop all variables are subset to the bounding region of the mask, see spatial.apply_mask. Returns the processing message and id of the step
+    """
+    if drop:
+        compact_mask = spatial.compress_mask(mask)
+        for name, variable in variables.items():
+            variables[name] = variable.isel({dim: indexer for dim, indexer in compact_mask.indexers.items() if dim in variable.dims})
+        mask = mask.isel(compact_mask.indexers)
+        if compact_mask.bits is None:
+            return "Applied mask", "masked"
+
+    for name in split_variables(variables, mask.dims)[0]:
+        variables[name] = variables[name].where(mask)
+    return "Applied mask", "masked"
+
+
+def run_lonlatbox(variables, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim="lat", longitude_dim="lon", drop=False):
+    """Masks the dependent variables in place with a longitude and latitude box. Returns the processing message and id of the step
+    """
+    coords = xr.Dataset(coords = {latitude_dim: variables_coord(variables, latitude_dim), longitude_dim: variables_coord(variables, longitude_dim)})
+    mask = spatial.gen_lonlatbox_mask(coords, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim = latitude_dim, longitude_dim = longitude_dim)
+    return run_apply_mask(variables, mask, drop = drop)
+
+
+def variables_coord(variables, dim):
+    """Returns the coordinate of a dimension from the first variable that has it
+
+    Args:
+        variables (dict): DataArrays of the variables
+        dim (str): Name of the dimension
+
+    Returns:
+        xarray.DataArray: Coordinate of the dimension
+    """
+    for variable in variables.values():
+        if dim in variable.dims:
+            return variable[dim]
+    raise KeyError("No variable has the dimension {}".format(dim))
+
+
+def run_weighted_mean(variables, reducer):
+    """Replaces the dependent variables by their weighted mean in place, see stat.cal_weighted_mean. Returns the processing message and id of the step
+    """
+    dependent = split_variables(variables, reducer.dims)[0]
+    result = reducer.mean(xr.Dataset({name: variables[name] for name in dependent}))
+    variables.update(result.data_vars)
+
+    dimension_name_string = "-".join(reducer.dims)
+    return "Calculated {} weighted mean over dimensions {}".format(reducer.name, dimension_name_string), "_".join([reducer.name, "weightedmean", dimension_name_string])
+
+
+def run_weighted_anom(variables, reducer):
+    """Replaces the dependent variables by their weighted anomaly in place, see stat.cal_weighted_anom. Returns the processing message and id of the step
+    """
+    dependent = split_variables(variables, reducer.dims)[0]
+    data = xr.Dataset({name: variables[name] for name in dependent})
+    variables.update((data - reducer.mean(data)).data_vars)
+
+    dimension_name_string = "-".join(reducer.dims)
+    return "Calculated {} weighted anomly over dimensions {}".format(reducer.name, dimension_name_string), "_".join([reducer.name, "weightedanom", dimension_name_string])
+
+
+step_functions = dict(
+    temporal_downsampling = run_temporal_downsampling,
+    anomaly = run_anomaly,
+    apply_mask = run_apply_mask,
+    lonlatbox = run_lonlatbox,
+    weighted_mean = run_weighted_mean,
+    weighted_anom = run_weighted_anom,
+)
+
+
+class Pipeline:
+    """Deferred chain of climtools operations. The steps are only recorded when they are added and planned as a whole when the pipeline is run:
+    spatial subsets are moved in front of steps along other dimensions (e.g. temporal downsampling), unused variables are dropped at the start
+    and the variables are merged and the processing attributes added only once at the end.
+    A pipeline can be called like a function on a dataset, e.g. as func of processing.load_execute_save.
+    """
+
+    def __init__(self, variables=None):
+        """
+        Args:
+            variables (list, optional): Variables of the result, all other variables except time_bnds are dropped before processing. Defaults to None.
+        """
+        self.variables = variables
+        self.steps = []
+
+    def add_step(self, name, kind, dims, **kwargs):
+        """Records a step, returns the pipeline so that steps can be chained
+        """
+        self.steps.append(Step(name, kind, tuple(dims), kwargs))
+        return self
+
+    def temporal_downsampling(self, target_resolution, max_chunk_bytes=temporal.default_max_chunk_bytes):
+        """Adds temporal.temporal_downsampling as a step
+        """
+        return self.add_step("temporal_downsampling", "temporal", ("time",), target_resolution = target_resolution, max_chunk_bytes = max_chunk_bytes)
+
+    def anomaly(self, dimensions):
+        """Adds stat.cal_anomaly_dim as a step
+        """
+        dimensions = [dimensions] if isinstance(dimensions, str) else list(dimensions)
+        return self.add_step("anomaly", "reduction", dimensions, dimensions = dimensions)
+
+    def apply_mask(self, mask, drop=False):
+        """Adds spatial.apply_mask as a step
+        """
+        return self.add_step("apply_mask", "spatial", mask.dims, mask = mask, drop = drop)
+
+    def lonlatbox(self, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim="lat", longitude_dim="lon", drop=False):
+        """Adds masking with the longitude and latitude box of spatial.gen_lonlatbox_mask as a step. Like in spatial.sellonlatbox only variables on the grid are masked.
+        """
+        return self.add_step("lonlatbox", "spatial", (latitude_dim, longitude_dim), longitude_min = longitude_min, longitude_max = longitude_max, latitude_min = latitude_min, latitude_max = latitude_max,
+                             latitude_dim = latitude_dim, longitude_dim = longitude_dim, drop = drop)
+
+    def weighted_mean(self, weights):
+        """Adds stat.cal_weighted_mean as a step
+        """
+        reducer = weights if isinstance(weights, stat.WeightedReducer) else stat.WeightedReducer(weights)
+        return self.add_step("weighted_mean", "reduction", reducer.dims, reducer = reducer)
+
+    def weighted_anom(self, weights):
+        """Adds stat.cal_weighted_anom as a step
+        """
+        reducer = weights if isinstance(weights, stat.WeightedReducer) else stat.WeightedReducer(weights)
+        return self.add_step("weighted_anom", "reduction", reducer.dims, reducer = reducer)
+
+    def plan(self):
+        """Plans the order of the steps. Spatial steps which subset the data (drop=True) are moved in front of preceding non spatial steps as long as these operate on other dimensions,
+        since masking commutes with operations along those dimensions and the following steps only process the subset. Masks without subsetting stay in place
+        since they would only be applied to more data.
+
+        Returns:
+            list: Steps in the order of execution
+        """
+        steps = []
+        for step in self.steps:
+            position = len(steps)
+            if step.kind == "spatial" and step.kwargs["drop"]:
+                while position > 0 and steps[position - 1].kind != "spatial" and set(steps[position - 1].dims).isdisjoint(step.dims):
+                    position = position - 1
+            steps.insert(position, step)
+        return steps
+
+    def run(self, data, compute=False):
+        """Runs the planned steps on a dataset. The steps are recorded in the provenance log in the declared order, independent of the order of execution (see plan).
+
+        Args:
+            data (xarray.Dataset): Input dataset
+            compute (bool, optional): If True dask backed results are computed in a single pass at the end. Defaults to False.
+
+        Returns:
+            xarray.Dataset: Processed dataset
+        """
+        if self.variables is not None:
+            keep_variables = [variable for variable in data.data_vars if variable in self.variables or variable == "time_bnds"]
+            data = data[keep_variables]
+
+        variables = dict(data.data_vars)
+        step_records = {}
+        for step in self.plan():
+            logging.info("Pipeline step {} {}".format(step.name, step.dims))
+            bytes_in = sum(variable.nbytes for variable in variables.values())
+            time_start = time.perf_counter()
+            processing_message, processing_id = step_functions[step.name](variables, **step.kwargs)
+            step_records[id(step)] = dict(processing_message = processing_message, processing_id = processing_id, name = step.name,
+                                          params = {key: provenance.summarize_param(value) for key, value in step.kwargs.items()},
+                                          wall_time = time.perf_counter() - time_start, bytes_in = bytes_in,
+                                          bytes_out = sum(variable.nbytes for variable in variables.values()))
+
+        result = xr.merge([variable.rename(name) for name, variable in variables.items()], combine_attrs="override")
+        result.attrs = dict(data.attrs)
+        for step in self.steps:
+            provenance.add_step(result, **step_records[id(step)])
+
+        target_resolutions = [step.kwargs["target_resolution"] for step in self.steps if step.name == "temporal_downsampling"]
+        if len(target_resolutions) > 0:
+            temporal.set_temporal_resolution(result, target_resolutions[-1])
+
+        if compute:
+            result = result.compute()
+        return result
+
+    def __call__(self, data):
+        return self.run(data)
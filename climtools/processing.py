@@ -1,16 +1,308 @@
 import xarray as xr
 xr.set_options(keep_attrs = True)
 import os
+import glob
+import json
+import time
+import logging
+import traceback
+import concurrent.futures
+import pandas as pd
+from . import cache
 from . import cmor
+from . import provenance
+from . import profiling
+from . import writer
+
+default_manifest_filename = ".batch_manifest.json"
 
 def load_execute_save(func, data, version_id, data_init_path, chunks=None, *func_args, **func_kwargs):
+    """Applies a function to a dataset or input file and saves the result in the cmor structure, see process_input.
+    All further positional and keyword arguments are passed to func.
+    """
+    return process_input(func, data, version_id, data_init_path, chunks=chunks, func_args=func_args, func_kwargs=func_kwargs)
+
+
+@profiling.profiled
+def process_input(func, data, version_id, data_init_path, chunks=None, func_args=(), func_kwargs=None, result_cache=None, save_kwargs=None):
+    """Applies a function to a dataset or input file and saves the result in the cmor structure. The arguments of func and the options of the
+    driver are passed separately, so that func can take arguments of any name.
+
+    Args:
+        func (function): Function applied to the dataset
+        data (str or xarray.Dataset): Input file or dataset
+        version_id (str): cmor version id of the output
+        data_init_path (str): Path to the parent folder where the CMIP-folder structure starts
+        chunks (dict, optional): Chunks used for opening the input. Defaults to None.
+        func_args (tuple, optional): Positional arguments passed to func. Defaults to ().
+        func_kwargs (dict, optional): Keyword arguments passed to func. Defaults to None.
+        result_cache (cache.ResultCache, optional): Cache of results of input files, a cached result is returned without processing. Defaults to None.
+        save_kwargs (dict, optional): Keyword arguments passed to writer.save_dataset, e.g. preset and engine. Defaults to None.
+
+    Returns:
+        str: Output file
+    """
+    func_kwargs = {} if func_kwargs is None else func_kwargs
+    save_kwargs = {} if save_kwargs is None else save_kwargs
+    engine = save_kwargs.get("engine", "netcdf")
+    cache_key = None
     if type(data) == str:
-        data = xr.open_dataset(data, use_cftime=True, chunks = chunks)
+        if result_cache is not None:
+            cache_key = result_cache.gen_key(data, func, func_args, func_kwargs, version_id=version_id, data_init_path=os.path.abspath(data_init_path), save_kwargs=save_kwargs)
+            data_full_filename = result_cache.get(cache_key)
+            if data_full_filename is not None:
+                return data_full_filename
+        input_path = data
+        with profiling.profile("processing.open_dataset") as event:
+            data = xr.open_dataset(data, use_cftime=True, chunks = chunks)
+            event.set_result(data)
     data_proc = func(data,*func_args, **func_kwargs)
+    if cache_key is not None:
+        provenance.add_step(data_proc, "result cache key {}".format(cache_key), name = "result_cache")
+    data_proc = provenance.render(data_proc)
     data_cmor_path, data_filename = cmor.gen_cmor_path_and_filename(data_proc, version_id = version_id)
     data_full_path = os.path.join(data_init_path, data_cmor_path)
     os.makedirs(data_full_path, exist_ok=True)
 
-    data_full_filename =os.path.join(data_full_path, data_filename) 
-    data_proc.to_netcdf(data_full_filename)
+    data_full_filename =os.path.join(data_full_path, writer.set_extension(data_filename, engine)) 
+    writer.save_dataset(data_proc, data_full_filename, **save_kwargs)
+    if cache_key is not None:
+        result_cache.put(cache_key, data_full_filename, input=os.path.abspath(input_path))
     return data_full_filename
+
+
+def gen_input_list(inputs):
+    """Generates the list of input files for a batch
+
+    Args:
+        inputs (str or list): Glob pattern (recursive patterns with ** are supported) or list of input files
+
+    Returns:
+        list: Sorted list of input files
+    """
+    if isinstance(inputs, str):
+        return sorted(glob.glob(inputs, recursive=True))
+    return list(inputs)
+
+
+def get_func_id(func):
+    """Returns an identifier of a function which is stored in the batch manifest
+
+    Args:
+        func (function): Function applied to the inputs
+
+    Returns:
+        str: Module and qualified name of the function
+    """
+    return "{}.{}".format(getattr(func, "__module__", None), getattr(func, "__qualname__", repr(func)))
+
+
+def hash_arguments(func_args, func_kwargs):
+    """Hashes the arguments passed to the function of a batch
+
+    Args:
+        func_args (tuple): Positional arguments of the function
+        func_kwargs (dict): Keyword arguments of the function
+
+    Returns:
+        str: Hex digest of the arguments or None if they can not be hashed
+    """
+    try:
+        return cache.hash_object([func_args, func_kwargs])
+    except TypeError as error:
+        logging.warning("Arguments can not be hashed, outputs are always recomputed: {}".format(error))
+        return None
+
+
+def gen_manifest_entry(input_path, output_path, func, version_id, func_args=(), func_kwargs=None):
+    """Generates the manifest entry which records the state of an input when its output was written
+
+    Args:
+        input_path (str): Input file
+        output_path (str): Output file
+        func (function): Function applied to the input
+        version_id (str): cmor version id of the output
+        func_args (tuple, optional): Positional arguments passed to func. Defaults to ().
+        func_kwargs (dict, optional): Keyword arguments passed to func. Defaults to None.
+
+    Returns:
+        dict: Manifest entry
+    """
+    func_kwargs = {} if func_kwargs is None else func_kwargs
+    input_stat = os.stat(input_path)
+    return {"output": output_path, "input_mtime": input_stat.st_mtime, "input_size": input_stat.st_size, "func": get_func_id(func), "version_id": version_id,
+            "func_hash": cache.hash_func(func), "args_hash": hash_arguments(func_args, func_kwargs)}
+
+
+def is_up_to_date(entry, input_path, func, version_id, func_args=(), func_kwargs=None):
+    """Checks if the output recorded in a manifest entry is still up to date with its input
+
+    Args:
+        entry (dict): Manifest entry of the input or None
+        input_path (str): Input file
+        func (function): Function applied to the input
+        version_id (str): cmor version id of the output
+        func_args (tuple, optional): Positional arguments passed to func. Defaults to ().
+        func_kwargs (dict, optional): Keyword arguments passed to func. Defaults to None.
+
+    Returns:
+        bool: True if the output exists and neither the input nor the processing, including the source code of func and its arguments, changed since it was written.
+        False if the input does not exist
+    """
+    func_kwargs = {} if func_kwargs is None else func_kwargs
+    if entry is None or not os.path.exists(entry["output"]):
+        return False
+    if not os.path.exists(input_path):
+        logging.warning("Input {} of manifest entry does not exist anymore".format(input_path))
+        return False
+    input_stat = os.stat(input_path)
+    if (entry["input_mtime"], entry["input_size"]) != (input_stat.st_mtime, input_stat.st_size):
+        return False
+    if (entry["func"], entry["version_id"]) != (get_func_id(func), version_id):
+        return False
+    args_hash = hash_arguments(func_args, func_kwargs)
+    if args_hash is None or (entry.get("func_hash"), entry.get("args_hash")) != (cache.hash_func(func), args_hash):
+        return False
+    return os.path.getmtime(entry["output"]) >= input_stat.st_mtime
+
+
+def load_manifest(path):
+    """Loads a batch manifest
+
+    Args:
+        path (str): Path of the manifest
+
+    Returns:
+        dict: Manifest entries for each input, empty if the manifest does not exist
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as handle:
+        return json.load(handle)
+
+
+def save_manifest(manifest, path):
+    """Atomically saves a batch manifest
+
+    Args:
+        manifest (dict): Manifest entries for each input
+        path (str): Path of the manifest
+    """
+    path_tmp = path + ".tmp"
+    with open(path_tmp, "w") as handle:
+        json.dump(manifest, handle, indent=1)
+    os.replace(path_tmp, path)
+
+
+def init_worker(memory_limit):
+    """Initializes a batch worker process by limiting its address space
+
+    Args:
+        memory_limit (int): Memory limit of the worker in bytes or None
+    """
+    if memory_limit is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        logging.warning("Memory limit of workers is not supported on this platform")
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def execute_task(func, input_path, version_id, data_init_path, chunks, func_args, func_kwargs, result_cache=None, save_kwargs=None):
+    """Executes process_input for one input and records its timing. Exceptions are returned instead of raised so that a batch continues.
+
+    Returns:
+        dict: Output file, wall time and error traceback of the task
+    """
+    time_start = time.perf_counter()
+    try:
+        output_path = process_input(func, input_path, version_id, data_init_path, chunks, func_args, func_kwargs, result_cache=result_cache, save_kwargs=save_kwargs)
+        error = None
+    except Exception:
+        output_path = None
+        error = traceback.format_exc()
+    return {"output": output_path, "wall_time": time.perf_counter() - time_start, "error": error}
+
+
+def run_tasks(func, input_paths, version_id, data_init_path, chunks, func_args, func_kwargs, n_workers, memory_limit, result_cache=None, save_kwargs=None):
+    """Runs process_input for several inputs, in the current process if n_workers is 1 and no memory limit is set and in a process pool otherwise
+
+    Returns:
+        dict: Task result for each input
+    """
+    task_args = (version_id, data_init_path, chunks, func_args, func_kwargs, result_cache, save_kwargs)
+    if n_workers == 1 and memory_limit is None:
+        return {input_path: execute_task(func, input_path, *task_args) for input_path in input_paths}
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(memory_limit,)) as executor:
+        futures = {executor.submit(execute_task, func, input_path, *task_args): input_path for input_path in input_paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception:
+                # e.g. a worker killed by the operating system breaks the pool
+                results[futures[future]] = {"output": None, "wall_time": float("nan"), "error": traceback.format_exc()}
+    return results
+
+
+@profiling.profiled
+def batch_load_execute_save(func, inputs, version_id, data_init_path, chunks=None, func_args=(), func_kwargs=None, n_workers=1, memory_limit=None, n_retries=1, overwrite=False, manifest_path=None, result_cache=None, save_kwargs=None):
+    """Applies load_execute_save to many input files in a pool of worker processes. Inputs whose outputs are up to date according to a manifest are skipped and failed inputs are retried.
+
+    Args:
+        func (function): Function applied to each dataset, must be picklable if workers are used
+        inputs (str or list): Glob pattern or list of input files
+        version_id (str): cmor version id of the outputs
+        data_init_path (str): Path to the parent folder where the CMIP-folder structure starts
+        chunks (dict, optional): Chunks used for opening the inputs. Defaults to None.
+        func_args (tuple, optional): Positional arguments passed to func. Defaults to ().
+        func_kwargs (dict, optional): Keyword arguments passed to func. Defaults to None.
+        n_workers (int, optional): Number of worker processes, if 1 and no memory limit is given the inputs are processed in the current process. Defaults to 1.
+        memory_limit (int, optional): Address space limit of each worker process in bytes. Defaults to None.
+        n_retries (int, optional): Number of times a failed input is retried. Defaults to 1.
+        overwrite (bool, optional): If True outputs are written even if they are up to date. Defaults to False.
+        manifest_path (str, optional): Path of the manifest recording the processed inputs. Defaults to default_manifest_filename in data_init_path.
+        result_cache (cache.ResultCache, optional): Cache of results passed to process_input. Defaults to None.
+        save_kwargs (dict, optional): Keyword arguments passed to writer.save_dataset, e.g. preset and engine. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Summary with output, status ("done", "skipped" or "failed"), number of attempts, wall time and error for each input
+    """
+    func_kwargs = {} if func_kwargs is None else func_kwargs
+    if manifest_path is None:
+        manifest_path = os.path.join(data_init_path, default_manifest_filename)
+    os.makedirs(data_init_path, exist_ok=True)
+
+    manifest = load_manifest(manifest_path)
+    summary = {}
+    input_paths_pending = []
+    for input_path in gen_input_list(inputs):
+        entry = manifest.get(input_path)
+        if not overwrite and is_up_to_date(entry, input_path, func, version_id, func_args, func_kwargs):
+            summary[input_path] = {"output": entry["output"], "status": "skipped", "n_attempt": 0, "wall_time": 0., "error": None}
+        else:
+            input_paths_pending.append(input_path)
+    logging.info("Batch: {} inputs pending, {} skipped".format(len(input_paths_pending), len(summary)))
+
+    for attempt in range(1, n_retries + 2):
+        if len(input_paths_pending) == 0:
+            break
+        results = run_tasks(func, input_paths_pending, version_id, data_init_path, chunks, func_args, func_kwargs, n_workers, memory_limit, result_cache, save_kwargs)
+
+        input_paths_pending = []
+        for input_path, result in results.items():
+            status = "failed" if result["error"] is not None else "done"
+            summary[input_path] = dict(result, status=status, n_attempt=attempt)
+            if status == "failed":
+                logging.info("Batch: {} failed in attempt {}".format(input_path, attempt))
+                input_paths_pending.append(input_path)
+            else:
+                manifest[input_path] = gen_manifest_entry(input_path, result["output"], func, version_id, func_args, func_kwargs)
+        save_manifest(manifest, manifest_path)
+
+    summary = pd.DataFrame.from_dict(summary, orient="index", columns=["output", "status", "n_attempt", "wall_time", "error"])
+    summary.index.name = "input"
+    return summary
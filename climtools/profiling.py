@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+
+_state = threading.local()
+_events = []
+_enabled = os.environ.get("CLIMTOOLS_PROFILE", "0") not in ("", "0")
+_time_origin = time.perf_counter()
+
+
+def enable():
+    """Enables the recording of profiling events
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Disables the recording of profiling events, recorded events are kept
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """Returns whether profiling events are recorded
+
+    Returns:
+        bool: True if profiling is enabled
+    """
+    return _enabled
+
+
+def clear():
+    """Removes all recorded profiling events
+    """
+    del _events[:]
+
+
+def get_events():
+    """Returns the recorded profiling events in the order in which the profiled calls finished
+
+    Returns:
+        list: Profiling events
+    """
+    return list(_events)
+
+
+def get_rss():
+    """Returns the current resident set size of the process
+
+    Returns:
+        int: Resident set size in bytes or None if it is not available on the platform
+    """
+    try:
+        with open("/proc/self/statm", "r") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_max_rss():
+    """Returns the peak resident set size over the lifetime of the process
+
+    Returns:
+        int: Peak resident set size in bytes or None if it is not available on the platform
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss*1024
+
+
+def get_nbytes(data):
+    """Returns the size of the arrays of an object or a tuple of objects without loading them
+
+    Args:
+        data (object): xarray.Dataset, xarray.DataArray, array or tuple of these
+
+    Returns:
+        int: Number of bytes or None for objects without arrays
+    """
+    if isinstance(data, (tuple, list)):
+        nbytes = [get_nbytes(element) for element in data]
+        nbytes = [element for element in nbytes if element is not None]
+        return sum(nbytes) if len(nbytes) > 0 else None
+    return getattr(data, "nbytes", None)
+
+
+def count_dask_tasks(data):
+    """Returns the number of tasks in the dask graph of an object or a tuple of objects
+
+    Args:
+        data (object): xarray.Dataset, xarray.DataArray, dask collection or tuple of these
+
+    Returns:
+        int: Number of tasks, 0 for objects which are not dask backed
+    """
+    if isinstance(data, (tuple, list)):
+        return sum(count_dask_tasks(element) for element in data)
+    if not hasattr(data, "__dask_graph__"):
+        return 0
+    graph = data.__dask_graph__()
+    return 0 if graph is None else len(graph)
+
+
+class Profile:
+    """Context manager that records a profiling event with wall time, CPU time, memory, processed bytes and dask task count.
+    The memory is recorded as rss_delta, the change of the current resident set size, and as max_rss_growth, the growth of the peak
+    resident set size of the process. The latter is only non-zero if the profiled code exceeded the previous peak of the process.
+    When profiling is disabled entering and leaving only checks a flag.
+    Events of worker processes (e.g. of processing.batch_load_execute_save with several workers) are recorded in the workers.
+    """
+    __slots__ = ["name", "data", "result", "active", "start", "cpu_start", "rss_start", "max_rss_start", "depth"]
+
+    def __init__(self, name, data=None):
+        """
+        Args:
+            name (str): Name of the event
+            data (object, optional): Input of the profiled code, used for the processed bytes. Defaults to None.
+        """
+        self.name = name
+        self.data = data
+        self.result = None
+        self.active = False
+
+    def set_result(self, result):
+        """Sets the output of the profiled code, used for the output bytes and the dask task count
+        """
+        self.result = result
+
+    def __enter__(self):
+        self.active = _enabled
+        if self.active:
+            self.depth = getattr(_state, "depth", 0)
+            _state.depth = self.depth + 1
+            self.rss_start = get_rss()
+            self.max_rss_start = get_max_rss()
+            self.cpu_start = time.process_time()
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.active:
+            return False
+        wall_time = time.perf_counter() - self.start
+        cpu_time = time.process_time() - self.cpu_start
+        rss_end = get_rss()
+        max_rss_end = get_max_rss()
+        _state.depth = self.depth
+
+        _events.append(dict(name = self.name, start = self.start - _time_origin, wall_time = wall_time, cpu_time = cpu_time,
+                            rss_delta = None if rss_end is None or self.rss_start is None else rss_end - self.rss_start,
+                            max_rss_growth = None if max_rss_end is None else max_rss_end - self.max_rss_start,
+                            bytes_in = get_nbytes(self.data), bytes_out = get_nbytes(self.result), dask_tasks = count_dask_tasks(self.result),
+                            depth = self.depth, error = None if exc_type is None else exc_type.__name__,
+                            pid = os.getpid(), tid = threading.get_ident()))
+        self.data = None
+        self.result = None
+        return False
+
+
+def profile(name, data=None):
+    """Returns a context manager that records a profiling event for a block of code, e.g. with profile("open_dataset") as event: ... event.set_result(data)
+
+    Args:
+        name (str): Name of the event
+        data (object, optional): Input of the profiled code. Defaults to None.
+
+    Returns:
+        Profile: Context manager
+    """
+    return Profile(name, data)
+
+
+def profiled(func):
+    """Decorator that records a profiling event for every call of a function while profiling is enabled. The first argument is treated as input
+    and the return value as output of the call. When profiling is disabled the overhead is a single flag check.
+
+    Args:
+        func (function): Function to be profiled
+
+    Returns:
+        function: Wrapped function
+    """
+    name = "{}.{}".format(func.__module__.split(".")[-1], func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        with Profile(name, args[0] if len(args) > 0 else None) as event:
+            result = func(*args, **kwargs)
+            event.set_result(result)
+        return result
+
+    return wrapper
+
+
+def summarize(events=None):
+    """Summarizes profiling events by name
+
+    Args:
+        events (list, optional): Profiling events. Defaults to the recorded events.
+
+    Returns:
+        dict: Number of calls, total wall time and total CPU time for each name, sorted by decreasing wall time
+    """
+    events = get_events() if events is None else events
+    summary = {}
+    for event in events:
+        entry = summary.setdefault(event["name"], dict(calls = 0, wall_time = 0., cpu_time = 0.))
+        entry["calls"] += 1
+        entry["wall_time"] += event["wall_time"]
+        entry["cpu_time"] += event["cpu_time"]
+    return dict(sorted(summary.items(), key = lambda item: -item[1]["wall_time"]))
+
+
+def export_json(path, events=None):
+    """Writes profiling events as JSON
+
+    Args:
+        path (str): Output file
+        events (list, optional): Profiling events. Defaults to the recorded events.
+    """
+    events = get_events() if events is None else events
+    with open(path, "w") as file:
+        json.dump({"events": events, "summary": summarize(events)}, file, indent = 1)
+
+
+def gen_chrome_trace(events=None):
+    """Generates a Chrome trace (viewable in chrome://tracing or Perfetto) of profiling events
+
+    Args:
+        events (list, optional): Profiling events. Defaults to the recorded events.
+
+    Returns:
+        dict: Trace with one complete event per profiling event
+    """
+    events = get_events() if events is None else events
+    trace_events = []
+    for event in events:
+        args = {key: event[key] for key in ["cpu_time", "rss_delta", "max_rss_growth", "bytes_in", "bytes_out", "dask_tasks", "error"]}
+        trace_events.append(dict(name = event["name"], cat = event["name"].split(".")[0], ph = "X", ts = event["start"]*1e6, dur = event["wall_time"]*1e6,
+                                 pid = event["pid"], tid = event["tid"], args = args))
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(path, events=None):
+    """Writes profiling events as Chrome trace file
+
+    Args:
+        path (str): Output file
+        events (list, optional): Profiling events. Defaults to the recorded events.
+    """
+    with open(path, "w") as file:
+        json.dump(gen_chrome_trace(events), file)
@@ -0,0 +1,169 @@
+import time
+import uuid
+import inspect
+import logging
+import datetime
+import functools
+import xarray as xr
+
+provenance_attr = "provenance_id"
+
+
+class StepToken(str):
+    """Token of a step record stored in the attributes of processed data. The token holds its record and the record holds the token of
+    the previous step, so the records of an object live exactly as long as some object carries the token in its attributes.
+    Copies of the attributes, e.g. by xarray operations keeping attributes or by pickling to worker processes, keep the records available.
+    """
+
+    def __new__(cls, token, record):
+        self = super().__new__(cls, token)
+        self.record = record
+        return self
+
+    def __reduce__(self):
+        return StepToken, (str(self), self.record)
+
+
+def get_nbytes(data):
+    """Returns the size of the data of an object without loading it
+
+    Args:
+        data (object): xarray.Dataset, xarray.DataArray or other object
+
+    Returns:
+        int: Number of bytes or None for objects without nbytes
+    """
+    return getattr(data, "nbytes", None)
+
+
+def summarize_param(value):
+    """Summarizes a parameter of a step in a form that can be stored in the provenance log and exported as JSON
+
+    Args:
+        value (object): Value of the parameter
+
+    Returns:
+        object: Value for numbers, strings and None, lists of summaries for lists and tuples, a short description otherwise
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [summarize_param(element) for element in value]
+    if hasattr(value, "dims"):
+        return "<{} {} {}>".format(type(value).__name__, getattr(value, "name", None), tuple(value.dims))
+    return "<{}>".format(type(value).__name__)
+
+
+def get_record(data):
+    """Returns the latest step record of an object
+
+    Args:
+        data (xarray.Dataset or xarray.DataArray): Processed data
+
+    Returns:
+        dict: Step record or None if no step was recorded
+    """
+    return getattr(data.attrs.get(provenance_attr), "record", None)
+
+
+def add_step(data, processing_message, processing_id=None, name=None, params=None, wall_time=None, bytes_in=None, bytes_out=None):
+    """Records a processing step of an object. The object receives the short token of the record in its attributes, which keeps
+    the attributes of all intermediates small, and the record is released together with the last object carrying its token.
+    The records of an object are rendered into the history and table_id attributes by render.
+
+    Args:
+        data (xarray.Dataset or xarray.DataArray): Processed data, its attributes are changed in place
+        processing_message (str): Message describing the processing step
+        processing_id (str, optional): ID indicative of the processing step, None for steps that do not change the table_id. Defaults to None.
+        name (str, optional): Name of the step. Defaults to None.
+        params (dict, optional): Parameters of the step. Defaults to None.
+        wall_time (float, optional): Wall time of the step in seconds. Defaults to None.
+        bytes_in (int, optional): Size of the input. Defaults to None.
+        bytes_out (int, optional): Size of the output. Defaults to None.
+
+    Returns:
+        dict: Step record
+    """
+    token = uuid.uuid4().hex
+    record = dict(token = token, parent = data.attrs.get(provenance_attr), name = name, message = processing_message, processing_id = processing_id,
+                  params = params, wall_time = wall_time, bytes_in = bytes_in, bytes_out = bytes_out,
+                  timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"))
+    data.attrs[provenance_attr] = StepToken(token, record)
+    return record
+
+
+def get_steps(data):
+    """Returns the step records of an object in the order of processing
+
+    Args:
+        data (xarray.Dataset or xarray.DataArray): Processed data
+
+    Returns:
+        list: Step records
+    """
+    steps = []
+    token = data.attrs.get(provenance_attr)
+    while token is not None:
+        record = getattr(token, "record", None)
+        if record is None:
+            logging.warning("Provenance record %s is unknown, earlier steps are not rendered", token)
+            break
+        steps.append(record)
+        token = record["parent"]
+    return steps[::-1]
+
+
+def render(data):
+    """Renders the recorded steps of an object into its history and table_id attributes. This is done once before writing by writer.save_dataset,
+    intermediate results can be rendered explicitly to inspect their attributes.
+
+    Args:
+        data (xarray.Dataset or xarray.DataArray): Processed data
+
+    Returns:
+        xarray.Dataset or xarray.DataArray: Shallow copy with rendered attributes and without the provenance token, the object itself if no step was recorded
+    """
+    if provenance_attr not in data.attrs:
+        return data
+
+    from . import utils
+    from . import temporal
+    steps = get_steps(data)
+    rendered = data.copy(deep = False)
+    if isinstance(data, xr.Dataset):
+        temporal.copy_cached_temporal_resolution(data, rendered)
+    del rendered.attrs[provenance_attr]
+    for step in steps:
+        if step["processing_id"] is not None:
+            utils.add_table_id(rendered, step["processing_id"])
+        utils.add_history(rendered, step["message"], timestamp = step["timestamp"])
+    return rendered
+
+
+def tracked(func):
+    """Decorator that completes the step record added by a processing function with the name of the function, its parameters,
+    its wall time and the size of its input and output. The overhead is a timer and a dictionary update per call.
+
+    Args:
+        func (function): Processing function with the data as first argument which records its step with utils.add_processing_attributes
+
+    Returns:
+        function: Wrapped function
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(data, *args, **kwargs):
+        parent = data.attrs.get(provenance_attr)
+        time_start = time.perf_counter()
+        result = func(data, *args, **kwargs)
+        wall_time = time.perf_counter() - time_start
+
+        record = get_record(result)
+        if record is not None and record["token"] != parent:
+            arguments = signature.bind(data, *args, **kwargs).arguments
+            params = {key: summarize_param(value) for key, value in list(arguments.items())[1:]}
+            record.update(name = func.__name__, params = params, wall_time = wall_time, bytes_in = get_nbytes(data), bytes_out = get_nbytes(result))
+        return result
+
+    return wrapper
@@ -1,9 +1,141 @@
 import xarray as xr
 xr.set_options(keep_attrs = True)
+import numpy as np
+import hashlib
+from collections import namedtuple, OrderedDict
 from . import utils
+from . import provenance
+from . import profiling
 
+CompactMask = namedtuple("CompactMask", ["dims", "shape", "indexers", "bits"])
+CompactMask.__doc__ = """Compact representation of a boolean mask. indexers select the bounding region of the mask (a slice for contiguous ranges,
+an integer array otherwise) and bits contains the packed mask inside this region or None if the region is completely True."""
 
-def sellonlatbox(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim = "lat", longitude_dim = "lon"):
+_mask_registry = OrderedDict()
+mask_registry_size = 256
+
+
+def gen_grid_fingerprint(data, latitude_dim = "lat", longitude_dim = "lon"):
+    """Generates a fingerprint of the longitude and latitude grid of a dataset
+
+    Args:
+        data (xarray.Dataset): Dataset with latitude and longitude coordinates
+        latitude_dim (str, optional): Name of the latitude dimension. Defaults to "lat".
+        longitude_dim (str, optional): Name of the longitude dimension. Defaults to "lon".
+
+    Returns:
+        str: Hash of the dimensions and values of the latitude and longitude coordinates
+    """
+    fingerprint = hashlib.sha1()
+    for coordinate in [getattr(data, latitude_dim), getattr(data, longitude_dim)]:
+        fingerprint.update(repr((coordinate.name, coordinate.dims, str(coordinate.dtype))).encode())
+        fingerprint.update(np.ascontiguousarray(coordinate.values).tobytes())
+    return fingerprint.hexdigest()
+
+
+def gen_index_indexer(index):
+    """Returns a slice for a contiguous range of indices and the indices otherwise
+
+    Args:
+        index (np.array of int): Sorted indices
+
+    Returns:
+        slice or np.array of int: Indexer for isel
+    """
+    if len(index) == 0:
+        return slice(0, 0)
+    if index[-1] - index[0] + 1 == len(index):
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+
+def compress_mask(mask):
+    """Compresses a boolean mask into the indexers of its bounding region and a bitset of the mask inside this region
+
+    Args:
+        mask (xarray.DataArray): Boolean mask
+
+    Returns:
+        CompactMask: Compact mask
+    """
+    values = np.asarray(mask.values, dtype=bool)
+    
+    indexers = {}
+    index_list = []
+    for axis, dim in enumerate(mask.dims):
+        other_axes = tuple(other_axis for other_axis in range(values.ndim) if other_axis != axis)
+        index = np.flatnonzero(values.any(axis=other_axes))
+        indexers[dim] = gen_index_indexer(index)
+        index_list.append(index)
+    
+    values_region = values[np.ix_(*index_list)]
+    bits = None if values_region.all() else np.packbits(values_region)
+    return CompactMask(mask.dims, values.shape, indexers, bits)
+
+
+def get_region_shape(compact_mask):
+    """Returns the shape of the bounding region of a compact mask
+
+    Args:
+        compact_mask (CompactMask): Compact mask
+
+    Returns:
+        tuple of int: Shape of the bounding region
+    """
+    return tuple(len(range(*indexer.indices(size))) if isinstance(indexer, slice) else len(indexer) 
+                 for indexer, size in zip(compact_mask.indexers.values(), compact_mask.shape))
+
+
+def expand_region_mask(compact_mask):
+    """Returns the mask inside the bounding region of a compact mask
+
+    Args:
+        compact_mask (CompactMask): Compact mask
+
+    Returns:
+        np.array of bool: Mask inside the bounding region
+    """
+    region_shape = get_region_shape(compact_mask)
+    if compact_mask.bits is None:
+        return np.ones(region_shape, dtype=bool)
+    return np.unpackbits(compact_mask.bits, count=int(np.prod(region_shape))).reshape(region_shape).astype(bool)
+
+
+def expand_mask(compact_mask):
+    """Expands a compact mask into a boolean array on the full grid
+
+    Args:
+        compact_mask (CompactMask): Compact mask
+
+    Returns:
+        np.array of bool: Mask
+    """
+    values = np.zeros(compact_mask.shape, dtype=bool)
+    index_list = [np.arange(size)[indexer] for indexer, size in zip(compact_mask.indexers.values(), compact_mask.shape)]
+    values[np.ix_(*index_list)] = expand_region_mask(compact_mask)
+    return values
+
+
+def clear_mask_registry():
+    """Removes all masks from the mask registry
+    """
+    _mask_registry.clear()
+
+
+def register_mask(key, compact_mask):
+    """Adds a compact mask to the mask registry. The least recently used masks are removed if the registry holds more than mask_registry_size masks.
+
+    Args:
+        key (tuple): Grid fingerprint and box of the mask
+        compact_mask (CompactMask): Compact mask
+    """
+    _mask_registry[key] = compact_mask
+    while len(_mask_registry) > mask_registry_size:
+        _mask_registry.popitem(last=False)
+
+
+@profiling.profiled
+def sellonlatbox(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim = "lat", longitude_dim = "lon", drop = False):
     """Selects points of a given dataset that are in between the boundaries defined by latitude and longitudes mininmums and maximums
 
     Args:
@@ -14,20 +146,80 @@ def sellonlatbox(data, longitude_min, longitude_max, latitude_min, latitude_max,
         latitude_max (float): Maximum latitude
         latitude_dim (str, optional): Name of the latitude dimension. Defaults to "lat".
         longitude_dim (str, optional): Name of the longitude dimension. Defaults to "lon".
+        drop (bool, optional): Subset the dataset to the index ranges covering the box instead of masking the full field. Defaults to False.
 
     Returns:
-        xarray Dataset: Dataset with masked values
+        xarray Dataset: Dataset with masked values. Only the variables depending on the grid are masked.
     """
-    variables = utils.decompose_dependent_variables(data, getattr(data,latitude_dim).dims)
-    dep_variables = variables["dependent"]
-    ind_variables = variables["independent"]
+    compact_mask = get_lonlatbox_compact_mask(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim = latitude_dim, longitude_dim = longitude_dim)
 
-    mask = gen_lonlatbox_mask(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim = latitude_dim, longitude_dim = longitude_dim)
+    if drop:
+        return select_compact_mask(data, compact_mask)
 
-    return data.where(mask)
+    return mask_dependent_variables(data, xr.DataArray(expand_mask(compact_mask), dims = compact_mask.dims))
 
+
+def mask_dependent_variables(data, mask):
+    """Masks the variables of a dataset that depend on all dimensions of a mask. The other variables are left unchanged instead of being broadcast against the mask.
+
+    Args:
+        data (xarray.Dataset): Dataset which should be masked
+        mask (xarray.DataArray): Mask on the grid of the dataset, usually without coordinates so that no alignment is needed
+
+    Returns:
+        xarray.Dataset: Masked data
+    """
+    dep_variables, ind_variables = utils.select_dependent_variables(data, mask.dims)
+    return xr.merge([data[ind_variables], data[dep_variables].where(mask)], combine_attrs="override")
+
+
+def select_compact_mask(data, compact_mask):
+    """Selects the bounding region of a compact mask with isel and masks the points inside the region that are not part of the mask
+
+    Args:
+        data (xarray.Dataset): Dataset on the grid of the mask
+        compact_mask (CompactMask): Compact mask
+
+    Returns:
+        xarray.Dataset: Subset of the dataset
+    """
+    data = data.isel(compact_mask.indexers)
+    if compact_mask.bits is None:
+        return data
+    return mask_dependent_variables(data, xr.DataArray(expand_region_mask(compact_mask), dims = compact_mask.dims))
+
+
+def get_lonlatbox_compact_mask(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim="lat", longitude_dim ="lon"):
+    """ Returns the compact mask of a longitude and latitude box from the mask registry. The mask is generated and registered if the registry
+    does not contain a mask for the grid of the dataset and the box yet (see register_mask).
+
+    Args:
+        data (xarray.Dataset): Dataset for which mask is generated
+        longitude_min (float): Minimum longitude (Minimum not included)
+        longitude_max (float): Maximum longitude (Maximum not included)
+        latitude_min (float): Minimum latitude (Minimum not included)
+        latitude_max (float): Maximum latitude (Maximum not included)
+        latitude_dim (str, optional): Name of the latitude dimension. Defaults to "lat".
+        longitude_dim (str, optional): Name of the longitude dimension. Defaults to "lon".
+
+    Returns:
+        CompactMask: Compact mask
+    """
+    key = (gen_grid_fingerprint(data, latitude_dim = latitude_dim, longitude_dim = longitude_dim), (longitude_min, longitude_max, latitude_min, latitude_max))
+    
+    if key not in _mask_registry:
+        mask = cal_lonlatbox_mask(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim = latitude_dim, longitude_dim = longitude_dim)
+        register_mask(key, compress_mask(mask))
+    else:
+        _mask_registry.move_to_end(key)
+    
+    return _mask_registry[key]
+
+
+@profiling.profiled
 def gen_lonlatbox_mask(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim="lat", longitude_dim ="lon"):
-    """ Generates a mask for a longitude and latitude box for a given dataset. Longitude has to be in [0,360]
+    """ Generates a mask for a longitude and latitude box for a given dataset. Longitude has to be in [0,360]. 
+    Masks are cached in the mask registry by grid and box.
 
     Args:
         data (xarray.Dataset): Dataset for which mask is generated
@@ -38,6 +230,48 @@ def gen_lonlatbox_mask(data, longitude_min, longitude_max, latitude_min, latitud
         latitude_dim (str, optional): _description_. Defaults to "lat".
         longitude_dim (str, optional): _description_. Defaults to "lon".
 
+    Returns:
+        xarray.DataArray: Mask
+    """
+    compact_mask = get_lonlatbox_compact_mask(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim = latitude_dim, longitude_dim = longitude_dim)
+    
+    lat = getattr(data,latitude_dim)
+    lon = getattr(data,longitude_dim)
+    template = xr.broadcast(lat, lon)[0]
+    
+    return xr.DataArray(expand_mask(compact_mask), dims = compact_mask.dims, coords = template.coords)
+
+
+@profiling.profiled
+def gen_lonlatbox_masks(data, boxes, region_dim="region", latitude_dim="lat", longitude_dim ="lon"):
+    """ Generates a stack of masks for several longitude and latitude boxes, e.g. as input for stat.cal_regional_weighted_means
+
+    Args:
+        data (xarray.Dataset): Dataset for which masks are generated
+        boxes (dict): Dictionary of region names and (longitude_min, longitude_max, latitude_min, latitude_max) tuples
+        region_dim (str, optional): Name of the region dimension. Defaults to "region".
+        latitude_dim (str, optional): Name of the latitude dimension. Defaults to "lat".
+        longitude_dim (str, optional): Name of the longitude dimension. Defaults to "lon".
+
+    Returns:
+        xarray.DataArray: Masks with dimension region_dim
+    """
+    masks = [gen_lonlatbox_mask(data, *box, latitude_dim = latitude_dim, longitude_dim = longitude_dim) for box in boxes.values()]
+    return xr.concat(masks, dim = region_dim).assign_coords({region_dim: list(boxes)})
+
+
+def cal_lonlatbox_mask(data, longitude_min, longitude_max, latitude_min, latitude_max, latitude_dim="lat", longitude_dim ="lon"):
+    """ Calculates a mask for a longitude and latitude box for a given dataset without using the mask registry. Longitude has to be in [0,360]
+
+    Args:
+        data (xarray.Dataset): Dataset for which mask is generated
+        longitude_min (float): Minimum longitude (Minimum not included)
+        longitude_max (float): Maximum longitude (Maximum not included)
+        latitude_min (float): Minimum latitude (Minimum not included)
+        latitude_max (float): Maximum latitude (Maximum not included)
+        latitude_dim (str, optional): Name of the latitude dimension. Defaults to "lat".
+        longitude_dim (str, optional): Name of the longitude dimension. Defaults to "lon".
+
     Returns:
         xarray.DataArray: Mask
     """
@@ -57,12 +291,16 @@ def gen_lonlatbox_mask(data, longitude_min, longitude_max, latitude_min, latitud
     return mask
 
 
-def apply_mask(data, mask):
+@profiling.profiled
+@provenance.tracked
+def apply_mask(data, mask, drop=False):
     """Applies a mask to a datast for all variables that have the same dimensions as the mask
 
     Args:
         data (xarray.Dataset): Dataset which should be masked
         mask (xarray.DataArray): Mask
+        drop (bool, optional): Subset the dataset to the bounding index ranges of the mask with isel and only mask inside these ranges. 
+            The mask must be on the grid of the dataset. Defaults to False.
 
     Returns:
         xarray.Dataset: Masked data 
@@ -72,7 +310,17 @@ def apply_mask(data, mask):
     dep_variables = variable_dict["dependent"]
     ind_variables = variable_dict["independent"]
     
-    data = xr.merge([data[ind_variables],data[dep_variables].where(mask)], combine_attrs="override")
+    if drop:
+        compact_mask = compress_mask(mask)
+        data = data.isel(compact_mask.indexers)
+        mask = mask.isel(compact_mask.indexers)
+
+    if drop and compact_mask.bits is None:
+        data_masked = data[dep_variables]
+    else:
+        data_masked = data[dep_variables].where(mask)
+
+    data = xr.merge([data[ind_variables],data_masked], combine_attrs="override")
     utils.add_processing_attributes(data, processing_message="Applied mask" , processing_id="masked")
     
     return data 
@@ -7,17 +7,192 @@ def distance_on_earth(lon_rad_1, lat_rad_1, lon_rad_2, lat_rad_2):
     distance = earth_radius*xr.ufuncs.arccos( xr.ufuncs.sin(lat_rad_1)*xr.ufuncs.sin(lat_rad_2) + xr.ufuncs.cos(lat_rad_1)*xr.ufuncs.cos(lat_rad_2)*xr.ufuncs.cos(lon_rad_2 -lon_rad_1))
     return distance
 
-def xarray_autocovariance_matrix(data, sample_dim="sample"):
+class StreamingCovariance:
+    """Online accumulator of the covariance matrix of a stream of sample batches, using the batched Welford update of Chan et al.
+    The co-moment matrix is accumulated in square tiles of the upper triangle. It is kept in memory, in a memory-mapped .npy file or in any array-like store
+    that supports 2D slice assignment (e.g. a zarr array). With a band only the tiles within the band are accumulated and kept in memory.
+
+    Args:
+        n_feature (int): Number of features
+        tile_size (int, optional): Edge length of the tiles. Defaults to 1024.
+        store (str or array_like, optional): Path of a .npy file that is memory-mapped or array of shape (n_feature, n_feature). Defaults to an array in memory.
+        band (int, optional): Maximum distance between the feature indices of a covariance entry. Defaults to None (all entries).
+    """
+
+    def __init__(self, n_feature, tile_size=1024, store=None, band=None):
+        self.n_feature = n_feature
+        self.tile_size = tile_size
+        self.band = band
+        self.n_sample = 0
+        self.mean = np.zeros(n_feature)
+
+        if band is not None:
+            self.comoment = {}
+        elif store is None:
+            self.comoment = np.zeros([n_feature, n_feature])
+        elif isinstance(store, str):
+            self.comoment = np.lib.format.open_memmap(store, mode="w+", dtype=np.float64, shape=(n_feature, n_feature))
+        else:
+            self.comoment = store
+            self.comoment[...] = 0
+
+    def tile_slices(self):
+        """Returns the slices of all accumulated tiles of the upper triangle
+
+        Returns:
+            list of tuple(slice, slice): Row and column slices of the tiles
+        """
+        starts = range(0, self.n_feature, self.tile_size)
+        tiles = []
+        for row_start in starts:
+            for column_start in starts:
+                if column_start < row_start:
+                    continue
+                if self.band is not None and column_start - (row_start + self.tile_size - 1) > self.band:
+                    continue
+                tiles.append((slice(row_start, min(row_start + self.tile_size, self.n_feature)), 
+                              slice(column_start, min(column_start + self.tile_size, self.n_feature))))
+        return tiles
+
+    def update(self, batch):
+        """Updates the mean and the co-moment matrix with a batch of samples
+
+        Args:
+            batch (np.array): Samples of shape (n_batch, n_feature)
+        """
+        batch = np.asarray(batch, dtype=np.float64)
+        n_batch = batch.shape[0]
+        n_total = self.n_sample + n_batch
+        
+        batch_mean = batch.mean(axis=0)
+        batch_anom = batch - batch_mean
+        delta = batch_mean - self.mean
+        delta_factor = self.n_sample*n_batch/n_total
+        
+        for row_slice, column_slice in self.tile_slices():
+            tile = batch_anom[:, row_slice].T @ batch_anom[:, column_slice] + np.outer(delta[row_slice], delta[column_slice])*delta_factor
+            if self.band is not None:
+                key = (row_slice.start, column_slice.start)
+                self.comoment[key] = self.comoment.get(key, 0) + tile
+            else:
+                self.comoment[row_slice, column_slice] += tile
+        
+        self.mean += delta*n_batch/n_total
+        self.n_sample = n_total
+
+    def covariance_tile(self, row_slice, column_slice):
+        """Returns the covariance of an accumulated tile
+
+        Args:
+            row_slice (slice): Row slice of the tile
+            column_slice (slice): Column slice of the tile
+
+        Returns:
+            np.array: Covariance tile
+        """
+        if self.band is not None:
+            tile = self.comoment[(row_slice.start, column_slice.start)]
+        else:
+            tile = np.asarray(self.comoment[row_slice, column_slice])
+        return tile/(self.n_sample - 1)
+
+    def finalize(self):
+        """Converts the co-moment store tile by tile into the full symmetric covariance matrix. No updates are possible afterwards.
+
+        Returns:
+            array_like: Covariance matrix in the store
+        """
+        assert self.band is None, "A banded covariance can only be returned as sparse matrix"
+        for row_slice, column_slice in self.tile_slices():
+            tile = self.covariance_tile(row_slice, column_slice)
+            self.comoment[row_slice, column_slice] = tile
+            self.comoment[column_slice, row_slice] = tile.T
+        self.n_sample = 1
+        if isinstance(self.comoment, np.memmap):
+            self.comoment.flush()
+        return self.comoment
+
+    def to_sparse(self, top_k=None):
+        """Returns the covariance as sparse matrix. Entries outside of the band are dropped and with top_k only the top_k entries with the largest 
+        absolute value of each row are kept. The matrix is assembled in blocks of tile_size rows, so that only one block of rows is held in memory.
+
+        Args:
+            top_k (int, optional): Number of entries per row. Defaults to None (all entries).
+
+        Returns:
+            scipy.sparse.csr_matrix: Covariance matrix
+        """
+        import scipy.sparse
+
+        tiles = self.tile_slices()
+        blocks = []
+        for row_start in range(0, self.n_feature, self.tile_size):
+            row_stop = min(row_start + self.tile_size, self.n_feature)
+            rows, columns, values = [], [], []
+            
+            for row_slice, column_slice in tiles:
+                if row_slice.start == row_start:
+                    tile = self.covariance_tile(row_slice, column_slice)
+                elif column_slice.start == row_start:
+                    tile = self.covariance_tile(row_slice, column_slice).T
+                    row_slice, column_slice = column_slice, row_slice
+                else:
+                    continue
+                
+                row_index, column_index = np.meshgrid(np.arange(row_slice.start, row_slice.stop), np.arange(column_slice.start, column_slice.stop), indexing="ij")
+                keep = np.ones(tile.shape, dtype=bool) if self.band is None else np.abs(column_index - row_index) <= self.band
+                rows.append(row_index[keep] - row_start)
+                columns.append(column_index[keep])
+                values.append(tile[keep])
+
+            block = scipy.sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape = (row_stop - row_start, self.n_feature))
+            if top_k is not None:
+                block = select_top_k(block, top_k)
+            blocks.append(block)
+
+        return scipy.sparse.vstack(blocks, format="csr")
+
+
+def select_top_k(matrix, top_k):
+    """Keeps the top_k entries with the largest absolute value in each row of a sparse matrix
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): Sparse matrix
+        top_k (int): Number of entries per row
+
+    Returns:
+        scipy.sparse.csr_matrix: Sparse matrix with at most top_k entries per row
+    """
+    import scipy.sparse
+
+    rows, columns, values = [], [], []
+    for row in range(matrix.shape[0]):
+        row_start, row_end = matrix.indptr[row], matrix.indptr[row + 1]
+        row_values = matrix.data[row_start:row_end]
+        keep = np.argsort(-np.abs(row_values), kind="stable")[:top_k]
+        rows.append(np.full(len(keep), row))
+        columns.append(matrix.indices[row_start:row_end][keep])
+        values.append(row_values[keep])
+    
+    return scipy.sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape = matrix.shape)
+
+
+def xarray_autocovariance_matrix(data, sample_dim="sample", batch_size=None, tile_size=None, store=None, band=None, top_k=None):
     """"
     Args:
         data ([type]): [description]
         sample_dim (str, optional): [description]. Defaults to "time".
+        batch_size (int, optional): Number of samples loaded at once for the streaming calculation with StreamingCovariance. Defaults to None.
+        tile_size (int, optional): Edge length of the tiles of the streaming calculation. Defaults to 1024.
+        store (str or array_like, optional): Path of a memory-mapped .npy file or array-like store (e.g. zarr) for the streaming calculation. Defaults to None.
+        band (int, optional): Only keep covariances between stacked features whose index differs by at most band. Returns a sparse matrix. Defaults to None.
+        top_k (int, optional): Only keep the top_k largest absolute covariances of each stacked feature. Returns a sparse matrix. Defaults to None.
 
     Raises:
         ValueError: [description]
 
     Returns:
-        [type]: [description]
+        [type]: [description] With band or top_k a scipy.sparse.csr_matrix over the features stacked in the order of the dimensions of data.
     """
     
     data_dimensions = list(data.dims)
@@ -31,15 +206,140 @@ def xarray_autocovariance_matrix(data, sample_dim="sample"):
     for data_dimension in data_dimensions:
         rename_dict[data_dimension] = data_dimension+"_1"
 
+    if all(argument is None for argument in [batch_size, tile_size, store, band, top_k]):
+        sample_size = data.sizes[sample_dim]
+        data_anom_1 = data-data.mean(dim=sample_dim)
+        data_anom_2 = data_anom_1.rename(rename_dict)
+        
+        covariance = xr.dot(data_anom_1, data_anom_2)/(sample_size-1)
+        return covariance
+
+    data_stack = data.transpose(sample_dim, *data_dimensions)
+    feature_shape = data_stack.shape[1:]
+    n_feature = int(np.prod(feature_shape))
     sample_size = data.sizes[sample_dim]
-    data_anom_1 = data-data.mean(dim=sample_dim)
-    data_anom_2 = data_anom_1.rename(rename_dict)
+    batch_size = sample_size if batch_size is None else batch_size
+
+    accumulator = StreamingCovariance(n_feature, tile_size = tile_size or 1024, store = store, band = band)
+    for batch_start in range(0, sample_size, batch_size):
+        batch = data_stack.isel({sample_dim: slice(batch_start, batch_start + batch_size)}).values
+        accumulator.update(batch.reshape(batch.shape[0], n_feature))
+
+    if band is not None or top_k is not None:
+        return accumulator.to_sparse(top_k = top_k)
     
-    covariance = xr.dot(data_anom_1, data_anom_2)/(sample_size-1)
-    return covariance
+    covariance = accumulator.finalize().reshape(feature_shape + feature_shape)
+    coords = {}
+    for data_dimension in data_dimensions:
+        if data_dimension in data.coords:
+            coords[data_dimension] = data[data_dimension].values
+            coords[rename_dict[data_dimension]] = data[data_dimension].values
 
+    return xr.DataArray(covariance, dims = data_dimensions + [rename_dict[data_dimension] for data_dimension in data_dimensions], coords = coords)
 
-def xarray_spatial_correlated_distance_regular_grid(n_sample = 1000, lonlat_resolution=10, distance_decay_constant = 40000):
+
+def cal_zonal_spectral_factors(lon, lat, distance_decay_constant = 40000):
+    """Calculates the square roots of the zonal spectra of an exponential covariance of the great circle distance on a regular longitude latitude grid.
+    Since the covariance only depends on the two latitudes and the longitude difference, it is block circulant in longitude and is
+    block diagonalized by a FFT along longitude into one (lat x lat) matrix per zonal wavenumber. Only the wavenumbers up to n_lon/2 are returned,
+    since the spectrum is symmetric. Memory scales with n_lon*n_lat^2 instead of (n_lon*n_lat)^2.
+
+    Args:
+        lon (np.array): Regular longitudes in degrees covering the full circle
+        lat (np.array): Latitudes in degrees
+        distance_decay_constant (float, optional): Decay distance of the covariance in km. Defaults to 40000.
+
+    Returns:
+        np.array: Square roots of the spectra with shape (n_lon//2 + 1, n_lat, n_lat)
+    """
+    n_lon = len(lon)
+    assert np.allclose(np.diff(lon), 360/n_lon), "Longitudes must be regular and cover the full circle"
+
+    lat_rad = np.deg2rad(np.asarray(lat, dtype=float))
+    lon_difference_rad = np.deg2rad(np.asarray(lon, dtype=float) - lon[0])
+
+    spectra = np.empty([n_lon//2 + 1, len(lat), len(lat)])
+    for lat_index, lat_value in enumerate(lat_rad):
+        cos_distance = np.sin(lat_value)*np.sin(lat_rad)[np.newaxis, :] + np.cos(lat_value)*np.cos(lat_rad)[np.newaxis, :]*np.cos(lon_difference_rad)[:, np.newaxis]
+        covariance = np.exp(-earth_radius*np.arccos(np.clip(cos_distance, -1, 1))/distance_decay_constant)
+        spectra[:, lat_index, :] = np.fft.rfft(covariance, axis=0).real
+
+    eigenvalues, eigenvectors = np.linalg.eigh(spectra)
+    return eigenvectors*np.sqrt(np.clip(eigenvalues, 0, None))[:, np.newaxis, :]
+
+
+def sample_zonal_spectral_factors(factors, n_lon, n_sample, rng = None):
+    """Draws samples of a field whose covariance is given by zonal spectral factors (see cal_zonal_spectral_factors). 
+    Every complex draw yields two independent real samples.
+
+    Args:
+        factors (np.array): Square roots of the spectra with shape (n_lon//2 + 1, n_lat, n_lat)
+        n_lon (int): Number of longitudes
+        n_sample (int): Number of samples
+        rng (numpy.random.Generator, optional): Random number generator. Defaults to numpy.random.default_rng().
+
+    Returns:
+        np.array: Samples with shape (n_sample, n_lon, n_lat)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n_lat = factors.shape[1]
+    n_draw = (n_sample + 1)//2
+    
+    wavenumber = np.arange(n_lon)
+    factors_index = np.minimum(wavenumber, n_lon - wavenumber)
+
+    noise = rng.standard_normal([n_lon, n_lat, n_draw]) + 1j*rng.standard_normal([n_lon, n_lat, n_draw])
+    spectral_samples = np.empty(noise.shape, dtype=complex)
+    for index in range(n_lon):
+        spectral_samples[index] = factors[factors_index[index]] @ noise[index]
+
+    samples = np.fft.ifft(spectral_samples, axis=0)*np.sqrt(n_lon)
+    samples = np.concatenate([samples.real, samples.imag], axis=-1)[..., :n_sample]
+    return np.moveaxis(samples, -1, 0)
+
+
+def iterate_spatial_correlated_distance_regular_grid(n_sample = 1000, lonlat_resolution = 10, distance_decay_constant = 40000, batch_size = 100, rng = None):
+    """Generates samples of a spatially correlated field with an exponential covariance of the great circle distance on a regular grid 
+    in batches using the zonal spectral factorization, so that the samples are streamed out without holding all of them in memory.
+
+    Args:
+        n_sample (int, optional): Number of samples. Defaults to 1000.
+        lonlat_resolution (int, optional): Resolution of the grid in degree. Defaults to 10.
+        distance_decay_constant (int, optional): Decay distance of the covariance in km. Defaults to 40000.
+        batch_size (int, optional): Number of samples per batch. Defaults to 100.
+        rng (numpy.random.Generator, optional): Random number generator. Defaults to numpy.random.default_rng().
+
+    Yields:
+        xarray.DataArray: Batch of samples with dimensions sample, lon and lat
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    lat = np.arange(-90, 90, lonlat_resolution)
+    lon = np.arange(-180,180, lonlat_resolution)
+
+    factors = cal_zonal_spectral_factors(lon, lat, distance_decay_constant = distance_decay_constant)
+    
+    for batch_start in range(0, n_sample, batch_size):
+        n_batch = min(batch_size, n_sample - batch_start)
+        samples = sample_zonal_spectral_factors(factors, len(lon), n_batch, rng = rng)
+        yield xr.DataArray(samples, dims = ["sample", "lon", "lat"], coords = {"sample": range(batch_start, batch_start + n_batch), "lon": lon, "lat": lat})
+
+
+def xarray_spatial_correlated_distance_regular_grid(n_sample = 1000, lonlat_resolution=10, distance_decay_constant = 40000, method = "dense", rng = None, batch_size = None):
+    """Generates samples of a spatially correlated field with an exponential covariance of the great circle distance on a regular grid
+
+    Args:
+        n_sample (int, optional): Number of samples. Defaults to 1000.
+        lonlat_resolution (int, optional): Resolution of the grid in degree. Defaults to 10.
+        distance_decay_constant (int, optional): Decay distance of the covariance in km. Defaults to 40000.
+        method (str, optional): "dense" draws from the dense covariance matrix, which is returned as well. "fft" uses the zonal spectral factorization, 
+            which scales to high resolutions and does not return the covariance. Defaults to "dense".
+        rng (numpy.random.Generator, optional): Random number generator. Defaults to None (numpy.random global state for "dense").
+        batch_size (int, optional): Number of samples generated at once with method "fft". Defaults to None (all samples).
+
+    Returns:
+        xarray.Dataset: Dataset with the samples, the mean and for method "dense" the covariance
+    """
+    assert method in ["dense", "fft"], "Method must be one of the following: dense, fft"
 
     # Define Grid
     lat = np.arange(-90, 90, lonlat_resolution)
@@ -53,6 +353,11 @@ def xarray_spatial_correlated_distance_regular_grid(n_sample = 1000, lonlat_reso
                         dims = ["lon","lat"],
                         coords = {"lat":lat, "lon":lon})
 
+    if method == "fft":
+        batches = iterate_spatial_correlated_distance_regular_grid(n_sample = n_sample, lonlat_resolution = lonlat_resolution, distance_decay_constant = distance_decay_constant,
+                                                                   batch_size = batch_size or n_sample, rng = rng)
+        return xr.merge([xr.concat(list(batches), dim = "sample").rename("data"), mean.rename("mean")])
+
     mean_stack_1 = mean.rename({"lon":"lon_1", "lat":"lat_1"}).stack(feature_1 = ("lon_1","lat_1"))
     mean_stack_2 = mean.rename({"lon":"lon_2", "lat":"lat_2"}).stack(feature_2 = ("lon_2","lat_2"))
 
@@ -72,14 +377,15 @@ def xarray_spatial_correlated_distance_regular_grid(n_sample = 1000, lonlat_reso
                                                      covariance, 
                                                      n_sample=n_sample,
                                                      feature_dim = "feature_1", 
-                                                     sample_dim = "sample")
+                                                     sample_dim = "sample",
+                                                     rng = rng)
     return xr.merge([result.unstack(dim="feature_1").rename({"lon_1":"lon", "lat_1":"lat"}).rename("data"),
     covariance.unstack().rename({"lon_1":"lon", "lat_1":"lat"}).rename("covariance"), mean.rename("mean")])
 
 
 
 
-def xarray_multivariate_normal_distribution(mean, covariance, n_sample, feature_dim = "location",  sample_dim = "sample"):
+def xarray_multivariate_normal_distribution(mean, covariance, n_sample, feature_dim = "location",  sample_dim = "sample", rng = None):
     """
     Args:
         mean ([type]): [description]
@@ -87,13 +393,17 @@ def xarray_multivariate_normal_distribution(mean, covariance, n_sample, feature_
         n_sample ([type]): [description]
         feature_dim (str, optional): [description]. Defaults to "location".
         sample_dim (str, optional): [description]. Defaults to "sample".
+        rng (numpy.random.Generator, optional): Random number generator. Defaults to None (numpy.random global state).
 
     Returns:
         [type]: [description]
     """
-    data_surrogate = np.random.multivariate_normal(mean, covariance, size = n_sample)
+    if rng is None:
+        data_surrogate = np.random.multivariate_normal(mean, covariance, size = n_sample)
+    else:
+        data_surrogate = rng.multivariate_normal(mean, covariance, size = n_sample, method = "eigh")
     
     data_surrogate = xr.DataArray(data_surrogate, dims  = [sample_dim, feature_dim], coords = {sample_dim:range(n_sample),
     feature_dim: mean.coords[feature_dim]})
 
-    return data_surrogate
\ No newline at end of file
+    return data_surrogate
@@ -1,7 +1,17 @@
 import xarray as xr
 import numpy as np
+import os
+import logging
 from . import temporal
 from . import utils 
+from . import provenance
+from . import profiling
+from . import writer
+
+climatology_group_coords = dict(
+month = np.arange(1, 13),
+dayofyear = np.arange(1, 367),
+season = np.array(["DJF", "MAM", "JJA", "SON"]))
 
 def gen_seasonal_cycle(start, end, frequency):
     """Generates an artifical seasonal cycle for times between a given start and endpoint with a given frequncy
@@ -23,28 +33,35 @@ def gen_seasonal_cycle(start, end, frequency):
     return xr.merge([seasonal_cycle.rename("seasonal_cycle"), times_bnds.rename("time_bnds")])
 
 
-def generate_timeseries(start, end, frequency):
-    """[summary]
+def generate_timeseries(start, end, frequency, calendar="proleptic_gregorian", numeric=False):
+    """Generates the time bounds of all periods of a given frequency which start between a start and an end point, with the middle of each period as time coordinate.
+    Bounds and midpoints are calculated as integer days since 0001-01-01 and only converted into cftime.datetime objects at the end.
 
     Args:
-        start ([type]): [description]
-        end ([type]): [description]
-        frequency ([type]): [description]
+        start (cftime.datetime): Beginning of the period
+        end (cftime.datetime): End of the period, the last generated period ends at the last period start before end
+        frequency (str): One of the keys of temporal.temporal_resolution_dict
+        calendar (str, optional): CF calendar name. Defaults to "proleptic_gregorian".
+        numeric (bool, optional): If True times are returned as days since 0001-01-01 with units and calendar attributes instead of cftime.datetime objects. Defaults to False.
 
     Returns:
-        [type]: [description]
+        xarray.DataArray: Time bounds with dimensions time and bnds
     """
     assert frequency in temporal.temporal_resolution_dict, "Frequency must be one the following: "+str(list(temporal.temporal_resolution_dict.keys()))
 
-    frequency_str = temporal.temporal_resolution_dict[frequency]
+    period_starts = temporal.gen_period_starts(start, end, frequency, calendar)*temporal.microseconds_per_day
+    times_stmp = (period_starts[:-1] + period_starts[1:])//2
 
-    times_bnds_min = xr.cftime_range(start=start, end=end,  freq=frequency_str, calendar="proleptic_gregorian")[:-1]
-    times_bnds_min = times_bnds_min.shift(1,"0D")
-    times_bnds_max = times_bnds_min.shift(1,frequency_str)
+    if numeric:
+        attrs = {"units": temporal.time_units, "calendar": temporal.normalize_calendar(calendar)}
+        times_stmp = xr.DataArray(times_stmp/temporal.microseconds_per_day, dims = ["time"], attrs = attrs)
+        times_bnds = np.stack([period_starts[:-1], period_starts[1:]], axis=1)/temporal.microseconds_per_day
+        return xr.DataArray(times_bnds, dims = ["time","bnds"], coords = {"time":times_stmp}, attrs = attrs)
 
-    times_stmp = temporal.cal_middle_time(times_bnds_min, times_bnds_max)
+    period_starts = temporal.decode_cftime(period_starts, calendar)
+    times_stmp = temporal.decode_cftime(times_stmp, calendar)
 
-    times_bnds = xr.DataArray(np.stack([times_bnds_min, times_bnds_max], axis=1), dims = ["time","bnds"], coords = {"time":times_stmp})
+    times_bnds = xr.DataArray(np.stack([period_starts[:-1], period_starts[1:]], axis=1), dims = ["time","bnds"], coords = {"time":times_stmp})
     return times_bnds
 
 def gen_test_mono_timeseries(start, end):
@@ -68,18 +85,147 @@ def gen_test_mono_timeseries(start, end):
     
     return xr.merge([data.rename("values"), times_bnds.rename("time_bnds")])
 
+def weighted_sum(values, weights):
+    """Calculates the weighted sum over the trailing axes of values with the shape of weights as one matrix-vector product
+
+    Args:
+        values (np.array): Values with the dimensions of weights as trailing axes
+        weights (np.array): Weights
+
+    Returns:
+        np.array: Weighted sum over the trailing axes
+    """
+    values = values.reshape(values.shape[:values.ndim - weights.ndim] + (weights.size,))
+    return values @ weights.ravel()
+
+
+def weighted_mean(values, weights, weights_normalized):
+    """Calculates the weighted mean over the trailing axes of values. Values without nan only need a single product with the normalized weights,
+    otherwise the weights are renormalized with the weights of the valid values. For dask arrays this is decided chunk by chunk.
+
+    Args:
+        values (np.array): Values with the dimensions of weights as trailing axes
+        weights (np.array): Weights without nan
+        weights_normalized (np.array): Weights divided by their sum
+
+    Returns:
+        np.array: Weighted mean over the trailing axes
+    """
+    nan = np.isnan(values) if values.dtype.kind in "fc" else None
+    if nan is None or not nan.any():
+        return weighted_sum(values, weights_normalized)
+
+    weights_sum = weighted_sum(~nan, weights)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return weighted_sum(np.where(nan, 0, values), weights)/np.where(weights_sum != 0, weights_sum, np.nan)
+
+
+class WeightedReducer:
+    """Weighted mean over the dimensions of a fixed set of weights. The weights are cleaned and normalized once,
+    so that a reducer can be applied to many datasets on the same grid.
+
+    Args:
+        weights (xarray.DataArray): Weights. Dimension of weights determine the average dimensions. Nan weights are treated as zero.
+    """
+    stack_dim = "__variable__"
+
+    def __init__(self, weights):
+        self.name = weights.name
+        self.dims = weights.dims
+        self.weights = weights.fillna(0)
+        self.weights_normalized = self.weights/self.weights.sum(dim=self.dims)
+
+    def align_weights(self, data):
+        """Returns the weights and the normalized weights on the coordinates of data, e.g. of a subset of the grid of the reducer
+
+        Args:
+            data (xarray.DataArray): Data with all dimensions of the reducer
+
+        Raises:
+            ValueError: If data has points without weights
+
+        Returns:
+            xarray.DataArray: Weights
+            xarray.DataArray: Normalized weights
+        """
+        dims = [dim for dim in self.dims if dim in data.indexes and dim in self.weights.indexes]
+        if all(data.indexes[dim].equals(self.weights.indexes[dim]) for dim in dims):
+            return self.weights, self.weights_normalized
+
+        weights = self.weights.reindex({dim: data.indexes[dim] for dim in dims})
+        if bool(weights.isnull().any()):
+            raise ValueError("Weights {} are missing for points of the data along dimensions {}".format(self.name, dims))
+        return weights, weights/weights.sum(dim=self.dims)
+
+    def reduce(self, data):
+        """Calculates the weighted mean of a DataArray with one contraction over the dimensions of the reducer. Dask backed data is reduced chunk by chunk.
+
+        Args:
+            data (xarray.DataArray): Data with all dimensions of the reducer
+
+        Returns:
+            xarray.DataArray: Weighted mean
+        """
+        weights, weights_normalized = self.align_weights(data)
+        return xr.apply_ufunc(weighted_mean, data, weights, weights_normalized,
+                              input_core_dims = [list(self.dims)]*3,
+                              join = "exact",
+                              dask = "parallelized",
+                              output_dtypes = [float],
+                              dask_gufunc_kwargs = dict(allow_rechunk = True))
+
+    def mean_variable(self, data):
+        """Calculates the weighted mean of a DataArray
+
+        Args:
+            data (xarray.DataArray): Data with all dimensions of the reducer
+
+        Returns:
+            xarray.DataArray: Weighted mean
+        """
+        return self.reduce(data).assign_attrs(data.attrs)
+
+    def mean(self, data):
+        """Calculates the weighted mean for all variables of a dataset. Variables with the same dimensions are stacked and reduced with a single contraction.
+
+        Args:
+            data (xarray.Dataset): Dataset whose variables have all dimensions of the reducer
+
+        Returns:
+            xarray.Dataset: Weighted means
+        """
+        groups = {}
+        for variable in data.data_vars:
+            groups.setdefault(data[variable].dims, []).append(variable)
+
+        means = {}
+        for variables in groups.values():
+            if len(variables) == 1:
+                means[variables[0]] = self.mean_variable(data[variables[0]])
+                continue
+            stacked_mean = self.reduce(data[variables].to_array(dim = self.stack_dim))
+            for index, variable in enumerate(variables):
+                means[variable] = stacked_mean.isel({self.stack_dim: index}, drop = True).assign_attrs(data[variable].attrs)
+
+        result = xr.Dataset({variable: means[variable] for variable in data.data_vars})
+        return result.assign_attrs(data.attrs)
+
+
+@profiling.profiled
+@provenance.tracked
 def cal_weighted_mean(data, weights):
     """_summary_
 
     Args:
         data (xarray.Dataset): Dataset for which weighted mean should be calculated
-        weights (xarray.DataArray): Dataset of weights. Dimension of weights determine the average dimensions
+        weights (xarray.DataArray or WeightedReducer): Dataset of weights. Dimension of weights determine the average dimensions. 
+            A WeightedReducer can be passed to reuse the normalized weights for many datasets.
 
     Returns:
         xarray.Dataset: weighted mean over given dimension
     """
-
-    weights_dimensions = weights.dims
+    reducer = weights if isinstance(weights, WeightedReducer) else WeightedReducer(weights)
+    weights_dimensions = reducer.dims
     
 
     variables_dict = utils.decompose_dependent_variables(data, dimensions = weights_dimensions)
@@ -87,11 +233,11 @@ def cal_weighted_mean(data, weights):
     dep_variables = variables_dict["dependent"]
     ind_variables = variables_dict["independent"]
     
-    dep_variables_weighted_mean = data[dep_variables].weighted(weights.fillna(0)).mean(weights_dimensions)
+    dep_variables_weighted_mean = reducer.mean(data[dep_variables])
     
     result = xr.merge([data[ind_variables], dep_variables_weighted_mean], combine_attrs = "override")
     
-    weights_name = weights.name
+    weights_name = reducer.name
     dimension_name_string = "-".join(weights_dimensions)
     
     processing_message = "Calculated {} weighted mean over dimensions {}".format(weights_name, dimension_name_string)
@@ -103,25 +249,27 @@ def cal_weighted_mean(data, weights):
     
     return result
 
+@profiling.profiled
+@provenance.tracked
 def cal_weighted_anom(data, weights):    
     """ Calculates the weighted anomaly for a given dataset
 
     Args:
         data (xarray.Dataset): Dataset for which weighted mean should be calculated
-        weights (xarray.DataArray): Dataset of weights. Dimension of weights determine the average dimensions
+        weights (xarray.DataArray or WeightedReducer): Dataset of weights. Dimension of weights determine the average dimensions
 
     Returns:
         xarray Dataset: weighted anom over given dimension
     """
-    weights_name = weights.name
-    weights_dimensions = weights.dims
-    weighs_dimensions = utils.decompose_dependent_variables(data, dimensions = weights_dimensions)
+    reducer = weights if isinstance(weights, WeightedReducer) else WeightedReducer(weights)
+    weights_name = reducer.name
+    weights_dimensions = reducer.dims
     
     variables_dict = utils.decompose_dependent_variables(data, dimensions = weights_dimensions)
     dep_variables = variables_dict["dependent"]
     ind_variables = variables_dict["independent"]
     
-    dep_variables_mean = cal_weighted_mean(data[dep_variables], weights)
+    dep_variables_mean = reducer.mean(data[dep_variables])
     
     dep_variables_anom = data[dep_variables] - dep_variables_mean
     
@@ -139,6 +287,115 @@ def cal_weighted_anom(data, weights):
     return result
 
 
+def gen_region_matrix(masks, weights, region_dim="region"):
+    """Generates a sparse (region x gridpoint) matrix of the weights inside each region. Falls back to a dense matrix if scipy is not available.
+
+    Args:
+        masks (xarray.DataArray): Boolean or fractional masks with dimension region_dim and the dimensions of weights
+        weights (xarray.DataArray): Weights on the grid. Nan weights are treated as zero.
+        region_dim (str, optional): Name of the region dimension. Defaults to "region".
+
+    Returns:
+        scipy.sparse.csr_matrix or np.array: Weights of each gridpoint for each region, gridpoints flattened in the order of weights.dims
+    """
+    masks = masks.transpose(region_dim, *weights.dims)
+    matrix = masks.values.reshape(masks.shape[0], -1)*weights.fillna(0).values.reshape(1, -1)
+    
+    try:
+        import scipy.sparse
+    except ImportError:
+        return matrix
+    return scipy.sparse.csr_matrix(matrix)
+
+
+def regional_weighted_mean(values, matrix, skipna=True, n_grid_axes=None):
+    """Calculates the weighted mean of all regions of a region matrix with one matrix product over the trailing gridpoint axes
+
+    Args:
+        values (np.array): Values with the gridpoint dimensions as trailing axes
+        matrix (scipy.sparse.csr_matrix or np.array): Region matrix (see gen_region_matrix)
+        skipna (bool, optional): Ignore nan values. Defaults to True.
+        n_grid_axes (int, optional): Number of trailing gridpoint axes. Defaults to the fewest trailing axes with as many points as the matrix has columns.
+
+    Returns:
+        np.array: Weighted means with the leading axes of values and the region as last axis
+    """
+    n_region, n_points = matrix.shape
+    if n_grid_axes is None:
+        n_grid_axes = 0
+        while np.prod(values.shape[values.ndim - n_grid_axes:], dtype=int) < n_points:
+            n_grid_axes += 1
+    batch_shape = values.shape[:values.ndim - n_grid_axes]
+    values = values.reshape(-1, n_points)
+    
+    weights_sum = np.asarray(matrix.sum(axis=1)).reshape(n_region, 1)
+    nan = np.isnan(values) if values.dtype.kind in "fc" else None
+    
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if nan is not None and nan.any():
+            if skipna:
+                weights_sum = matrix @ (~nan).T.astype(float)
+            else:
+                # only nan values inside a region propagate into its mean, as for the sparse matrix where the zero weights are not stored
+                weights_sum = np.where(abs(matrix) @ nan.T.astype(float) > 0, np.nan, weights_sum)
+            values = np.where(nan, 0, values)
+        
+        result = (matrix @ values.T)/np.where(weights_sum != 0, weights_sum, np.nan)
+    return np.asarray(result).T.reshape(batch_shape + (n_region,))
+
+
+@profiling.profiled
+@provenance.tracked
+def cal_regional_weighted_means(data, masks, weights, region_dim="region", skipna=True):
+    """Calculates the weighted means of many regions in one pass over the grid. Masks and weights are combined into a sparse (region x gridpoint) matrix
+    and all regional means are computed with a single matrix product per chunk.
+
+    Args:
+        data (xarray.Dataset): Dataset for which the regional means are calculated
+        masks (xarray.DataArray): Boolean or fractional masks with dimension region_dim and the dimensions of weights, e.g. from spatial.gen_lonlatbox_masks
+        weights (xarray.DataArray): Weights on the grid of the dataset. Dimension of weights determine the average dimensions
+        region_dim (str, optional): Name of the region dimension. Defaults to "region".
+        skipna (bool, optional): Ignore nan values. Defaults to True.
+
+    Returns:
+        xarray.Dataset: Weighted means with dimension region_dim instead of the dimensions of weights
+    """
+    weights_dimensions = weights.dims
+    
+    variables_dict = utils.decompose_dependent_variables(data, dimensions = weights_dimensions)
+    dep_variables = variables_dict["dependent"]
+    ind_variables = variables_dict["independent"]
+    
+    matrix = gen_region_matrix(masks, weights, region_dim = region_dim)
+    
+    dep_variables_means = xr.apply_ufunc(regional_weighted_mean, data[dep_variables],
+                                         input_core_dims = [list(weights_dimensions)],
+                                         output_core_dims = [[region_dim]],
+                                         kwargs = dict(matrix = matrix, skipna = skipna, n_grid_axes = len(weights_dimensions)),
+                                         dask = "parallelized",
+                                         output_dtypes = [float],
+                                         dask_gufunc_kwargs = dict(output_sizes = {region_dim: masks.sizes[region_dim]}, allow_rechunk = True))
+    
+    if region_dim in masks.coords:
+        dep_variables_means = dep_variables_means.assign_coords({region_dim: masks[region_dim]})
+
+    result = xr.merge([data[ind_variables], dep_variables_means], combine_attrs = "override")
+    
+    weights_name = weights.name
+    dimension_name_string = "-".join(weights_dimensions)
+    
+    processing_message = "Calculated {} weighted means of {} regions over dimensions {}".format(weights_name, masks.sizes[region_dim], dimension_name_string)
+    processing_id = "_".join([weights_name, "regionalmean", dimension_name_string])
+    
+    utils.add_processing_attributes(result, 
+                                    processing_message = processing_message,
+                                    processing_id = processing_id)
+    
+    return result
+
+
+@profiling.profiled
+@provenance.tracked
 def cal_anomaly_dim(data, dimensions):
     """Calculates the anomaly over given dimension(s)
 
@@ -173,4 +430,255 @@ def cal_anomaly_dim(data, dimensions):
     utils.add_processing_attributes(result, 
                                     processing_message = processing_message,
                                     processing_id = processing_id)
-    return result
\ No newline at end of file
+    return result
+
+def cal_climatology_codes(time, group):
+    """Calculates the index of the climatological group of each timestamp
+
+    Args:
+        time (xarray.DataArray): Time coordinate
+        group (str): "month", "dayofyear" or "season"
+
+    Returns:
+        np.array of int: Index of the group of each timestamp in climatology_group_coords[group]
+    """
+    assert group in climatology_group_coords, "Group must be one of the following: {}".format(list(climatology_group_coords))
+    index = time.to_index()
+    if group == "dayofyear":
+        return np.asarray(index.dayofyear, dtype=np.int64) - 1
+    
+    month = np.asarray(index.month, dtype=np.int64)
+    if group == "month":
+        return month - 1
+    return month%12//3
+
+
+def cal_group_sums(values, codes, n_group):
+    """Calculates the sum and the number of valid values of all groups along the last axis in one pass. The values are sorted by group once
+    and every group is reduced as a contiguous segment.
+
+    Args:
+        values (np.array): Values with the grouped dimension as last axis
+        codes (np.array of int): Group index of each element along the last axis
+        n_group (int): Number of groups
+
+    Returns:
+        np.array: Sums and numbers of valid values with the axes (..., 2, n_group), groups without values are zero
+    """
+    result = np.zeros(values.shape[:-1] + (2, n_group))
+    if len(codes) == 0:
+        return result
+
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    values = values[..., order]
+    valid = ~np.isnan(values) if values.dtype.kind in "fc" else np.ones(values.shape, dtype=bool)
+    
+    group_starts = temporal.cal_bin_starts(codes)
+    groups = codes[group_starts]
+    result[..., 0, groups] = np.add.reduceat(np.where(valid, values, 0), group_starts, axis=-1)
+    result[..., 1, groups] = np.add.reduceat(valid.astype(float), group_starts, axis=-1)
+    return result
+
+
+def cal_group_sums_blockwise(values, codes, n_group):
+    """Calculates the sum and the number of valid values of all groups along the last axis of a dask array.
+    Every chunk is reduced independently and the partial sums are added, which results in a single pass over the data.
+
+    Args:
+        values (dask.array.Array): Values with the grouped dimension as last axis
+        codes (np.array of int): Group index of each element along the last axis
+        n_group (int): Number of groups
+
+    Returns:
+        dask.array.Array: Sums and numbers of valid values with the axes (..., 2, n_group)
+    """
+    def reduce_block(block, block_info=None):
+        start, stop = block_info[0]["array-location"][-1]
+        return cal_group_sums(block, codes[start:stop], n_group)[..., np.newaxis, :, :]
+
+    chunks = values.chunks[:-1] + ((1,)*values.numblocks[-1], (2,), (n_group,))
+    partial_sums = values.map_blocks(reduce_block, chunks = chunks, new_axis = [values.ndim, values.ndim + 1], dtype = float)
+    return partial_sums.sum(axis = values.ndim - 1)
+
+
+def reduce_groups(values, codes, n_group):
+    """Calculates the sum and the number of valid values of all groups along the last axis for numpy or dask arrays, see cal_group_sums
+    """
+    if utils.is_dask_array(values):
+        return cal_group_sums_blockwise(values, codes, n_group)
+    return cal_group_sums(values, codes, n_group)
+
+
+def cal_circular_running_sum(values, window):
+    """Calculates the centered running sum along the last axis, which is treated as periodic
+
+    Args:
+        values (np.array): Values
+        window (int): Odd window length
+
+    Returns:
+        np.array: Running sums
+    """
+    assert window%2 == 1 and window <= values.shape[-1], "Window must be odd and not longer than the last axis"
+    half = window//2
+    padded = np.concatenate([values[..., values.shape[-1] - half:], values, values[..., :half]], axis=-1)
+    cumsum = np.cumsum(padded, axis=-1)
+    cumsum = np.concatenate([np.zeros(cumsum.shape[:-1] + (1,)), cumsum], axis=-1)
+    return cumsum[..., window:] - cumsum[..., :-window]
+
+
+def gen_climatology_path(cache_dir, dataset_id, variable, group, period, smoothing_window=None):
+    """Generates the path of a cached climatology of a variable
+
+    Args:
+        cache_dir (str): Folder of the climatology cache
+        dataset_id (str): Identifier of the dataset
+        variable (str): Name of the variable
+        group (str): "month", "dayofyear" or "season"
+        period (str): Reference period of the form YYYYMMDD-YYYYMMDD
+        smoothing_window (int, optional): Window of the smoothing. Defaults to None.
+
+    Returns:
+        str: Path of the climatology
+    """
+    group_string = group if smoothing_window is None else "{}{}".format(group, smoothing_window)
+    return os.path.join(cache_dir, dataset_id, "_".join([variable, group_string, period]) + ".nc")
+
+
+@profiling.profiled
+def cal_climatology(data, group="month", period_start=None, period_end=None, smoothing_window=None, cache_dir=None, dataset_id=None, time_dim="time"):
+    """Calculates the monthly, day-of-year or seasonal climatology of all time dependent variables over a reference period.
+    All groups of all variables are reduced in one pass over the data, dask backed variables chunk by chunk.
+    With a cache_dir the climatology of each variable is stored as netcdf keyed by dataset id, variable, group, smoothing and reference period,
+    and later calls for the same key load it instead of reading the data. The dataset id has to change whenever the data changes.
+
+    Args:
+        data (xarray.Dataset): Input Dataset
+        group (str, optional): "month", "dayofyear" or "season" (DJF, MAM, JJA, SON). Defaults to "month".
+        period_start (str, optional): Start of the reference period, e.g. "1981". Defaults to None.
+        period_end (str, optional): End of the reference period, e.g. "2010". Defaults to None.
+        smoothing_window (int, optional): Odd number of groups of a periodic running mean applied to the climatology, e.g. 31 for dayofyear. Defaults to None.
+        cache_dir (str, optional): Folder of the climatology cache. Defaults to None.
+        dataset_id (str, optional): Identifier of the dataset, required with cache_dir. Defaults to None.
+        time_dim (str, optional): Name of the time dimension. Defaults to "time".
+
+    Returns:
+        xarray.Dataset: Climatology with the dimension group instead of time
+    """
+    assert group in climatology_group_coords, "Group must be one of the following: {}".format(list(climatology_group_coords))
+    assert cache_dir is None or dataset_id is not None, "A dataset_id is required to cache climatologies"
+
+    data = data.sel({time_dim: slice(period_start, period_end)})
+    time_index = data.indexes[time_dim]
+    period = "-".join(time.strftime("%Y%m%d") for time in [time_index[0], time_index[-1]])
+    variables = [variable for variable in utils.decompose_dependent_variables(data, dimensions = (time_dim,))["dependent"]
+                 if variable != "time_bnds" and temporal.is_numeric(data[variable])]
+
+    climatologies = {}
+    if cache_dir is not None:
+        for variable in variables:
+            path = gen_climatology_path(cache_dir, dataset_id, variable, group, period, smoothing_window)
+            if os.path.exists(path):
+                logging.info("Loading cached climatology {}".format(path))
+                with xr.open_dataset(path) as cached:
+                    climatologies[variable] = cached[variable].load()
+
+    compute_variables = [variable for variable in variables if variable not in climatologies]
+    if len(compute_variables) > 0:
+        n_group = len(climatology_group_coords[group])
+        sums = xr.apply_ufunc(reduce_groups, data[compute_variables],
+                              input_core_dims = [[time_dim]],
+                              output_core_dims = [["statistic", group]],
+                              kwargs = dict(codes = cal_climatology_codes(data[time_dim], group), n_group = n_group),
+                              dask = "allowed").compute()
+
+        for variable in compute_variables:
+            variable_sums = sums[variable].values
+            if smoothing_window is not None:
+                variable_sums = cal_circular_running_sum(variable_sums, smoothing_window)
+            
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = variable_sums[..., 0, :]/np.where(variable_sums[..., 1, :] > 0, variable_sums[..., 1, :], np.nan)
+            dims = [dim for dim in sums[variable].dims if dim != "statistic"]
+            climatologies[variable] = xr.DataArray(values, dims = dims, coords = {dim: data[dim] for dim in dims if dim in data.coords}, attrs = data[variable].attrs)
+        
+    result = xr.Dataset(climatologies).assign_coords({group: climatology_group_coords[group]})
+    result.attrs = dict(data.attrs, climatology_group = group, climatology_period = period)
+    if smoothing_window is not None:
+        result.attrs["climatology_smoothing_window"] = smoothing_window
+
+    if cache_dir is not None:
+        for variable in compute_variables:
+            path = gen_climatology_path(cache_dir, dataset_id, variable, group, period, smoothing_window)
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            writer.save_dataset(result[[variable]], path)
+    return result
+
+
+def subtract_group_values(values, group_values, codes):
+    """Subtracts the value of the group of each element along the last axis for numpy or dask arrays. Dask arrays are processed chunk by chunk.
+
+    Args:
+        values (np.array or dask.array.Array): Values with the grouped dimension as last axis
+        group_values (np.array): Values of the groups along the last axis, leading axes of length one are broadcasted
+        codes (np.array of int): Group index of each element along the last axis
+
+    Returns:
+        np.array or dask.array.Array: Values minus the values of their groups
+    """
+    if not utils.is_dask_array(values):
+        return values - group_values[..., codes]
+
+    def subtract_block(block, block_info=None):
+        location = block_info[0]["array-location"]
+        index = tuple(slice(start, stop) if group_values.shape[axis] > 1 else slice(None) for axis, (start, stop) in enumerate(location[:-1]))
+        start, stop = location[-1]
+        return block - group_values[index + (codes[start:stop],)]
+
+    return values.map_blocks(subtract_block, dtype = np.result_type(values.dtype, group_values.dtype))
+
+
+@profiling.profiled
+@provenance.tracked
+def cal_climatology_anomaly(data, group="month", period_start=None, period_end=None, smoothing_window=None, cache_dir=None, dataset_id=None, climatology=None, time_dim="time"):
+    """Calculates the anomaly of all time dependent variables with respect to their monthly, day-of-year or seasonal climatology (see cal_climatology).
+    The climatology is subtracted lazily, dask backed variables stay dask backed.
+
+    Args:
+        data (xarray.Dataset): Input Dataset
+        group (str, optional): "month", "dayofyear" or "season". Defaults to "month".
+        period_start (str, optional): Start of the reference period. Defaults to None.
+        period_end (str, optional): End of the reference period. Defaults to None.
+        smoothing_window (int, optional): Window of the smoothing of the climatology. Defaults to None.
+        cache_dir (str, optional): Folder of the climatology cache. Defaults to None.
+        dataset_id (str, optional): Identifier of the dataset, required with cache_dir. Defaults to None.
+        climatology (xarray.Dataset, optional): Precomputed climatology, if given all other climatology arguments are ignored. Defaults to None.
+        time_dim (str, optional): Name of the time dimension. Defaults to "time".
+
+    Returns:
+        xarray.Dataset: Anomaly Dataset
+    """
+    if climatology is None:
+        climatology = cal_climatology(data, group = group, period_start = period_start, period_end = period_end, smoothing_window = smoothing_window,
+                                      cache_dir = cache_dir, dataset_id = dataset_id, time_dim = time_dim)
+    group = climatology.attrs["climatology_group"]
+
+    variables = list(climatology.data_vars)
+    ind_variables = [variable for variable in data.data_vars if variable not in variables]
+    anomaly = xr.apply_ufunc(subtract_group_values, data[variables], climatology[variables],
+                             input_core_dims = [[time_dim], [group]],
+                             output_core_dims = [[time_dim]],
+                             kwargs = dict(codes = cal_climatology_codes(data[time_dim], group)),
+                             dask = "allowed")
+    for variable in variables:
+        anomaly[variable] = anomaly[variable].transpose(*data[variable].dims)
+
+    result = xr.merge([data[ind_variables], anomaly], combine_attrs = "override")
+    
+    processing_message = "Calculated {} climatology anomaly relative to {}".format(group, climatology.attrs["climatology_period"])
+    processing_id = "_".join([group, "anomaly"])
+    utils.add_processing_attributes(result, 
+                                    processing_message = processing_message,
+                                    processing_id = processing_id)
+    return result
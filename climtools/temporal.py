@@ -6,6 +6,8 @@ import matplotlib.pyplot as plt
 import warnings
 import logging
 from . import utils
+from . import provenance
+from . import profiling
 
 temporal_resolution_dict = dict(
 day="1D",
@@ -16,8 +18,313 @@ season_jan = "QS-JAN",
 season_feb = "QS-FEB",
 year ="1Y")
 
+season_anchor_month_dict = dict(
+season = 1,
+season_dec = 12,
+season_jan = 1,
+season_feb = 2)
+
+frequency_resolution_dict = dict(
+day="day",
+mon="month",
+yr="year",
+dec="multiyear")
+
+resolution_frequency_dict = dict(
+day="day",
+month="mon",
+year="yr")
+
 timedelta_1D = np.timedelta64(1,"D")
 
+default_max_chunk_bytes = 128*2**20
+
+calendar_alias_dict = {
+"gregorian": "standard",
+"365_day": "noleap",
+"366_day": "all_leap"}
+
+calendar_year_length_dict = {
+"noleap": 365,
+"all_leap": 366,
+"360_day": 360}
+
+calendars = ("standard", "proleptic_gregorian", "julian", "noleap", "all_leap", "360_day")
+
+calendar_date_type_dict = {
+"standard": "DatetimeGregorian",
+"proleptic_gregorian": "DatetimeProlepticGregorian",
+"julian": "DatetimeJulian",
+"noleap": "DatetimeNoLeap",
+"all_leap": "DatetimeAllLeap",
+"360_day": "Datetime360Day"}
+
+month_start_table = np.cumsum([[0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+                               [0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]], axis=1)
+
+time_units = "days since 0001-01-01 00:00:00"
+microseconds_per_day = 86400*10**6
+
+
+def normalize_calendar(calendar):
+    """Maps a CF calendar name onto its canonical name (e.g. gregorian -> standard, 365_day -> noleap)
+
+    Args:
+        calendar (str): CF calendar name
+
+    Raises:
+        ValueError: If the calendar is not a known CF calendar
+
+    Returns:
+        str: Canonical calendar name
+    """
+    calendar = calendar.lower()
+    calendar = calendar_alias_dict.get(calendar, calendar)
+    if calendar not in calendars:
+        raise ValueError("Calendar {} not implemented. Must be one of {}".format(calendar, list(calendars) + list(calendar_alias_dict)))
+    return calendar
+
+
+def get_calendar(time):
+    """Returns the calendar of a time coordinate, taken from the encoding if available and from the first timestamp otherwise
+
+    Args:
+        time (xarray.DataArray): DataArray containing cftime.datetime Objects
+
+    Returns:
+        str: Canonical calendar name
+    """
+    if "calendar" in time.encoding:
+        return normalize_calendar(time.encoding["calendar"])
+    return normalize_calendar(time.values.flat[0].calendar)
+
+
+def cal_year_properties(years, calendar):
+    """Calculates the length and the leap year flag for an array of years in a given calendar in a single vectorized pass.
+    Leap year rules follow https://github.com/Unidata/cftime/blob/master/src/cftime/_cftime.pyx, i.e. the standard calendar
+    is julian before and gregorian after 1582 (which is shortened by the 10 days of the calendar reform) and the julian based
+    calendars have no year zero, so that year -1 is a leap year.
+
+    Args:
+        years (array_like of int): Years
+        calendar (str): CF calendar name
+
+    Returns:
+        tuple(np.array of int, np.array of bool): Number of days in each year and leap year flags
+    """
+    calendar = normalize_calendar(calendar)
+    years = np.asarray(years, dtype=np.int64)
+
+    if calendar in calendar_year_length_dict:
+        year_length = calendar_year_length_dict[calendar]
+        leap = np.full(years.shape, calendar == "all_leap")
+        return np.full(years.shape, year_length, dtype=np.int64), leap
+
+    if calendar == "proleptic_gregorian":
+        years_astronomical = years
+    else:
+        years_astronomical = np.where(years < 0, years + 1, years)
+
+    leap_julian = years_astronomical % 4 == 0
+    leap_gregorian = leap_julian & ((years_astronomical % 100 != 0) | (years_astronomical % 400 == 0))
+
+    if calendar == "proleptic_gregorian":
+        leap = leap_gregorian
+    elif calendar == "julian":
+        leap = leap_julian
+    else:
+        leap = np.where(years > 1581, leap_gregorian, leap_julian)
+
+    year_length = 365 + leap.astype(np.int64)
+    if calendar == "standard":
+        year_length = np.where(years == 1582, year_length - 10, year_length)
+
+    return year_length, leap
+
+
+def cal_year_length(years, calendar):
+    """Returns the number of days for an array of years in a given calendar
+
+    Args:
+        years (array_like of int): Years
+        calendar (str): CF calendar name
+
+    Returns:
+        np.array of int: Number of days in each year
+    """
+    return cal_year_properties(years, calendar)[0]
+
+
+def cal_leap_year(years, calendar):
+    """Returns the leap year flags for an array of years in a given calendar
+
+    Args:
+        years (array_like of int): Years
+        calendar (str): CF calendar name
+
+    Returns:
+        np.array of bool: True for leap years
+    """
+    return cal_year_properties(years, calendar)[1]
+
+
+def gen_year_start_table(year_min, year_max, calendar):
+    """Generates the number of days since 0001-01-01 of the first day of each year between two years
+
+    Args:
+        year_min (int): First year
+        year_max (int): Last year
+        calendar (str): CF calendar name
+
+    Returns:
+        tuple(np.array of int, np.array of int): Years (without year zero for the julian based calendars) and the days since 0001-01-01 of their first day
+    """
+    calendar = normalize_calendar(calendar)
+    table_years = np.arange(min(year_min, 1), max(year_max, 1) + 1, dtype=np.int64)
+    if calendar in ("standard", "julian"):
+        table_years = table_years[table_years != 0]
+    table_starts = np.concatenate([[0], np.cumsum(cal_year_length(table_years, calendar))[:-1]])
+    table_starts = table_starts - table_starts[np.searchsorted(table_years, 1)]
+    return table_years, table_starts
+
+
+def cal_days_since_epoch(years, months, days, calendar):
+    """Calculates the number of days since 0001-01-01 for arrays of dates in a given calendar with integer arithmetic
+
+    Args:
+        years (array_like of int): Years
+        months (array_like of int): Months
+        days (array_like of int): Days of the month
+        calendar (str): CF calendar name
+
+    Returns:
+        np.array of int: Days since 0001-01-01
+    """
+    calendar = normalize_calendar(calendar)
+    years, months, days = np.broadcast_arrays(*[np.asarray(values, dtype=np.int64) for values in [years, months, days]])
+
+    if calendar == "360_day":
+        return (years - 1)*360 + (months - 1)*30 + days - 1
+
+    leap = cal_leap_year(years, calendar).astype(np.int64)
+    day_of_year = month_start_table[leap, months - 1] + days - 1
+    if calendar == "standard":
+        day_of_year = day_of_year - 10*((years == 1582) & (day_of_year >= 287))
+
+    if calendar in calendar_year_length_dict:
+        return (years - 1)*calendar_year_length_dict[calendar] + day_of_year
+    if years.size == 0:
+        return day_of_year
+
+    table_years, table_starts = gen_year_start_table(years.min(), years.max(), calendar)
+    return table_starts[np.searchsorted(table_years, years)] + day_of_year
+
+
+def cal_dates_from_days(days, calendar):
+    """Calculates the dates of arrays of days since 0001-01-01 in a given calendar with integer arithmetic, the inverse of cal_days_since_epoch
+
+    Args:
+        days (array_like of int): Days since 0001-01-01
+        calendar (str): CF calendar name
+
+    Returns:
+        tuple(np.array of int, np.array of int, np.array of int): Years, months and days of the month
+    """
+    calendar = normalize_calendar(calendar)
+    days = np.asarray(days, dtype=np.int64)
+
+    if calendar in calendar_year_length_dict:
+        year_length = calendar_year_length_dict[calendar]
+        years = days//year_length + 1
+        day_of_year = days - (years - 1)*year_length
+    elif days.size == 0:
+        years = day_of_year = days
+    else:
+        table_years, table_starts = gen_year_start_table(days.min()//365 - 1, days.max()//365 + 1, calendar)
+        index = np.searchsorted(table_starts, days, side="right") - 1
+        years = table_years[index]
+        day_of_year = days - table_starts[index]
+
+    if calendar == "360_day":
+        return years, day_of_year//30 + 1, day_of_year%30 + 1
+
+    if calendar == "standard":
+        day_of_year = day_of_year + 10*((years == 1582) & (day_of_year >= 277))
+    month_starts = month_start_table[cal_leap_year(years, calendar).astype(np.int64)]
+    months = np.sum(day_of_year[..., np.newaxis] >= month_starts[..., 1:12], axis=-1) + 1
+    return years, months, day_of_year - np.take_along_axis(month_starts, (months - 1)[..., np.newaxis], axis=-1)[..., 0] + 1
+
+
+def encode_cftime(times, calendar):
+    """Converts datetime objects into microseconds since 0001-01-01 in a given calendar. Only the fields of the objects are read.
+
+    Args:
+        times (array_like of cftime.datetime): Timestamps
+        calendar (str): CF calendar name
+
+    Returns:
+        np.array of int: Microseconds since 0001-01-01
+    """
+    times = np.asarray(times)
+    fields = np.array([(time.year, time.month, time.day, time.hour, time.minute, time.second, time.microsecond) for time in times.ravel()], dtype=np.int64)
+    fields = fields.reshape(times.shape + (7,))
+    
+    days = cal_days_since_epoch(fields[..., 0], fields[..., 1], fields[..., 2], calendar)
+    seconds = fields[..., 3]*3600 + fields[..., 4]*60 + fields[..., 5]
+    return days*microseconds_per_day + seconds*10**6 + fields[..., 6]
+
+
+def decode_cftime(microseconds, calendar):
+    """Converts microseconds since 0001-01-01 into cftime.datetime objects of a given calendar, the inverse of encode_cftime
+
+    Args:
+        microseconds (array_like of int): Microseconds since 0001-01-01
+        calendar (str): CF calendar name
+
+    Returns:
+        np.array of cftime.datetime: Timestamps
+    """
+    import cftime
+    calendar = normalize_calendar(calendar)
+    date_type = getattr(cftime, calendar_date_type_dict[calendar])
+
+    microseconds = np.asarray(microseconds, dtype=np.int64)
+    days, microseconds = np.divmod(microseconds, microseconds_per_day)
+    seconds, microseconds = np.divmod(microseconds, 10**6)
+    fields = cal_dates_from_days(days, calendar) + (seconds//3600, seconds//60%60, seconds%60, microseconds)
+
+    times = (date_type(*field) for field in zip(*[field.ravel().tolist() for field in fields]))
+    return np.fromiter(times, dtype=object, count=days.size).reshape(days.shape)
+
+
+def gen_period_starts(start, end, resolution, calendar):
+    """Generates the first day of all periods of a given resolution which start between a start and an end point
+
+    Args:
+        start (cftime.datetime): Beginning of the range
+        end (cftime.datetime): End of the range
+        resolution (str): One of the keys of temporal_resolution_dict
+        calendar (str): CF calendar name
+
+    Returns:
+        np.array of int: Days since 0001-01-01 of the first day of each period
+    """
+    assert resolution in temporal_resolution_dict, "Resolution must be one of the following: {}".format(list(temporal_resolution_dict))
+    start_microseconds, end_microseconds = encode_cftime([start, end], calendar)
+
+    if resolution == "day":
+        starts = np.arange(start_microseconds//microseconds_per_day, end_microseconds//microseconds_per_day + 1)
+    elif resolution == "year":
+        starts = cal_days_since_epoch(np.arange(start.year, end.year + 1), 1, 1, calendar)
+    else:
+        step, anchor_month = (1, 1) if resolution == "month" else (3, season_anchor_month_dict[resolution])
+        month_codes = np.arange(start.year*12 + start.month - 1, end.year*12 + end.month)
+        month_codes = month_codes[(month_codes - anchor_month + 1) % step == 0]
+        starts = cal_days_since_epoch(month_codes//12, month_codes%12 + 1, 1, calendar)
+
+    starts_microseconds = starts*microseconds_per_day
+    return starts[(starts_microseconds >= start_microseconds) & (starts_microseconds <= end_microseconds)]
+
 
 def cal_timedelta_year(time):
     """Calculates the duration for each year in each timestamp
@@ -26,11 +333,11 @@ def cal_timedelta_year(time):
         time (xarray.DataArray): DataArray containing cftime.datetime Objects
 
     Returns:
-        [:obj: `np.array` of :obj: `timedelta64`]: [description]
+        [:obj: `np.array` of :obj: `timedelta64`]: Duration of the year of each timestamp
     """
-    leap_years = [is_leap_year(time_value) for time_value in time.values]
+    year_length = cal_year_length(time.dt.year.values, get_calendar(time))
 
-    timedelta = (365 + np.array(leap_years))*timedelta_1D
+    timedelta = year_length*timedelta_1D
     return timedelta
     
 
@@ -47,17 +354,114 @@ def cal_timedelta_month(time):
     return timedelta
 
 
-def get_temporal_resolution(data):
-    """ Returns the temporal resolution of a given xarray object from the time_bnds variable
+@profiling.profiled
+def get_temporal_resolution(data, full_validation=False, n_sample=3):
+    """ Returns the temporal resolution of a given xarray object from the time_bnds variable.
+    By default the resolution is decided from the first and last n_sample bounds only, so that only these elements
+    of time_bnds have to be loaded. The result is cached on the object, so that repeated calls are free as long as time_bnds is unchanged.
+
     Args:
         data (Dataset): Input Dataset must contain at least the dimension "time_bnds"
+        full_validation (bool, optional): Check all bounds instead of a sample. Defaults to False.
+        n_sample (int, optional): Number of bounds at the beginning and the end of the time series used for the detection. Defaults to 3.
 
     Returns:
         str: Name of the temporal resolution detected
     """
+    cache = utils.get_object_cache(data)
+    time_bnds_variable = data["time_bnds"].variable
+
+    if "temporal_resolution" in cache:
+        cached_variable, temporal_resolution, validated = cache["temporal_resolution"]
+        if cached_variable is time_bnds_variable and (validated or not full_validation):
+            return temporal_resolution
+
+    time_stmp = data.time
+    time_bnds = data.time_bnds
+    n_time = data.sizes["time"]
+
+    validated = full_validation or n_time <= 2*n_sample
+    if not validated:
+        index = np.concatenate([np.arange(n_sample), np.arange(n_time - n_sample, n_time)])
+        time_stmp = time_stmp.isel(time=index)
+        time_bnds = time_bnds.isel(time=index)
+
+    temporal_resolution = detect_temporal_resolution(time_stmp, time_bnds)
+    cache["temporal_resolution"] = (time_bnds_variable, temporal_resolution, validated)
+    return temporal_resolution
+
+
+def get_cached_temporal_resolution(data):
+    """ Returns the temporal resolution cached on an object by get_temporal_resolution or set_temporal_resolution without reading any element of time_bnds
+
+    Args:
+        data (Dataset): Input Dataset
+
+    Returns:
+        str: Name of the cached temporal resolution or None if no resolution is cached for the current time_bnds
+    """
+    cache = utils.get_object_cache(data)
+    if "temporal_resolution" not in cache or "time_bnds" not in data.variables:
+        return None
+    cached_variable, temporal_resolution, validated = cache["temporal_resolution"]
+    if cached_variable is not data["time_bnds"].variable:
+        return None
+    return temporal_resolution
+
+
+def copy_cached_temporal_resolution(data, data_copy):
+    """ Carries the temporal resolution cached on an object over to a shallow copy. Shallow copies share the values of time_bnds but have new
+    variable objects, for which the cache of the original object is not valid.
+
+    Args:
+        data (Dataset): Original Dataset
+        data_copy (Dataset): Shallow copy of data, its cache is changed in place
+    """
+    temporal_resolution = get_cached_temporal_resolution(data)
+    if temporal_resolution is not None:
+        validated = utils.get_object_cache(data)["temporal_resolution"][2]
+        utils.get_object_cache(data_copy)["temporal_resolution"] = (data_copy["time_bnds"].variable, temporal_resolution, validated)
+
+
+def get_frequency_temporal_resolution(data):
+    """ Returns the temporal resolution given by the CMIP frequency attribute
+
+    Args:
+        data (Dataset): Input Dataset
+
+    Returns:
+        str: Name of the temporal resolution or None if the frequency attribute is missing or has no corresponding resolution
+    """
+    return frequency_resolution_dict.get(data.attrs.get("frequency"))
 
-    time_stmp = data.time.compute()
-    time_bnds = data.time_bnds.compute()
+
+def set_temporal_resolution(data, temporal_resolution):
+    """ Sets the temporal resolution of an object whose time_bnds were generated for a known resolution. The resolution is cached on the object
+    and the CMIP frequency attribute is updated, or removed if there is no corresponding frequency.
+
+    Args:
+        data (Dataset): Dataset with the variable time_bnds, changed in place
+        temporal_resolution (str): Name of the temporal resolution
+    """
+    utils.get_object_cache(data)["temporal_resolution"] = (data["time_bnds"].variable, temporal_resolution, True)
+    if temporal_resolution in resolution_frequency_dict:
+        data.attrs["frequency"] = resolution_frequency_dict[temporal_resolution]
+    else:
+        data.attrs.pop("frequency", None)
+
+
+def detect_temporal_resolution(time_stmp, time_bnds):
+    """ Returns the temporal resolution by comparing all given bounds with the length of days, months and years
+
+    Args:
+        time_stmp (xarray.DataArray): Timestamps containing cftime.datetime Objects
+        time_bnds (xarray.DataArray): Bounds of the timestamps with dimension bnds
+
+    Returns:
+        str: Name of the temporal resolution detected
+    """
+    time_stmp = time_stmp.compute()
+    time_bnds = time_bnds.compute()
     time_max = time_bnds.isel(bnds=1)
     time_min = time_bnds.isel(bnds=0)
     timedelta = xr.apply_ufunc(np.subtract,time_max, time_min, dask="parallelized")
@@ -81,7 +485,6 @@ def get_temporal_resolution(data):
         return "multiyear"
     else: 
         raise Exception("No valid timedelta could be identified")
-        
 
 
 def cal_middle_time(time_1, time_2):
@@ -101,29 +504,214 @@ def cal_middle_time(time_1, time_2):
     
 
 def gen_time_bnds_stmp(data, target_resolution):
-    """[summary]
+    """Generates the time bounds and the middle timestamps of the periods of a target resolution
 
     Args:
-        resample ([type]): [description]
+        data (xarray.Dataset): Dataset containing time and time_bnds
+        target_resolution (str): Target resolution
 
     Returns:
-        [type]: [description]
+        xarray.DataArray: time_bnds of the target periods with the middle of each period as time coordinate
     """
-    resample = data.time_bnds.compute().resample(time = temporal_resolution_dict[target_resolution])
+    bin_starts = cal_bin_starts(cal_bin_codes(data.time, target_resolution))
+    return gen_time_bnds_bins(data.time_bnds, bin_starts)
+
 
-    time_bnds_min = resample.first().isel(bnds=0)
-    time_bnds_max = resample.last().isel(bnds=1)
+def gen_time_bnds_bins(time_bnds, bin_starts):
+    """Generates the time bounds and the middle timestamps of contiguous bins along the time dimension.
+    Only the first and the last bound of each bin are read.
+
+    Args:
+        time_bnds (xarray.DataArray): Time bounds with dimensions time and bnds
+        bin_starts (np.array of int): Index of the first timestamp of each bin
+
+    Returns:
+        xarray.DataArray: time_bnds of the bins with the middle of each bin as time coordinate
+    """
+    bin_ends = np.append(bin_starts[1:], time_bnds.sizes["time"]) - 1
+
+    time_bnds_min = time_bnds.isel(time = bin_starts, bnds = 0).values
+    time_bnds_max = time_bnds.isel(time = bin_ends, bnds = 1).values
+
+    if time_bnds_min.dtype.kind in "iuf":
+        time_stmp = (time_bnds_min + time_bnds_max)/2
+    else:
+        calendar = get_calendar(time_bnds)
+        time_stmp = decode_cftime((encode_cftime(time_bnds_min, calendar) + encode_cftime(time_bnds_max, calendar))//2, calendar)
+
+    time_bnds = xr.DataArray(np.stack([time_bnds_min, time_bnds_max], axis=1), dims = ["time", "bnds"], coords = {"time":time_stmp}, attrs = time_bnds.attrs)
+    return time_bnds.rename("time_bnds")
+
+
+def cal_bin_codes(time, target_resolution):
+    """Calculates an integer code of the target period for each timestamp, e.g. year*12 + month for monthly periods.
+
+    Args:
+        time (xarray.DataArray): DataArray containing cftime.datetime Objects
+        target_resolution (str): Target resolution, one of the keys of temporal_resolution_dict
+
+    Returns:
+        np.array of int: Code of the period each timestamp belongs to
+    """
+    index = time.to_index()
+    year = np.asarray(index.year, dtype=np.int64)
+    month = np.asarray(index.month, dtype=np.int64)
+
+    if target_resolution == "day":
+        return (year*12 + month - 1)*31 + np.asarray(index.day, dtype=np.int64) - 1
+    if target_resolution == "month":
+        return year*12 + month - 1
+    if target_resolution == "year":
+        return year
     
-    time_bnds_min = xr.CFTimeIndex(time_bnds_min.values)
-    time_bnds_max = xr.CFTimeIndex(time_bnds_max.values)
+    return (year*12 + month - season_anchor_month_dict[target_resolution])//3
+
 
-    time_stmp = cal_middle_time(time_bnds_min, time_bnds_max)
+def cal_bin_starts(codes):
+    """Returns the index of the first element of each run of equal codes
 
-    time_bnds_min = xr.DataArray(time_bnds_min, dims = ["time"], coords = {"time":time_stmp}) 
-    time_bnds_max = xr.DataArray(time_bnds_max, dims = ["time"], coords = {"time":time_stmp})
+    Args:
+        codes (np.array of int): Period codes of sorted timestamps
+
+    Returns:
+        np.array of int: Index of the first timestamp of each bin
+    """
+    return np.flatnonzero(np.diff(codes, prepend=codes[0] - 1))
+
+
+def weighted_segment_mean(values, weights, bin_starts, skipna=True):
+    """Calculates the weighted mean of contiguous segments along the last axis as segment-sum of value*weight divided by the segment-sum of weight.
+
+    Args:
+        values (np.array): Values with the segmented dimension as last axis
+        weights (np.array): Weights along the last axis
+        bin_starts (np.array of int): Index of the first element of each segment
+        skipna (bool, optional): Ignore nan values. Otherwise a single nan value leads to a nan in the segment. Defaults to True.
+
+    Returns:
+        np.array: Weighted mean of each segment along the last axis
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weighted = values*weights
+
+        if skipna:
+            nan = np.isnan(weighted)
+            np.copyto(weighted, 0, where=nan)
+            weights_sum = np.add.reduceat(np.where(nan, 0, weights), bin_starts, axis=-1)
+        else:
+            weights_sum = np.add.reduceat(weights, bin_starts)
+
+        return np.add.reduceat(weighted, bin_starts, axis=-1)/weights_sum
+
+
+def cal_aligned_chunks(bin_starts, n_time, bytes_per_step, max_chunk_bytes=default_max_chunk_bytes):
+    """Groups contiguous bins into chunks along time, so that chunk boundaries coincide with bin boundaries and every chunk stays below max_chunk_bytes.
+    A bin that alone exceeds max_chunk_bytes becomes a chunk on its own.
+
+    Args:
+        bin_starts (np.array of int): Index of the first timestamp of each bin
+        n_time (int): Length of the time dimension
+        bytes_per_step (int): Memory needed for a single timestep
+        max_chunk_bytes (int, optional): Memory budget of a chunk. Defaults to default_max_chunk_bytes.
+
+    Returns:
+        tuple(tuple of int, tuple of int): Number of timesteps and number of bins in each chunk
+    """
+    bin_sizes = np.diff(np.append(bin_starts, n_time))
+    max_steps = max(max_chunk_bytes//max(bytes_per_step, 1), 1)
+
+    time_chunks = []
+    bin_chunks = []
+    chunk_size = 0
+    chunk_bins = 0
+    for bin_size in bin_sizes:
+        if chunk_bins and chunk_size + bin_size > max_steps:
+            time_chunks.append(chunk_size)
+            bin_chunks.append(chunk_bins)
+            chunk_size = 0
+            chunk_bins = 0
+        chunk_size += int(bin_size)
+        chunk_bins += 1
     
-    time_bnds = xr.concat([time_bnds_min, time_bnds_max], dim ="bnds")
-    return time_bnds.rename("time_bnds")
+    time_chunks.append(chunk_size)
+    bin_chunks.append(chunk_bins)
+    return tuple(time_chunks), tuple(bin_chunks)
+
+
+def weighted_segment_mean_blockwise(values, weights, bin_starts, skipna=True, max_chunk_bytes=default_max_chunk_bytes):
+    """Calculates the weighted mean of contiguous segments along the last axis of a dask array.
+    The array is rechunked along the last axis such that no segment crosses a chunk boundary and every chunk is reduced independently,
+    which results in one task per chunk.
+
+    Args:
+        values (dask.array.Array): Values with the segmented dimension as last axis
+        weights (np.array): Weights along the last axis
+        bin_starts (np.array of int): Index of the first element of each segment
+        skipna (bool, optional): Ignore nan values. Defaults to True.
+        max_chunk_bytes (int, optional): Memory budget of a chunk. Defaults to default_max_chunk_bytes.
+
+    Returns:
+        dask.array.Array: Weighted mean of each segment along the last axis
+    """
+    n_time = values.shape[-1]
+    bytes_per_step = np.dtype(float).itemsize*int(np.prod([max(chunks) for chunks in values.chunks[:-1]]))
+    time_chunks, bin_chunks = cal_aligned_chunks(bin_starts, n_time, bytes_per_step, max_chunk_bytes)
+
+    if values.chunks[-1] != time_chunks:
+        values = values.rechunk(values.chunks[:-1] + (time_chunks,))
+
+    def reduce_block(block, block_info=None):
+        start, stop = block_info[0]["array-location"][-1]
+        block_bin_starts = bin_starts[(bin_starts >= start) & (bin_starts < stop)] - start
+        return weighted_segment_mean(block, weights[start:stop], block_bin_starts, skipna = skipna)
+
+    return values.map_blocks(reduce_block, chunks = values.chunks[:-1] + (bin_chunks,), dtype = float)
+
+
+def reduce_bins(values, weights, bin_starts, skipna=True, max_chunk_bytes=default_max_chunk_bytes):
+    """Calculates the weighted mean of contiguous segments along the last axis for numpy or dask arrays
+
+    Args:
+        values (np.array or dask.array.Array): Values with the segmented dimension as last axis
+        weights (np.array): Weights along the last axis
+        bin_starts (np.array of int): Index of the first element of each segment
+        skipna (bool, optional): Ignore nan values. Defaults to True.
+        max_chunk_bytes (int, optional): Memory budget of a chunk for dask arrays. Defaults to default_max_chunk_bytes.
+
+    Returns:
+        np.array or dask.array.Array: Weighted mean of each segment along the last axis
+    """
+    if utils.is_dask_array(values):
+        return weighted_segment_mean_blockwise(values, weights, bin_starts, skipna = skipna, max_chunk_bytes = max_chunk_bytes)
+    return weighted_segment_mean(values, weights, bin_starts, skipna = skipna)
+
+
+def cal_weighted_bin_mean(data, bin_starts, weights, skipna=True, time_dim="time", max_chunk_bytes=default_max_chunk_bytes):
+    """Calculates the weighted mean over contiguous bins along the time dimension for all variables of a dataset in one pass.
+    Dask backed variables are reduced chunk by chunk (see weighted_segment_mean_blockwise).
+
+    Args:
+        data (xarray.Dataset): Dataset with numeric variables that all depend on time_dim
+        bin_starts (np.array of int): Index of the first timestamp of each bin
+        weights (np.array): Weight of each timestamp
+        skipna (bool, optional): Ignore nan values. Defaults to True.
+        time_dim (str, optional): Name of the time dimension. Defaults to "time".
+        max_chunk_bytes (int, optional): Memory budget of a chunk for dask backed variables. Defaults to default_max_chunk_bytes.
+
+    Returns:
+        xarray.Dataset: Dataset with one timestep per bin. The time dimension has no coordinate.
+    """
+    result = xr.apply_ufunc(reduce_bins, data,
+                            input_core_dims = [[time_dim]],
+                            output_core_dims = [["time_bin"]],
+                            kwargs = dict(weights = weights, bin_starts = bin_starts, skipna = skipna, max_chunk_bytes = max_chunk_bytes),
+                            dask = "allowed")
+    
+    result = result.rename({"time_bin": time_dim})
+    for variable in result.data_vars:
+        result[variable] = result[variable].transpose(*data[variable].dims)
+    return result
+
 
 def cal_monthly_weights(data, target_resolution, time_dimension = "time"):
     """[summary]
@@ -146,12 +734,17 @@ def cal_monthly_weights(data, target_resolution, time_dimension = "time"):
     return weights
 
 
-def temporal_downsampling(data, target_resolution):
+@profiling.profiled
+@provenance.tracked
+def temporal_downsampling(data, target_resolution, max_chunk_bytes=default_max_chunk_bytes):
     """This function downsamples (averages) a given dataset to a given target resolution. The target resolutions must be coarser than the time resolution of the dataset provided.py
+    Dask backed variables are rechunked along time to whole target periods and every chunk is reduced independently, so the result stays lazy
+    with one task per chunk.
     
     Args:
         data (xarray.Dataset): Input Dataset. Must contain dimension time as well as the variable time_bnds for inferring the resolution
         target_resolution (string): Target Resolution.
+        max_chunk_bytes (int, optional): Memory budget of a chunk for dask backed variables. Defaults to default_max_chunk_bytes.
 
     Returns:
         xarray.Dataset: Dataset with a new temporal resolution
@@ -169,67 +762,173 @@ def temporal_downsampling(data, target_resolution):
     resample_variables = decomposition_dependent_variables["dependent"]
     leftover_variables = decomposition_dependent_variables["independent"]
     
+    data_result, time_bnds = downsample_variables(data, resample_variables, temporal_resolution, target_resolution, max_chunk_bytes = max_chunk_bytes)
+
+    with profiling.profile("temporal.merge") as event:
+        data_comb = xr.merge([data_result, time_bnds, data[leftover_variables]], combine_attrs="override")
+        event.set_result(data_comb)
+
+    utils.add_processing_attributes(data_comb, processing_message="Temporal downsampling from {} to {}".format(temporal_resolution_dict[temporal_resolution],temporal_resolution_dict[target_resolution]) , processing_id=temporal_resolution_dict[target_resolution])
+    set_temporal_resolution(data_comb, target_resolution)
+
+
+    return data_comb
     
-    
+
+@profiling.profiled
+def downsample_variables(data, variables, temporal_resolution, target_resolution, max_chunk_bytes=default_max_chunk_bytes):
+    """Downsamples the given time dependent variables of a dataset without merging the result back into the dataset. Non numeric variables,
+    e.g. flags or labels, take the value of the first timestep of each bin and time_bnds is replaced by the bounds of the bins.
+
+    Args:
+        data (xarray.Dataset): Input Dataset with the variable time_bnds
+        variables (list): Time dependent variables to downsample
+        temporal_resolution (string): Temporal resolution of the dataset
+        target_resolution (string): Target Resolution
+        max_chunk_bytes (int, optional): Memory budget of a chunk for dask backed variables. Defaults to default_max_chunk_bytes.
+
+    Returns:
+        xarray.Dataset: Downsampled variables
+        xarray.DataArray: Time bounds of the target resolution
+    """
+    time = data.time
+    bin_starts = cal_bin_starts(cal_bin_codes(time, target_resolution))
+
     if temporal_resolution =="month":
-        weights = cal_monthly_weights(data, target_resolution)
-        data_weighted = data.copy()
-        for variable in resample_variables:
-            if variable!="time_bnds":
-                data_weighted[variable] = data[variable]*weights
-                
-        
-        data_resample = data_weighted[resample_variables].resample(time = temporal_resolution_dict[target_resolution], keep_attrs=True)
-        data_result = data_resample.sum(skipna=False)
-        
+        weights = time.dt.daysinmonth.values.astype(float)
+        skipna = False
     else:
-        data_resample = data[resample_variables].resample(time = temporal_resolution_dict[target_resolution], keep_attrs=True)
-        
-        data_result = data_resample.mean()
-
-    time_bnds = gen_time_bnds_stmp(data, target_resolution)
+        weights = np.ones(time.size)
+        skipna = True
+    
+    reduce_variables = [variable for variable in variables if variable != "time_bnds" and is_numeric(data[variable])]
+    first_variables = [variable for variable in variables if variable != "time_bnds" and not is_numeric(data[variable])]
+    data_result = cal_weighted_bin_mean(data[reduce_variables], bin_starts, weights, skipna = skipna, max_chunk_bytes = max_chunk_bytes)
+    if len(first_variables) > 0:
+        data_first = data[first_variables].isel(time = bin_starts).drop_vars("time")
+        data_result = data_result.assign({variable: data_first[variable] for variable in first_variables})
+
+    time_bnds = gen_time_bnds_bins(data.time_bnds, bin_starts)
     data_result = data_result.assign_coords(time = time_bnds.time)
+    return data_result, time_bnds
 
-    data_comb = xr.merge([data_result, time_bnds, data[leftover_variables]], combine_attrs="override")
 
-    utils.add_processing_attributes(data_comb, processing_message="Temporal downsampling from {} to {}".format(temporal_resolution_dict[temporal_resolution],temporal_resolution_dict[target_resolution]) , processing_id=temporal_resolution_dict[target_resolution])
+def is_numeric(data):
+    """Checks whether a DataArray has a numeric or boolean dtype
 
+    Args:
+        data (xarray.DataArray): DataArray to check
+
+    Returns:
+        bool: True for numeric and boolean dtypes
+    """
+    return np.issubdtype(data.dtype, np.number) or np.issubdtype(data.dtype, np.bool_)
 
-    return data_comb
-    
 
 def is_leap_year(time):
     """Checks whether a given cf.Datetime is actually a leap year. Function based on https://github.com/Unidata/cftime/blob/master/src/cftime/_cftime.pyx 
 
     Args:
         time (cftime.datetime): Datetime to check
+
+    Returns:
+        bool: True for leap years, None if the calendar is not implemented
     """
 
-    year = time.year
-    calendar = time.calendar
     leap = None
 
-    if calendar == "proleptic_gregorian":
-        if year % 4: # not divisible by 4
-            leap = False
-        elif year % 100: # not divisible by 100
-            leap = True
-        elif year % 400: # not divisible by 400
-            leap = False
-        else:
-            leap = True
-    else:
+    try:
+        leap = bool(cal_leap_year(time.year, time.calendar))
+    except ValueError:
         warnings.warn("Calendar not implemented yet")
     return leap
 
 
-def cal_rolling_time_mean(data, time_dim="time", window=10):
+def cal_window_extent(window, center=True):
+    """Returns the number of timesteps before and after the labelled timestep that are part of a rolling window.
+    Centered windows of even length extend one step further to the past, as in xarray.
+
+    Args:
+        window (int): Length of the rolling window
+        center (bool, optional): Centered or trailing window. Defaults to True.
+
+    Returns:
+        tuple(int, int): Number of timesteps before and after the labelled timestep
+    """
+    left = window//2 if center else window - 1
+    return left, window - 1 - left
+
+
+def rolling_window_mean(values, window, center=True, min_periods=None):
+    """Calculates the rolling mean along the last axis in O(N) from cumulative sums of the values and of the number of valid values.
+    The values are shifted by their mean before the summation to limit the loss of precision.
+
+    Args:
+        values (np.array): Values with the rolling dimension as last axis
+        window (int): Length of the rolling window
+        center (bool, optional): Centered or trailing window. Defaults to True.
+        min_periods (int, optional): Minimum number of valid values in a window. Defaults to the window length.
+
+    Returns:
+        np.array: Rolling mean with nan where less than min_periods values are valid
+    """
+    if min_periods is None:
+        min_periods = window
+    left, right = cal_window_extent(window, center)
+    n_time = values.shape[-1]
+
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=-1, keepdims=True)
+    offset = np.where(valid, values, 0).sum(axis=-1, keepdims=True)/np.maximum(n_valid, 1)
+
+    padding = [(0, 0)]*(values.ndim - 1) + [(1, 0)]
+    cumsum = np.pad(np.cumsum(np.where(valid, values - offset, 0), axis=-1), padding)
+    cumcount = np.pad(np.cumsum(valid, axis=-1), padding)
+
+    index = np.arange(n_time)
+    upper = np.minimum(index + right + 1, n_time)
+    lower = np.maximum(index - left, 0)
+
+    window_sum = cumsum[..., upper] - cumsum[..., lower]
+    window_count = cumcount[..., upper] - cumcount[..., lower]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = window_sum/window_count + offset
+    return np.where(window_count >= max(min_periods, 1), mean, np.nan)
+
+
+def rolling_mean(values, window, center=True, min_periods=None):
+    """Calculates the rolling mean along the last axis for numpy or dask arrays. 
+    Dask arrays are processed chunk by chunk with an overlap of the window extent, so that the chunks are kept.
+
+    Args:
+        values (np.array or dask.array.Array): Values with the rolling dimension as last axis
+        window (int): Length of the rolling window
+        center (bool, optional): Centered or trailing window. Defaults to True.
+        min_periods (int, optional): Minimum number of valid values in a window. Defaults to the window length.
+
+    Returns:
+        np.array or dask.array.Array: Rolling mean
+    """
+    values = values.astype(float)
+    if utils.is_dask_array(values):
+        depth = max(cal_window_extent(window, center))
+        return values.map_overlap(rolling_window_mean, depth = {values.ndim - 1: depth}, boundary = "none", dtype = float,
+                                  window = window, center = center, min_periods = min_periods)
+    return rolling_window_mean(values, window, center = center, min_periods = min_periods)
+
+
+@profiling.profiled
+@provenance.tracked
+def cal_rolling_time_mean(data, time_dim="time", window=10, center=True, min_periods=None):
     """Calculates the rolling time mean for a given dataset
 
     Args:
         data (xarray.Dataset): Dataset for which to calculate the rolling mean
         time_dim (str, optional): Dimension over which rolling average is calculated. Defaults to time.
         window (int, optional): Length of the rolling window. Defaults to 10.
+        center (bool, optional): Centered or trailing window. Defaults to True.
+        min_periods (int, optional): Minimum number of valid values in a window. Defaults to the window length.
 
     Returns:
         xarray.Dataset: Rolling averaged data. Nan values are dropped.
@@ -242,17 +941,22 @@ def cal_rolling_time_mean(data, time_dim="time", window=10):
     if "time_bnds" in dep_variables:
         dep_variables.remove("time_bnds")
 
-        time_bnds_rol = data["time_bnds"].compute().rolling({time_dim:window}, center=True)
-        time_bnds_rol = data["time_bnds"].compute().rolling({time_dim:window}, center=True).construct(window_dim="window_step")
-        time_bnds_min = time_bnds_rol.isel(bnds=0, window_step=0)
-        time_bnds_max = time_bnds_rol.isel(bnds=1, window_step=-1)
+        window_left, window_right = cal_window_extent(window, center)
+        time_bnds_min = data["time_bnds"].isel(bnds=0).shift({time_dim: window_left})
+        time_bnds_max = data["time_bnds"].isel(bnds=1).shift({time_dim: -window_right})
 
         time_bnds = xr.concat([time_bnds_min, time_bnds_max], dim="bnds")
         data_ind = xr.merge([data[ind_variables], time_bnds.rename("time_bnds")],combine_attrs="override")
     else: 
         data_ind = data[ind_variables]
     
-    data_rolling = data[dep_variables].rolling({time_dim:window}, center=True).mean()
+    data_rolling = xr.apply_ufunc(rolling_mean, data[dep_variables],
+                                  input_core_dims = [[time_dim]],
+                                  output_core_dims = [[time_dim]],
+                                  kwargs = dict(window = window, center = center, min_periods = min_periods),
+                                  dask = "allowed")
+    for variable in dep_variables:
+        data_rolling[variable] = data_rolling[variable].transpose(*data[variable].dims)
     
     processing_id = temporal_resolution_dict[get_temporal_resolution(data)]  +str(window)+"rm"
     processing_message = "Rolling mean over {} time steps applied".format(str(window))
@@ -0,0 +1,96 @@
+import unittest
+import os
+import time
+import tempfile
+import functools
+import numpy as np
+import xarray as xr
+
+from climtools import cache
+
+
+def scale(data, factor=1):
+    return data*factor
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.folder.name, "input.nc")
+        with open(self.input_path, "wb") as handle:
+            handle.write(b"input")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def gen_output(self, name, size):
+        output_path = os.path.join(self.folder.name, name)
+        with open(output_path, "wb") as handle:
+            handle.write(b"0"*size)
+        return output_path
+
+    def test_gen_cache_key(self):
+        key = cache.gen_cache_key(self.input_path, scale, (), {"factor": 2})
+
+        self.assertEqual(key, cache.gen_cache_key(self.input_path, scale, (), {"factor": 2}))
+        self.assertNotEqual(key, cache.gen_cache_key(self.input_path, scale, (), {"factor": 3}))
+        self.assertNotEqual(key, cache.gen_cache_key(self.input_path, scale, (np.arange(3),), {"factor": 2}))
+        self.assertNotEqual(key, cache.gen_cache_key(self.input_path, functools.partial(scale, factor=4), (), {"factor": 2}))
+
+        key_checksum = cache.gen_cache_key(self.input_path, scale, checksum=True)
+        os.utime(self.input_path, (0, 0))
+        self.assertNotEqual(key, cache.gen_cache_key(self.input_path, scale, (), {"factor": 2}))
+        self.assertEqual(key_checksum, cache.gen_cache_key(self.input_path, scale, checksum=True))
+
+    def test_gen_cache_key_xarray(self):
+        data = xr.DataArray(np.zeros((100, 100)), dims=["lat", "lon"], coords={"lat": np.arange(100)}, name="tas")
+        data_changed = data.copy(deep=True)
+        data_changed[50, 50] = 1
+        self.assertEqual(repr(data), repr(data_changed))
+
+        key = cache.gen_cache_key(self.input_path, scale, (data,))
+        self.assertEqual(key, cache.gen_cache_key(self.input_path, scale, (data.copy(deep=True),)))
+        self.assertNotEqual(key, cache.gen_cache_key(self.input_path, scale, (data_changed,)))
+        self.assertNotEqual(key, cache.gen_cache_key(self.input_path, scale, (data.assign_coords(lat=np.arange(100) + 1),)))
+        self.assertNotEqual(key, cache.gen_cache_key(self.input_path, scale, (data.assign_attrs(units="K"),)))
+        self.assertNotEqual(cache.gen_cache_key(self.input_path, scale, (data.to_dataset(),)),
+                            cache.gen_cache_key(self.input_path, scale, (data_changed.to_dataset(),)))
+
+        with self.assertRaises(TypeError):
+            cache.gen_cache_key(self.input_path, scale, (object(),))
+
+    def test_result_cache_eviction(self):
+        result_cache = cache.ResultCache(os.path.join(self.folder.name, "cache"), max_size=250, delete_outputs=True)
+        output_paths = []
+        for i in range(3):
+            output_paths.append(self.gen_output("output_{}.nc".format(i), 100))
+            result_cache.put("key_{}".format(i), output_paths[-1])
+            time.sleep(0.01)
+            if i == 1:
+                self.assertEqual(result_cache.get("key_0"), os.path.abspath(output_paths[0]))
+
+        self.assertIsNone(result_cache.get("key_1"))
+        self.assertFalse(os.path.exists(output_paths[1]))
+        self.assertEqual(result_cache.get("key_2"), os.path.abspath(output_paths[2]))
+        self.assertEqual(sorted(result_cache.list_entries()), ["key_0", "key_2"])
+
+
+    def test_result_cache_overwritten_output(self):
+        result_cache = cache.ResultCache(os.path.join(self.folder.name, "cache"), delete_outputs=True)
+        output_path = self.gen_output("output.nc", 100)
+        result_cache.put("key", output_path)
+        self.assertEqual(result_cache.get("key"), os.path.abspath(output_path))
+
+        self.gen_output("output.nc", 120)
+        self.assertIsNone(result_cache.get("key"))
+        self.assertTrue(os.path.exists(output_path))
+        self.assertEqual(result_cache.list_entries(), {})
+
+        os.utime(output_path, ns=(0, 0))
+        result_cache.put("key", output_path)
+        os.utime(output_path, ns=(1, 1))
+        self.assertIsNone(result_cache.get("key"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from climtools import cmor
+from climtools import catalog
+
+
+class TestCmorIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = self.folder.name
+        self.files = []
+        for experiment_id in ["historical", "ssp585"]:
+            for variant_label in ["r1i1p1f1", "r2i1p1f1"]:
+                for variable_id, table_id in [("tas", "Amon"), ("pr", "Amon_1Y")]:
+                    self.add_file(experiment_id, variant_label, variable_id, table_id, "185001-189912")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def add_file(self, experiment_id, variant_label, variable_id, table_id, time_range_string):
+        filename = cmor.gen_cmor_full_filename("CMIP6", "CMIP", "MPI-M", "MPI-ESM1-2-LR", experiment_id, variant_label, table_id, variable_id, "gn", "v1", time_range_string, self.root)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        open(filename, "w").close()
+        self.files.append(filename)
+        return filename
+
+    def test_parse_cmor_filename(self):
+        facets = cmor.parse_cmor_filename("pr_Amon_1Y_MPI-ESM1-2-LR_historical_r1i1p1f1_gn_1850-1899.nc")
+        self.assertEqual((facets["variable_id"], facets["table_id"], facets["variant_label"], facets["time_range"]), ("pr", "Amon_1Y", "r1i1p1f1", "1850-1899"))
+        self.assertEqual(cmor.parse_time_range_string("185001-189912"), (18500101, 18991231))
+        self.assertIsNone(cmor.parse_cmor_filename("README.txt"))
+
+    def test_query(self):
+        index = catalog.CmorIndex(self.root)
+        index.refresh()
+
+        self.assertEqual(len(index.query()), 8)
+        self.assertEqual(index.query(variable_id="tas", table_id="Amon", experiment_id="historical"), sorted(file for file in self.files if "/historical/" in file and "/tas/" in file))
+        self.assertEqual(len(index.query(table_id=["Amon", "Amon_1Y"], variant_label="r2i1p1f1")), 4)
+        self.assertEqual(index.get_facet_values("experiment_id"), ["historical", "ssp585"])
+
+        self.add_file("historical", "r1i1p1f1", "tas", "Amon", "190001-194912")
+        index.refresh()
+        self.assertEqual(len(index.query(variable_id="tas", variant_label="r1i1p1f1", experiment_id="historical")), 2)
+        self.assertEqual(len(index.query(variable_id="tas", variant_label="r1i1p1f1", experiment_id="historical", period_start="1920", period_end="195001")), 1)
+
+    def test_refresh(self):
+        index = catalog.CmorIndex(self.root)
+        index.refresh()
+
+        new_file = self.add_file("historical", "r1i1p1f1", "tas", "Amon", "190001-194912")
+        shutil.rmtree(os.path.join(self.root, "CMIP6", "CMIP", "MPI-M", "MPI-ESM1-2-LR", "ssp585"))
+        statistics = catalog.CmorIndex(self.root).refresh()
+
+        self.assertLess(statistics["scanned"], 5)
+        self.assertEqual(index.get_facet_values("experiment_id"), ["historical"])
+        self.assertIn(new_file, index.query(variable_id="tas"))
+        self.assertEqual(len(index.query()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import os
+import tempfile
+import xarray as xr
+import cftime
+import numpy as np
+
+from climtools import stat
+from climtools import cmor
+from climtools import temporal
+from climtools import utils
+
+
+class TestOpenCmorPeriod(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1900,1,1,0,0,0, calendar ="proleptic_gregorian")
+        self.data = stat.generate_timeseries(start, end, "month").to_dataset(name="time_bnds")
+        self.data = self.data.assign_coords(lat = np.linspace(-60, 60, 5))
+        self.data["tas"] = (("time", "lat"), np.random.rand(self.data.sizes["time"], 5))
+
+        self.files = []
+        for year in range(1850, 1900, 10):
+            data = self.data.sel(time = slice(str(year), str(year + 9)))
+            filename = os.path.join(self.folder.name, "tas_Amon_MPI-ESM1-2-LR_historical_r1i1p1f1_gn_{}01-{}12.nc".format(year, year + 9))
+            data.to_netcdf(filename)
+            self.files.append(filename)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_select_files_in_period(self):
+        self.assertEqual(cmor.select_files_in_period(self.files[::-1], "1865", "187406"), self.files[1:3])
+        self.assertEqual(cmor.select_files_in_period(self.files, "188912"), self.files[3:])
+        self.assertEqual(cmor.select_files_in_period(self.files + ["areacella_fx_MPI-ESM1-2-LR_historical_r1i1p1f1_gn.nc"]), self.files)
+
+    def test_open_cmor_period(self):
+        for period_start, period_end in [("1865", "1874"), ("186503", "187402"), (None, "1855")]:
+            data = cmor.open_cmor_period(self.files, period_start, period_end, chunks = {"time": 12})
+            xr.testing.assert_allclose(data.load(), self.data.sel(time = slice(period_start and cmor.format_time_string(period_start), period_end and cmor.format_time_string(period_end))))
+
+
+class TestTimeRangeString(unittest.TestCase):
+
+    def setUp(self):
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1860,1,1,0,0,0, calendar ="proleptic_gregorian")
+        self.data = stat.generate_timeseries(start, end, "month").to_dataset(name="time_bnds")
+        self.data["tas"] = ("time", np.random.rand(self.data.sizes["time"]))
+
+    def test_detected_resolution(self):
+        self.assertEqual(cmor.get_time_range_string(self.data), "185001-185912")
+
+    def test_frequency_attribute(self):
+        data = self.data.copy()
+        data["time_bnds"] = xr.zeros_like(data["time_bnds"])
+        data.attrs["frequency"] = "mon"
+        self.assertEqual(cmor.get_time_range_string(data), "185001-185912")
+
+    def test_cached_resolution(self):
+        data_year = temporal.temporal_downsampling(self.data, "year")
+        self.assertEqual(data_year.attrs["frequency"], "yr")
+        self.assertEqual(temporal.get_cached_temporal_resolution(data_year), "year")
+        self.assertEqual(cmor.get_time_range_string(data_year), "1850-1859")
+
+        data_year["time_bnds"] = data_year["time_bnds"].copy()
+        self.assertIsNone(temporal.get_cached_temporal_resolution(data_year))
+
+    def test_seasonal_resolution(self):
+        data_season = temporal.temporal_downsampling(self.data, "season")
+        self.assertNotIn("frequency", data_season.attrs)
+        self.assertEqual(temporal.get_cached_temporal_resolution(data_season), "season")
+        time_range = cmor.get_time_range_string(data_season)
+        self.assertEqual(time_range, "-".join(cmor.get_time_string(data_season.indexes["time"][index], "season") for index in [0, -1]))
+
+
+    def test_gen_cmor_path_and_filename_seasonal(self):
+        data = self.data.assign_attrs(mip_era="CMIP6", activity_id="CMIP", institution_id="MPI-M", model_id="MPI-ESM1-2-LR", experiment_id="historical",
+                                      table_id="Amon", variable_id="tas", grid_label="gn", variant_label="r1i1p1f1")
+        data_season = temporal.temporal_downsampling(data, "season_dec")
+        cmor_path, cmor_file = cmor.gen_cmor_path_and_filename(data_season, "v1")
+
+        self.assertTrue(cmor_file.endswith("_{}.nc".format(cmor.get_time_range_string(data_season))))
+        self.assertEqual(cmor.parse_cmor_path(cmor_path)["table_id"], cmor.parse_cmor_filename(cmor_file)["table_id"])
+        self.assertNotEqual(cmor.parse_cmor_path(cmor_path)["table_id"], "Amon")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import os
+import sys
+import json
+import time
+import socket
+import pickle
+import subprocess
+import tempfile
+import xarray as xr
+import numpy as np
+import pandas as pd
+
+from climtools import multiindex
+
+
+class TestMultiindexStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        index = pd.MultiIndex.from_product([["member_1", "member_2", "member_3"], np.arange(4)], names = ["ensemble", "year"])
+        self.data = xr.DataArray(np.random.rand(12, 5), dims = ["sample", "feature"], name = "tas",
+                                 coords = {"sample": index, "feature": np.arange(5), "feature_label": ("feature", list("abcde"))})
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_xarray_save_load_multiindex(self):
+        multiindex.xarray_save_multiindex(self.data, self.folder.name)
+        data = multiindex.xarray_load_multiindex(self.folder.name)
+
+        xr.testing.assert_identical(data, self.data)
+        self.assertFalse(data.values.flags.writeable)
+        xr.testing.assert_identical(data.sel(ensemble = "member_2"), self.data.sel(ensemble = "member_2"))
+
+    def test_xarray_save_load_multiindex_dask(self):
+        multiindex.xarray_save_multiindex(self.data.chunk({"sample": 5}), self.folder.name)
+        data = multiindex.xarray_load_multiindex(self.folder.name, chunks = {"sample": 3})
+
+        self.assertEqual(data.chunks, ((3, 3, 3, 3), (5,)))
+        xr.testing.assert_identical(data.compute(), self.data)
+
+    def test_xarray_load_multiindex_pickle(self):
+        dict_coords = {dim: self.data[dim].coords.to_dataset()[dim] for dim in self.data.dims}
+        np.save(os.path.join(self.folder.name, "data.npy"), self.data.values)
+        with open(os.path.join(self.folder.name, "coordinates.pickle"), "wb") as handle:
+            pickle.dump(dict_coords, handle)
+
+        xr.testing.assert_identical(multiindex.xarray_load_multiindex(self.folder.name), self.data.rename(None).drop_vars("feature_label"))
+
+    def test_xarray_append_multiindex(self):
+        for start in range(0, 12, 4):
+            multiindex.xarray_append_multiindex(self.data.isel(sample = slice(start, start + 4)), self.folder.name, "sample")
+        data = multiindex.xarray_load_multiindex(self.folder.name)
+
+        self.assertEqual(data.chunks, ((4, 4, 4), (5,)))
+        xr.testing.assert_identical(data.compute(), self.data)
+        self.assertNotIn("coordinates.npz", os.listdir(self.folder.name))
+
+    def test_xarray_append_multiindex_reader(self):
+        multiindex.xarray_append_multiindex(self.data.isel(sample = slice(0, 4)), self.folder.name, "sample")
+        metadata = multiindex.load_metadata(self.folder.name)
+        multiindex.xarray_append_multiindex(self.data.isel(sample = slice(4, 8)), self.folder.name, "sample")
+
+        coords = xr.Dataset(coords = multiindex.load_sidecar(self.folder.name, metadata))
+        pd.testing.assert_index_equal(coords.indexes["sample"], self.data.isel(sample = slice(0, 4)).indexes["sample"])
+
+        multiindex.xarray_append_multiindex(self.data.isel(sample = slice(8, 12)), self.folder.name, "sample")
+        self.assertNotIn(multiindex.get_coordinates_file(metadata), os.listdir(self.folder.name))
+        xr.testing.assert_identical(multiindex.xarray_load_multiindex(self.folder.name).compute(), self.data)
+
+        multiindex.xarray_save_multiindex(self.data, self.folder.name)
+        self.assertEqual(sorted(os.listdir(self.folder.name)), ["coordinates.npz", "data.npy", "metadata.json"])
+
+    def test_xarray_write_region_multiindex(self):
+        multiindex.xarray_allocate_multiindex(self.data.coords, self.data.dims, self.folder.name, name = "tas")
+        for start in range(0, 12, 4):
+            multiindex.xarray_write_region_multiindex(self.data.isel(sample = slice(start, start + 4)), self.folder.name, {"sample": slice(start, start + 4)})
+
+        xr.testing.assert_identical(multiindex.xarray_load_multiindex(self.folder.name), self.data)
+
+        with multiindex.lock_store(self.folder.name):
+            with self.assertRaises(TimeoutError):
+                multiindex.xarray_write_region_multiindex(self.data.isel(sample = slice(0, 4)), self.folder.name, {"sample": slice(0, 4)}, timeout = 0.1)
+
+    def test_lock_store_stale(self):
+        lock_path = os.path.join(self.folder.name, "store.lock")
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        owners = [{"pid": process.pid, "host": socket.gethostname(), "time": time.time()},
+                  {"pid": os.getpid(), "host": "other", "time": time.time() - 2*multiindex.default_lock_stale_age}]
+        for owner in owners:
+            with open(lock_path, "w") as handle:
+                json.dump(owner, handle)
+            with multiindex.lock_store(self.folder.name, timeout = 1):
+                self.assertEqual(multiindex.read_lock(lock_path)["pid"], os.getpid())
+            self.assertEqual(os.listdir(self.folder.name), [])
+
+        with multiindex.lock_store(self.folder.name):
+            with self.assertRaisesRegex(TimeoutError, lock_path):
+                with multiindex.lock_store(self.folder.name, timeout = 0.1):
+                    pass
+
+if __name__ == '__main__':
+    unittest.main()
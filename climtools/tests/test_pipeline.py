@@ -0,0 +1,61 @@
+import unittest
+import xarray as xr
+import cftime
+import numpy as np
+
+from climtools import temporal
+from climtools import stat
+from climtools import spatial
+from climtools import pipeline
+from climtools import provenance
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1860,1,1,0,0,0, calendar ="proleptic_gregorian")
+        lat = np.linspace(-87.5, 87.5, 36)
+        lon = np.arange(2.5, 360, 5.)
+
+        self.data = stat.generate_timeseries(start, end, "month").to_dataset(name="time_bnds")
+        self.data = self.data.assign_coords(lat = lat, lon = lon).assign_attrs(table_id = "Amon")
+        for variable in ["tas", "pr"]:
+            self.data[variable] = (("time", "lat", "lon"), np.random.rand(self.data.sizes["time"], lat.size, lon.size))
+        self.data["area"] = np.cos(np.deg2rad(self.data.lat))*xr.ones_like(self.data.lon)
+        self.weights = np.cos(np.deg2rad(self.data.lat)).rename("coslat")
+        self.mask = spatial.gen_lonlatbox_mask(self.data, 10, 80, -20, 40)
+
+    def test_plan(self):
+        steps = pipeline.Pipeline().temporal_downsampling("year").anomaly("time").apply_mask(self.mask, drop=True).weighted_mean(self.weights).plan()
+        self.assertEqual([step.name for step in steps], ["apply_mask", "temporal_downsampling", "anomaly", "weighted_mean"])
+
+        steps = pipeline.Pipeline().temporal_downsampling("year").weighted_anom(self.weights).apply_mask(self.mask, drop=True).plan()
+        self.assertEqual([step.name for step in steps], ["temporal_downsampling", "weighted_anom", "apply_mask"])
+
+    def test_run(self):
+        for drop in [False, True]:
+            for data in [self.data, self.data.chunk({"time": 24})]:
+                data_chained = temporal.temporal_downsampling(data, "year")
+                data_chained = stat.cal_anomaly_dim(data_chained, ["time"])
+                data_chained = spatial.apply_mask(data_chained, self.mask, drop = drop)
+                data_chained = stat.cal_weighted_mean(data_chained, self.weights)
+
+                data_pipeline = pipeline.Pipeline().temporal_downsampling("year").anomaly("time").apply_mask(self.mask, drop = drop).weighted_mean(self.weights).run(data, compute = True)
+
+                xr.testing.assert_allclose(data_chained, data_pipeline)
+                self.assertEqual(provenance.render(data_pipeline).attrs["table_id"], provenance.render(data_chained).attrs["table_id"])
+                self.assertEqual([step["message"] for step in provenance.get_steps(data_pipeline)], [step["message"] for step in provenance.get_steps(data_chained)])
+
+    def test_run_variables(self):
+        data_pipeline = pipeline.Pipeline(variables = ["tas"]).lonlatbox(10, 80, -20, 40, drop = True).temporal_downsampling("year")(self.data)
+        data_chained = temporal.temporal_downsampling(spatial.apply_mask(self.data, self.mask, drop = True), "year")
+
+        self.assertEqual(sorted(data_pipeline.data_vars), ["tas", "time_bnds"])
+        xr.testing.assert_allclose(data_chained[["tas", "time_bnds"]], data_pipeline)
+        self.assertEqual(provenance.render(data_pipeline).attrs["table_id"], "Amon_masked_1Y")
+        self.assertEqual([step["name"] for step in provenance.get_steps(data_pipeline)], ["lonlatbox", "temporal_downsampling"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import os
+import tempfile
+import xarray as xr
+import cftime
+import numpy as np
+
+from climtools import stat
+from climtools import processing
+from climtools import cache
+from climtools import cmor
+from climtools import temporal
+
+calls = []
+
+def select_first_year(data):
+    return data.isel(time=slice(0, 12))
+
+def select_first_year_engine(data, engine):
+    calls.append(engine)
+    return data.isel(time=slice(0, 12))
+
+def select_years(data, n_year):
+    calls.append(n_year)
+    return data.isel(time=slice(0, 12*n_year))
+
+
+class TestBatchProcessing(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.input_paths = []
+        for variant_label in ["r1i1p1f1", "r2i1p1f1"]:
+            data = stat.generate_timeseries(cftime.datetime(2000, 1, 1, calendar="proleptic_gregorian"), cftime.datetime(2003, 1, 1, calendar="proleptic_gregorian"), "month").to_dataset(name="time_bnds")
+            data["tas"] = ("time", np.random.rand(data.sizes["time"]))
+            data = data.assign_attrs(mip_era="CMIP6", activity_id="CMIP", institution_id="MPI-M", model_id="MPI-ESM1-2-LR", experiment_id="historical",
+                                     table_id="Amon", variable_id="tas", grid_label="gn", variant_label=variant_label)
+            input_path = os.path.join(self.folder.name, "tas_{}.nc".format(variant_label))
+            data.to_netcdf(input_path)
+            self.input_paths.append(input_path)
+        self.output_path = os.path.join(self.folder.name, "output")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_batch_load_execute_save(self):
+        summary = processing.batch_load_execute_save(select_first_year, os.path.join(self.folder.name, "*.nc"), "v1", self.output_path)
+
+        self.assertEqual(list(summary.status), ["done", "done"])
+        for output in summary.output:
+            self.assertEqual(xr.open_dataset(output, use_cftime=True).sizes["time"], 12)
+
+        summary = processing.batch_load_execute_save(select_first_year, self.input_paths, "v1", self.output_path)
+        self.assertEqual(list(summary.status), ["skipped", "skipped"])
+
+    def test_batch_load_execute_save_changed_arguments(self):
+        processing.batch_load_execute_save(select_years, self.input_paths, "v1", self.output_path, func_kwargs={"n_year": 1})
+        summary = processing.batch_load_execute_save(select_years, self.input_paths, "v1", self.output_path, func_kwargs={"n_year": 1})
+        self.assertEqual(list(summary.status), ["skipped", "skipped"])
+
+        summary = processing.batch_load_execute_save(select_years, self.input_paths, "v1", self.output_path, func_kwargs={"n_year": 2})
+        self.assertEqual(list(summary.status), ["done", "done"])
+        for output in summary.output:
+            self.assertEqual(xr.open_dataset(output, use_cftime=True).sizes["time"], 24)
+
+    def test_batch_load_execute_save_failure(self):
+        input_paths = self.input_paths + [os.path.join(self.folder.name, "missing.nc")]
+        summary = processing.batch_load_execute_save(select_first_year, input_paths, "v1", self.output_path, n_workers=2, n_retries=1)
+
+        self.assertEqual(list(summary.loc[self.input_paths, "status"]), ["done", "done"])
+        self.assertEqual(summary.loc[input_paths[-1], "status"], "failed")
+        self.assertEqual(summary.loc[input_paths[-1], "n_attempt"], 2)
+
+    def test_batch_load_execute_save_removed_input(self):
+        processing.batch_load_execute_save(select_first_year, self.input_paths, "v1", self.output_path)
+        os.remove(self.input_paths[0])
+        summary = processing.batch_load_execute_save(select_first_year, self.input_paths, "v1", self.output_path, n_retries=0)
+
+        self.assertEqual(list(summary.loc[self.input_paths, "status"]), ["failed", "skipped"])
+
+    def test_load_execute_save_result_cache(self):
+        result_cache = cache.ResultCache(os.path.join(self.folder.name, "cache"))
+        del calls[:]
+
+        output = processing.process_input(select_years, self.input_paths[0], "v1", self.output_path, None, (2,), result_cache=result_cache)
+        self.assertEqual(processing.process_input(select_years, self.input_paths[0], "v1", self.output_path, None, (2,), result_cache=result_cache), output)
+        self.assertEqual(calls, [2])
+        self.assertIn("result cache key", xr.open_dataset(output, use_cftime=True).attrs["history"])
+
+        processing.process_input(select_years, self.input_paths[0], "v1", self.output_path, None, (1,), result_cache=result_cache)
+        self.assertEqual(calls, [2, 1])
+
+
+    def test_load_execute_save_func_kwargs(self):
+        del calls[:]
+        output = processing.load_execute_save(select_first_year_engine, self.input_paths[0], "v1", self.output_path, engine="custom")
+        self.assertEqual(calls, ["custom"])
+        self.assertTrue(output.endswith(".nc"))
+
+        output = processing.process_input(select_first_year_engine, self.input_paths[0], "v1", self.output_path, func_kwargs={"engine": "custom"}, save_kwargs={"preset": "zlib"})
+        self.assertEqual(calls, ["custom", "custom"])
+        self.assertTrue(xr.open_dataset(output).tas.encoding["zlib"])
+
+    def test_load_execute_save_seasonal(self):
+        result_cache = cache.ResultCache(os.path.join(self.folder.name, "cache"))
+        for cache_option in [None, result_cache]:
+            output = processing.process_input(temporal.temporal_downsampling, self.input_paths[0], "v1", self.output_path, None, ("season_dec",), result_cache=cache_option)
+            data = xr.open_dataset(output, use_cftime=True)
+            time_range = "-".join(cmor.get_time_string(data.indexes["time"][index], "season") for index in [0, -1])
+
+            self.assertEqual(cmor.parse_cmor_filename(output)["time_range"], time_range)
+            self.assertEqual(cmor.parse_cmor_filename(output)["table_id"], data.attrs["table_id"])
+
+if __name__ == '__main__':
+    unittest.main()
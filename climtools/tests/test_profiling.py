@@ -0,0 +1,78 @@
+import unittest
+import os
+import json
+import tempfile
+import cftime
+import numpy as np
+
+from climtools import profiling
+from climtools import stat
+from climtools import temporal
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1860,1,1,0,0,0, calendar ="proleptic_gregorian")
+        self.data = stat.generate_timeseries(start, end, "month").to_dataset(name="time_bnds")
+        self.data["tas"] = (("time", "lat"), np.random.rand(self.data.sizes["time"], 5))
+        profiling.clear()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.clear()
+
+    def test_disabled(self):
+        profiling.disable()
+        temporal.temporal_downsampling(self.data, "year")
+        self.assertEqual(profiling.get_events(), [])
+
+    def test_events(self):
+        profiling.enable()
+        data = self.data.chunk({"time": 24})
+        result = temporal.temporal_downsampling(data, "year")
+
+        events = {event["name"]: event for event in profiling.get_events()}
+        self.assertIn("temporal.get_temporal_resolution", events)
+        self.assertIn("temporal.merge", events)
+
+        event = events["temporal.temporal_downsampling"]
+        self.assertEqual(event["depth"], 0)
+        self.assertEqual(events["temporal.downsample_variables"]["depth"], 1)
+        self.assertEqual(event["bytes_in"], data.nbytes)
+        self.assertEqual(event["bytes_out"], result.nbytes)
+        self.assertGreater(event["dask_tasks"], 0)
+
+    @unittest.skipIf(profiling.get_rss() is None, "Resident set size is not available on this platform")
+    def test_memory(self):
+        profiling.enable()
+        with profiling.profile("peak"):
+            np.ones(2**25)
+        with profiling.profile("allocate") as event:
+            values = np.ones(2**23)
+            event.set_result(values)
+
+        events = {event["name"]: event for event in profiling.get_events()}
+        self.assertGreater(events["allocate"]["rss_delta"], 0.9*values.nbytes)
+        self.assertEqual(events["allocate"]["max_rss_growth"], 0)
+
+    def test_export(self):
+        profiling.enable()
+        with profiling.profile("block", self.data) as event:
+            event.set_result(self.data.tas.mean())
+
+        with tempfile.TemporaryDirectory() as folder:
+            profiling.export_json(os.path.join(folder, "profile.json"))
+            profiling.export_chrome_trace(os.path.join(folder, "trace.json"))
+
+            with open(os.path.join(folder, "profile.json")) as file:
+                self.assertEqual(json.load(file)["summary"]["block"]["calls"], 1)
+            with open(os.path.join(folder, "trace.json")) as file:
+                trace_event = json.load(file)["traceEvents"][0]
+        self.assertEqual((trace_event["name"], trace_event["ph"]), ("block", "X"))
+        self.assertEqual(trace_event["args"]["bytes_in"], self.data.nbytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import os
+import pickle
+import weakref
+import tempfile
+import xarray as xr
+import numpy as np
+
+from climtools import provenance
+from climtools import spatial
+from climtools import stat
+from climtools import writer
+
+
+class TestProvenance(unittest.TestCase):
+
+    def setUp(self):
+        self.data = xr.Dataset({"tas": (("time", "lat"), np.random.rand(4, 3))}, coords = {"lat": [-10., 0., 10.]}, attrs = {"table_id": "Amon", "history": "created"})
+        self.weights = xr.DataArray(np.ones(3), dims = ["lat"], coords = {"lat": self.data.lat}, name = "area")
+
+    def test_render(self):
+        data = spatial.apply_mask(self.data, self.data.lat > -5)
+        data = stat.cal_weighted_mean(data, self.weights)
+        self.assertEqual(data.attrs["table_id"], "Amon")
+        self.assertEqual(list(data.attrs), ["table_id", "history", provenance.provenance_attr])
+
+        rendered = provenance.render(data)
+        self.assertEqual(rendered.attrs["table_id"], "Amon_masked_area_weightedmean_lat")
+        self.assertTrue(rendered.attrs["history"].startswith("created"))
+        self.assertIn("Applied mask", rendered.attrs["history"])
+        self.assertNotIn(provenance.provenance_attr, rendered.attrs)
+        self.assertIn(provenance.provenance_attr, data.attrs)
+        self.assertIs(provenance.render(rendered), rendered)
+
+    def test_steps(self):
+        data = stat.cal_weighted_mean(spatial.apply_mask(self.data, self.data.lat > -5, drop = True), self.weights)
+        steps = provenance.get_steps(data)
+
+        self.assertEqual([step["name"] for step in steps], ["apply_mask", "cal_weighted_mean"])
+        self.assertEqual(steps[0]["params"]["drop"], True)
+        self.assertEqual(steps[0]["bytes_in"], self.data.nbytes)
+        self.assertTrue(all(step["wall_time"] >= 0 for step in steps))
+        self.assertEqual(steps[1]["parent"], steps[0]["token"])
+
+    def test_branches(self):
+        data_mask = spatial.apply_mask(self.data, self.data.lat > -5)
+        data_mean = stat.cal_weighted_mean(data_mask, self.weights)
+        data_anom = stat.cal_weighted_anom(data_mask, self.weights)
+
+        self.assertEqual(provenance.render(data_mean).attrs["table_id"], "Amon_masked_area_weightedmean_lat")
+        self.assertEqual(provenance.render(data_anom).attrs["table_id"], "Amon_masked_area_weightedanom_lat")
+
+    def test_records_released(self):
+        data = spatial.apply_mask(self.data, self.data.lat > -5)
+        token = weakref.ref(data.attrs[provenance.provenance_attr])
+        data_mean = stat.cal_weighted_mean(data, self.weights)
+        del data
+        self.assertIsNotNone(token())
+        self.assertEqual([step["name"] for step in provenance.get_steps(pickle.loads(pickle.dumps(data_mean)))], ["apply_mask", "cal_weighted_mean"])
+
+        del data_mean
+        self.assertIsNone(token())
+
+    def test_save_dataset(self):
+        data = stat.cal_weighted_mean(spatial.apply_mask(self.data, self.data.lat > -5), self.weights)
+        with tempfile.TemporaryDirectory() as folder:
+            path = writer.save_dataset(data, os.path.join(folder, "tas.nc"))
+            with xr.open_dataset(path) as data_written:
+                self.assertEqual(data_written.attrs["table_id"], "Amon_masked_area_weightedmean_lat")
+                self.assertIn("Applied mask", data_written.attrs["history"])
+                self.assertNotIn(provenance.provenance_attr, data_written.attrs)
+
+
+if __name__ == '__main__':
+    unittest.main()
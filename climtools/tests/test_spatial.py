@@ -7,6 +7,7 @@ import numpy as np
 
 from climtools import temporal 
 from climtools import stat
+from climtools import spatial
 
 import helper_functions
 
@@ -23,3 +24,60 @@ class TestStat(unittest.TestCase):
 
     def test_transformation(self, data, lon_dim="lon"):
         return 
+
+
+class TestMaskRegistry(unittest.TestCase):
+
+    def setUp(self):
+        lat = np.linspace(-89.5, 89.5, 180)
+        lon = np.arange(0.5, 360, 1.)
+        self.data = xr.Dataset({"tas": (("time", "lat", "lon"), np.random.rand(3, 180, 360))}, coords = {"lat": lat, "lon": lon})
+
+    def test_gen_lonlatbox_mask(self):
+        for box in [(10, 50, -20, 30), (350, 20, 40, 60)]:
+            mask = spatial.gen_lonlatbox_mask(self.data, *box)
+            mask_registered = spatial.gen_lonlatbox_mask(self.data, *box)
+            
+            xr.testing.assert_equal(spatial.cal_lonlatbox_mask(self.data, *box), mask)
+            xr.testing.assert_equal(mask, mask_registered)
+
+    def test_sellonlatbox_drop(self):
+        for box in [(10, 50, -20, 30), (350, 20, 40, 60)]:
+            mask = spatial.cal_lonlatbox_mask(self.data, *box)
+            xr.testing.assert_equal(self.data.where(mask, drop=True), spatial.sellonlatbox(self.data, *box, drop=True))
+
+    def test_sellonlatbox(self):
+        data = self.data.assign(time_index = ("time", np.arange(3)))
+        for box in [(10, 50, -20, 30), (350, 20, 40, 60)]:
+            mask = spatial.cal_lonlatbox_mask(self.data, *box)
+            data_box = spatial.sellonlatbox(data, *box)
+
+            xr.testing.assert_equal(data_box["tas"], self.data["tas"].where(mask))
+            xr.testing.assert_equal(data_box["time_index"], data["time_index"])
+            xr.testing.assert_equal(spatial.sellonlatbox(data, *box, drop=True)["time_index"], data["time_index"])
+
+    def test_mask_registry_size(self):
+        mask_registry_size = spatial.mask_registry_size
+        spatial.clear_mask_registry()
+        try:
+            spatial.mask_registry_size = 2
+            boxes = [(10, 50, -20, 30), (350, 20, 40, 60), (0, 90, 0, 45)]
+            spatial.get_lonlatbox_compact_mask(self.data, *boxes[0])
+            spatial.get_lonlatbox_compact_mask(self.data, *boxes[1])
+            spatial.get_lonlatbox_compact_mask(self.data, *boxes[0])
+            spatial.get_lonlatbox_compact_mask(self.data, *boxes[2])
+
+            self.assertEqual([key[1] for key in spatial._mask_registry], [boxes[0], boxes[2]])
+        finally:
+            spatial.mask_registry_size = mask_registry_size
+            spatial.clear_mask_registry()
+
+    def test_compress_mask(self):
+        mask = (self.data.lat > 0) & (self.data.lon < 100) & ((self.data.lat + self.data.lon) < 120)
+        compact_mask = spatial.compress_mask(mask)
+        
+        np.testing.assert_array_equal(spatial.expand_mask(compact_mask), mask.values)
+        xr.testing.assert_equal(spatial.apply_mask(self.data, mask, drop=True)["tas"], self.data["tas"].where(mask, drop=True))
+
+if __name__ == '__main__':
+    unittest.main()
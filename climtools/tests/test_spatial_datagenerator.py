@@ -27,5 +27,47 @@ class TestStat(unittest.TestCase):
         
         xr.testing.assert_allclose(covariance_ori, covariance_cal, atol = 1/np.sqrt(self.n_sample)*3)
 
+
+class TestStreamingCovariance(unittest.TestCase):
+
+    def setUp(self):
+        self.data = xr.DataArray(np.random.normal(size=(500, 7, 5)) + np.arange(5), dims = ["sample", "lon", "lat"], coords = {"lon": np.arange(7), "lat": np.arange(5)*10.})
+        self.covariance = spatial_datagenerator.xarray_autocovariance_matrix(self.data, sample_dim="sample")
+
+    def test_xarray_autocovariance_matrix_streaming(self):
+        covariance = spatial_datagenerator.xarray_autocovariance_matrix(self.data, sample_dim="sample", batch_size = 33, tile_size = 4)
+        xr.testing.assert_allclose(self.covariance, covariance)
+
+    def test_xarray_autocovariance_matrix_band(self):
+        covariance = self.covariance.values.reshape(35, 35)
+        row_index, column_index = np.indices(covariance.shape)
+
+        covariance_band = spatial_datagenerator.xarray_autocovariance_matrix(self.data, sample_dim="sample", batch_size = 50, tile_size = 8, band = 3)
+        np.testing.assert_allclose(covariance_band.toarray(), np.where(np.abs(row_index - column_index) <= 3, covariance, 0))
+
+        covariance_top_k = spatial_datagenerator.xarray_autocovariance_matrix(self.data, sample_dim="sample", batch_size = 50, tile_size = 8, top_k = 4)
+        np.testing.assert_array_equal(covariance_top_k.getnnz(axis=1), 4)
+        np.testing.assert_allclose(np.sort(np.abs(covariance_top_k.toarray()), axis=1)[:, -4:], np.sort(np.abs(covariance), axis=1)[:, -4:])
+
+
+class TestSpectralGenerator(unittest.TestCase):
+
+    def test_xarray_spatial_correlated_distance_regular_grid_fft(self):
+        n_sample = 100000
+        covariance_dense = spatial_datagenerator.xarray_spatial_correlated_distance_regular_grid(n_sample = 1, lonlat_resolution = 30)["covariance"]
+        
+        data = spatial_datagenerator.xarray_spatial_correlated_distance_regular_grid(n_sample = n_sample, lonlat_resolution = 30, method = "fft", 
+                                                                                    rng = np.random.default_rng(0), batch_size = 30000)
+        covariance = spatial_datagenerator.xarray_autocovariance_matrix(data["data"], sample_dim="sample")
+
+        self.assertEqual(data["data"].sizes["sample"], n_sample)
+        xr.testing.assert_allclose(covariance_dense.rename({"lon_2":"lon_1", "lat_2":"lat_1"}), covariance, atol = 5/np.sqrt(n_sample))
+
+    def test_iterate_spatial_correlated_distance_regular_grid(self):
+        batches = list(spatial_datagenerator.iterate_spatial_correlated_distance_regular_grid(n_sample = 25, lonlat_resolution = 30, batch_size = 10, rng = np.random.default_rng(0)))
+        
+        self.assertEqual([batch.sizes["sample"] for batch in batches], [10, 10, 5])
+        np.testing.assert_array_equal(xr.concat(batches, dim="sample").sample, np.arange(25))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
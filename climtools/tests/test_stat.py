@@ -3,9 +3,13 @@ import os
 import sys
 import xarray as xr
 import cftime
+import numpy as np
+import tempfile
 
 from climtools import temporal 
 from climtools import stat
+from climtools import provenance
+from climtools import spatial
 from helper_functions import *
 
 class TestStat(unittest.TestCase):
@@ -28,5 +32,147 @@ class TestStat(unittest.TestCase):
         xr.testing.assert_equal(self.data_1d["values"], time_values)
 
 
+class TestWeightedMean(unittest.TestCase):
+
+    def setUp(self):
+        lat = np.linspace(-85, 85, 18)
+        lon = np.arange(0, 360, 20.)
+        self.data = xr.Dataset({"tas": (("time", "lat", "lon"), np.random.rand(12, 18, 18)),
+                                "pr": (("time", "lat", "lon"), np.random.rand(12, 18, 18)),
+                                "time_index": ("time", np.arange(12))},
+                                coords = {"lat": lat, "lon": lon})
+        self.data["pr"][2:5, 3:9, 4] = np.nan
+        self.weights = (np.cos(np.deg2rad(self.data.lat))*xr.ones_like(self.data.lon)).rename("area")
+        self.weights[0, 0] = np.nan
+
+    def test_cal_weighted_mean(self):
+        data_mean = stat.cal_weighted_mean(self.data, self.weights)
+        data_mean_expected = self.data[["tas", "pr"]].weighted(self.weights.fillna(0)).mean(["lat", "lon"])
+
+        xr.testing.assert_allclose(data_mean[["tas", "pr"]], data_mean_expected)
+        xr.testing.assert_equal(data_mean["time_index"], self.data["time_index"])
+
+    def test_weighted_reducer(self):
+        reducer = stat.WeightedReducer(self.weights)
+        data_mean = stat.cal_weighted_mean(self.data, reducer)
+        data_mean_chunked = stat.cal_weighted_mean(self.data.chunk({"time": 4}), reducer)
+        
+        xr.testing.assert_allclose(data_mean, stat.cal_weighted_mean(self.data, self.weights))
+        xr.testing.assert_allclose(data_mean, data_mean_chunked.compute())
+
+    def test_weighted_reducer_dask(self):
+        reducer = stat.WeightedReducer(self.weights)
+        data = self.data[["tas", "pr"]].assign(orog = self.data["tas"].isel(time=0, drop=True))
+        data_mean = reducer.mean(data.chunk({"time": 4, "lat": 6}))
+        data_mean_expected = data.weighted(self.weights.fillna(0)).mean(["lat", "lon"])
+
+        self.assertTrue(all(variable.chunks is not None for variable in data_mean.data_vars.values()))
+        xr.testing.assert_allclose(data_mean.compute(), data_mean_expected)
+        self.assertEqual(data_mean["orog"].dims, ())
+
+    def test_weighted_reducer_alignment(self):
+        reducer = stat.WeightedReducer(self.weights)
+        data = self.data[["tas", "pr"]].isel(lat = slice(2, 10))
+        xr.testing.assert_allclose(reducer.mean(data), data.weighted(self.weights.fillna(0)).mean(["lat", "lon"]))
+
+        with self.assertRaises(ValueError):
+            reducer.mean(data.assign_coords(lat = data.lat + 1))
+
+    def test_cal_weighted_anom(self):
+        data_anom = stat.cal_weighted_anom(self.data, self.weights)
+        data_mean = self.data[["tas", "pr"]].weighted(self.weights.fillna(0)).mean(["lat", "lon"])
+        
+        xr.testing.assert_allclose(data_anom[["tas", "pr"]], self.data[["tas", "pr"]] - data_mean)
+
+    def test_cal_regional_weighted_means(self):
+        boxes = {"tropics": (0, 360, -30, 30), "north": (300, 60, 20, 80), "south": (10, 100, -80, -10)}
+        masks = spatial.gen_lonlatbox_masks(self.data, boxes)
+        data_means = stat.cal_regional_weighted_means(self.data, masks, self.weights)
+        data_means_chunked = stat.cal_regional_weighted_means(self.data.chunk({"time": 4}), masks, self.weights)
+
+        for region, box in boxes.items():
+            data_mean = stat.cal_weighted_mean(spatial.sellonlatbox(self.data, *box), self.weights)
+            xr.testing.assert_allclose(data_mean[["tas", "pr"]], data_means[["tas", "pr"]].sel(region=region, drop=True))
+        
+        xr.testing.assert_allclose(data_means, data_means_chunked.compute())
+
+
+    def test_cal_regional_weighted_means_shapes(self):
+        boxes = {"tropics": (0, 360, -30, 30), "north": (300, 60, 20, 80)}
+        masks = spatial.gen_lonlatbox_masks(self.data, boxes)
+        data = self.data.isel(time=0, drop=True)[["tas", "pr"]]
+        data_4d = self.data[["tas", "pr"]].expand_dims(member=3).copy(deep=True)
+        data_4d["tas"][2] = data_4d["tas"][2] + 1
+
+        data_means = stat.cal_regional_weighted_means(data, masks, self.weights)
+        self.assertEqual(data_means["tas"].dims, ("region",))
+        for region, box in boxes.items():
+            data_mean = stat.cal_weighted_mean(spatial.sellonlatbox(data, *box), self.weights)
+            xr.testing.assert_allclose(data_mean, data_means.sel(region=region, drop=True))
+
+        data_means_4d = stat.cal_regional_weighted_means(data_4d, masks, self.weights)
+        self.assertEqual(data_means_4d["tas"].dims, ("member", "time", "region"))
+        for region, box in boxes.items():
+            data_mean = stat.cal_weighted_mean(spatial.sellonlatbox(data_4d, *box), self.weights)
+            xr.testing.assert_allclose(data_mean, data_means_4d.sel(region=region, drop=True))
+        xr.testing.assert_allclose(data_means_4d, stat.cal_regional_weighted_means(data_4d.chunk({"time": 4}), masks, self.weights).compute())
+
+    def test_regional_weighted_mean_nan(self):
+        boxes = {"tropics": (0, 360, -30, 30), "north": (300, 60, 20, 80)}
+        masks = spatial.gen_lonlatbox_masks(self.data, boxes)
+        matrix = stat.gen_region_matrix(masks, self.weights)
+        values = self.data["tas"].transpose("time", "lat", "lon").values.copy()
+        values[0, -1, :] = np.nan
+        values[1, 0, 0] = np.nan
+
+        for skipna in [True, False]:
+            result_sparse = stat.regional_weighted_mean(values, matrix, skipna = skipna, n_grid_axes = 2)
+            result_dense = stat.regional_weighted_mean(values, matrix.toarray(), skipna = skipna, n_grid_axes = 2)
+
+            np.testing.assert_allclose(result_dense, result_sparse)
+            self.assertFalse(np.isnan(result_dense[:2]).any())
+
+class TestClimatology(unittest.TestCase):
+
+    def setUp(self):
+        start = cftime.datetime(1950,1,1,0,0,0, calendar="noleap")
+        end = cftime.datetime(1980,1,1,0,0,0, calendar="noleap")
+        self.data = stat.generate_timeseries(start, end, "day", calendar="noleap").to_dataset(name="time_bnds")
+        self.data = self.data.assign_coords(lat = np.arange(4.), lon = np.arange(5.))
+        self.data["tas"] = (("time", "lat", "lon"), np.random.rand(self.data.sizes["time"], 4, 5))
+        self.data["tas"][10, 1, 1] = np.nan
+        self.data["orog"] = (("lat", "lon"), np.random.rand(4, 5))
+
+    def test_cal_climatology(self):
+        for group in ["month", "dayofyear", "season"]:
+            climatology = stat.cal_climatology(self.data.chunk({"time": 1000}), group, "1955", "1974")
+            reference = self.data.tas.sel(time = slice("1955", "1974")).groupby("time." + group).mean("time")
+            xr.testing.assert_allclose(climatology.tas.sel({group: reference[group]}).transpose(*reference.dims), reference)
+
+    def test_cal_climatology_smoothing(self):
+        climatology = stat.cal_climatology(self.data, "dayofyear", smoothing_window = 3)
+        reference = stat.cal_climatology(self.data, "dayofyear")
+        
+        np.testing.assert_allclose(climatology.tas.sel(dayofyear = 100), reference.tas.sel(dayofyear = slice(99, 101)).mean("dayofyear"))
+
+    def test_cal_climatology_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            climatology = stat.cal_climatology(self.data, "month", "1955", "1974", cache_dir = cache_dir, dataset_id = "test")
+            self.assertEqual(os.listdir(os.path.join(cache_dir, "test")), ["tas_month_19550101-19741231.nc"])
+
+            data = self.data.copy()
+            data["tas"] = xr.zeros_like(data.tas)
+            xr.testing.assert_allclose(stat.cal_climatology(data, "month", "1955", "1974", cache_dir = cache_dir, dataset_id = "test"), climatology)
+
+    def test_cal_climatology_anomaly(self):
+        anomaly = stat.cal_climatology_anomaly(self.data.chunk({"time": 1000, "lat": 2}), "month")
+        reference = self.data.tas.groupby("time.month") - self.data.tas.groupby("time.month").mean("time")
+
+        self.assertIsNotNone(anomaly.tas.chunks)
+        xr.testing.assert_allclose(anomaly.tas, reference.drop_vars("month"))
+        xr.testing.assert_equal(anomaly.orog, self.data.orog)
+        self.assertEqual(provenance.render(anomaly).attrs["table_id"], "month_anomaly")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,26 +7,32 @@ import numpy as np
 
 from climtools import temporal 
 from climtools import stat
+from climtools import utils
 import helper_functions
 
 class TestStat(unittest.TestCase):
     
-    def __init__(self, *args, **kwargs):
-        super(TestStat, self).__init__(*args, **kwargs)
-        self.data_directory = os.path.join(os.getcwd(),"data")
-        if not os.path.exists(self.data_directory):
-            os.mkdir(self.data_directory)
+    @classmethod
+    def setUpClass(cls):
+        cls.data_directory = os.path.join(os.getcwd(),"data")
+        if not os.path.exists(cls.data_directory):
+            os.mkdir(cls.data_directory)
         
-        self.start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
-        self.end = cftime.datetime(2100,1,1,0,0,0, calendar ="proleptic_gregorian")
-        self.data_1d = stat.gen_test_mono_timeseries(self.start, self.end)
-        self.data_1m = temporal.temporal_downsampling(self.data_1d, "month")
-        self.data_1y = temporal.temporal_downsampling(self.data_1d, "year")
-        self.data_1y_from_1m = temporal.temporal_downsampling(self.data_1m, "year")
+        cls.start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        cls.end = cftime.datetime(2100,1,1,0,0,0, calendar ="proleptic_gregorian")
+        cls.data_1d = stat.gen_test_mono_timeseries(cls.start, cls.end)
+        cls.data_1m = temporal.temporal_downsampling(cls.data_1d, "month")
+        cls.data_1y = temporal.temporal_downsampling(cls.data_1d, "year")
+        cls.data_1y_from_1m = temporal.temporal_downsampling(cls.data_1m, "year")
 
     def test_temporal_downsampling_from_monthly_daily(self):
         xr.testing.assert_allclose(self.data_1y_from_1m, self.data_1y)
 
+    def test_temporal_downsampling_seasonal_from_monthly_daily(self):
+        data_1s = temporal.temporal_downsampling(self.data_1d, "season_dec")
+        data_1s_from_1m = temporal.temporal_downsampling(self.data_1m, "season_dec")
+        xr.testing.assert_allclose(data_1s_from_1m, data_1s)
+
     def test_temporal_downsampling_monthly(self):
         time = self.data_1m.time
         days_in_month = time.dt.days_in_month
@@ -50,6 +56,152 @@ class TestStat(unittest.TestCase):
 
     #def test_temporal_downsampling_yearly(self):
 
+
+class TestCalendar(unittest.TestCase):
+
+    def test_cal_year_properties(self):
+        years = np.arange(-50, 2500)
+        years = years[years != 0]
+        for calendar in ["standard", "gregorian", "proleptic_gregorian", "julian", "noleap", "365_day", "all_leap", "366_day", "360_day"]:
+            year_length, leap = temporal.cal_year_properties(years, calendar)
+
+            cftime_leap = [cftime.is_leap_year(year, calendar) for year in years]
+            has_year_zero = cftime.datetime(1, 1, 1, calendar=calendar).has_year_zero
+            next_years = np.where((years == -1) & ~has_year_zero, 1, years + 1)
+            cftime_year_length = [(cftime.datetime(next_year, 1, 1, calendar=calendar) - cftime.datetime(year, 1, 1, calendar=calendar)).days for year, next_year in zip(years, next_years)]
+
+            np.testing.assert_array_equal(cftime_leap, leap)
+            np.testing.assert_array_equal(cftime_year_length, year_length)
+
+    def test_cal_timedelta_year(self):
+        time = xr.DataArray(xr.cftime_range("1999-01-01", "2001-01-01", freq="1MS", calendar="julian"), dims=["time"])
+        timedelta = temporal.cal_timedelta_year(time)
+
+        np.testing.assert_array_equal(np.where(time.dt.year == 2000, 366, 365)*temporal.timedelta_1D, timedelta)
+
+    def test_cal_dates_from_days(self):
+        days = np.arange(-1000, 800000, 13)
+        for calendar in temporal.calendars:
+            times = cftime.num2date(days, temporal.time_units, calendar)
+            years, months, days_of_month = temporal.cal_dates_from_days(days, calendar)
+
+            np.testing.assert_array_equal([time.year for time in times], years)
+            np.testing.assert_array_equal([time.month for time in times], months)
+            np.testing.assert_array_equal([time.day for time in times], days_of_month)
+            np.testing.assert_array_equal(temporal.cal_days_since_epoch(years, months, days_of_month, calendar), days)
+
+    def test_encode_decode_cftime(self):
+        microseconds = np.arange(0, 10**4)*(700*temporal.microseconds_per_day//13 + 1) + 1850*365*temporal.microseconds_per_day
+        for calendar in temporal.calendars:
+            times = temporal.decode_cftime(microseconds, calendar)
+            np.testing.assert_array_equal(times[::7], cftime.num2date(microseconds[::7], temporal.time_units.replace("days", "microseconds"), calendar))
+            np.testing.assert_array_equal(temporal.encode_cftime(times, calendar), microseconds)
+
+    def test_generate_timeseries(self):
+        start = cftime.datetime(1850,1,15,0,0,0, calendar = "noleap")
+        end = cftime.datetime(1853,3,2,0,0,0, calendar = "noleap")
+        for frequency in ["day", "month", "season_dec"]:
+            time_bnds = stat.generate_timeseries(start, end, frequency, calendar = "noleap")
+            period_starts = xr.cftime_range(start, end, freq = temporal.temporal_resolution_dict[frequency], calendar = "noleap")
+
+            np.testing.assert_array_equal(time_bnds.values[:, 0], period_starts[:-1])
+            np.testing.assert_array_equal(time_bnds.values[:, 1], period_starts[1:])
+            np.testing.assert_array_equal(time_bnds.time.values, period_starts[:-1] + (period_starts[1:] - period_starts[:-1])/2)
+
+            time_bnds_numeric = stat.generate_timeseries(start, end, frequency, calendar = "noleap", numeric = True)
+            xr.testing.assert_identical(xr.decode_cf(time_bnds_numeric.to_dataset(name = "time_bnds"), use_cftime = True).time_bnds, time_bnds.rename("time_bnds"))
+
+
+
+
+class TestTemporalResolution(unittest.TestCase):
+
+    def setUp(self):
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1900,1,1,0,0,0, calendar ="proleptic_gregorian")
+        self.data_1m = stat.generate_timeseries(start, end, "month").to_dataset(name="time_bnds")
+
+    def test_get_temporal_resolution(self):
+        self.assertEqual(temporal.get_temporal_resolution(self.data_1m), "month")
+        self.assertEqual(temporal.get_temporal_resolution(self.data_1m, full_validation=True), "month")
+        self.assertEqual(temporal.get_temporal_resolution(self.data_1m.chunk({"time": 12})), "month")
+
+    def test_get_temporal_resolution_cache(self):
+        data = self.data_1m.copy()
+        self.assertEqual(temporal.get_temporal_resolution(data), "month")
+
+        cache = utils.get_object_cache(data)
+        time_bnds_variable, temporal_resolution, validated = cache["temporal_resolution"]
+        cache["temporal_resolution"] = (time_bnds_variable, "year", validated)
+        self.assertEqual(temporal.get_temporal_resolution(data), "year")
+
+        data["time_bnds"] = data.time_bnds.copy(deep=True)
+        self.assertEqual(temporal.get_temporal_resolution(data), "month")
+
+
+class TestTemporalDownsamplingChunked(unittest.TestCase):
+
+    def setUp(self):
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1870,1,1,0,0,0, calendar ="proleptic_gregorian")
+        self.data_1d = stat.gen_test_mono_timeseries(start, end)
+        self.data_1d["field"] = (("time", "lat"), np.random.rand(self.data_1d.sizes["time"], 8))
+
+    def test_temporal_downsampling_chunked(self):
+        data_chunked = self.data_1d.chunk({"time": 100})
+
+        for target_resolution in ["month", "season_dec", "year"]:
+            data_result = temporal.temporal_downsampling(data_chunked, target_resolution, max_chunk_bytes = 400*8*8)
+            data_result_eager = temporal.temporal_downsampling(self.data_1d, target_resolution)
+
+            self.assertTrue(data_result["field"].chunks is not None)
+            xr.testing.assert_allclose(data_result.compute(), data_result_eager)
+
+    def test_temporal_downsampling_non_numeric(self):
+        data = self.data_1d.assign(flag = ("time", self.data_1d.time.dt.strftime("%Y-%m-%d").values))
+        data_result = temporal.temporal_downsampling(data, "year")
+
+        self.assertEqual(data_result["flag"].dims, ("time",))
+        self.assertEqual(list(data_result["flag"].values), ["{}-01-01".format(year) for year in range(1850, 1870)])
+        xr.testing.assert_equal(data_result.drop_vars("flag"), temporal.temporal_downsampling(self.data_1d, "year"))
+
+    def test_cal_aligned_chunks(self):
+        bin_starts = temporal.cal_bin_starts(temporal.cal_bin_codes(self.data_1d.time, "month"))
+        time_chunks, bin_chunks = temporal.cal_aligned_chunks(bin_starts, self.data_1d.sizes["time"], bytes_per_step = 8, max_chunk_bytes = 8*100)
+        
+        self.assertEqual(sum(time_chunks), self.data_1d.sizes["time"])
+        self.assertEqual(sum(bin_chunks), len(bin_starts))
+        self.assertTrue(all(time_chunk <= 100 for time_chunk in time_chunks))
+        np.testing.assert_array_equal(np.cumsum((0,) + time_chunks)[:-1], bin_starts[np.cumsum((0,) + bin_chunks)[:-1]])
+
+
+class TestRollingMean(unittest.TestCase):
+
+    def setUp(self):
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1880,1,1,0,0,0, calendar ="proleptic_gregorian")
+        self.data_1m = stat.generate_timeseries(start, end, "month").to_dataset(name="time_bnds")
+        self.data_1m["field"] = (("time", "lat"), np.random.rand(self.data_1m.sizes["time"], 3))
+        self.data_1m["field"][20:25, 1] = np.nan
+
+    def test_rolling_window_mean(self):
+        values = self.data_1m["field"].transpose("lat", "time")
+        for window in [1, 4, 5]:
+            for center in [True, False]:
+                for min_periods in [None, 1, 2]:
+                    np.testing.assert_allclose(values.rolling(time=window, center=center, min_periods=min_periods).mean().values,
+                                               temporal.rolling_window_mean(values.values, window, center=center, min_periods=min_periods))
+
+    def test_cal_rolling_time_mean(self):
+        data_rolling = temporal.cal_rolling_time_mean(self.data_1m, window=12)
+        data_rolling_chunked = temporal.cal_rolling_time_mean(self.data_1m.chunk({"time": 50}), window=12)
         
+        xr.testing.assert_allclose(data_rolling["field"], self.data_1m["field"].rolling(time=12, center=True).mean().dropna("time", how="all"))
+        xr.testing.assert_allclose(data_rolling, data_rolling_chunked.compute())
+
+        xr.testing.assert_equal(data_rolling.time_bnds.isel(bnds=0).drop_vars("time"), self.data_1m.time_bnds.isel(bnds=0, time=slice(0, -11)).drop_vars("time"))
+        xr.testing.assert_equal(data_rolling.time_bnds.isel(bnds=1).drop_vars("time"), self.data_1m.time_bnds.isel(bnds=1, time=slice(11, None)).drop_vars("time"))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import xarray as xr
+import numpy as np
+
+from climtools import utils
+
+
+class TestDimsIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.data = xr.Dataset({"tas": (("time", "lat", "lon"), np.zeros((3, 4, 5))),
+                                "orog": (("lat", "lon"), np.zeros((4, 5))),
+                                "time_bnds": (("time", "bnds"), np.zeros((3, 2)))})
+
+    def test_select_dependent_variables(self):
+        self.assertEqual(utils.select_dependent_variables(self.data, ("lat", "lon")), (["tas", "orog"], ["time_bnds"]))
+        self.assertEqual(utils.select_dependent_variables(self.data, "time"), (["tas", "time_bnds"], ["orog"]))
+        self.assertEqual(utils.select_dependent_variables(self.data, ("time", "height")), ([], ["tas", "orog", "time_bnds"]))
+        self.assertEqual(utils.decompose_dependent_variables(self.data, ("time",)), {"dependent": ["tas", "time_bnds"], "independent": ["orog"]})
+
+    def test_dims_index_cache(self):
+        names, index = utils.get_dims_index(self.data)
+        self.assertIs(utils.get_dims_index(self.data)[1], index)
+
+        self.data["pr"] = (("time", "lat", "lon"), np.zeros((3, 4, 5)))
+        self.assertEqual(utils.select_dependent_variables(self.data, ("time", "lat"))[0], ["tas", "pr"])
+
+        self.data["orog"] = (("time",), np.zeros(3))
+        self.assertEqual(utils.select_dependent_variables(self.data, "time")[0], ["tas", "orog", "time_bnds", "pr"])
+
+
+class TestProcessingAttributes(unittest.TestCase):
+
+    def test_missing_attributes(self):
+        data = xr.Dataset({"tas": ("time", np.zeros(3))})
+        utils.add_table_id(data, "yearmean")
+        utils.add_history(data, "Downsampled", timestamp = "2000-01-01T00:00:00Z")
+        self.assertEqual(data.attrs, {"table_id": "yearmean", "history": " 2000-01-01T00:00:00Z ; Downsampled "})
+
+        utils.add_table_id(data, "masked")
+        utils.add_history(data, "Applied mask", timestamp = "2000-01-02T00:00:00Z")
+        self.assertEqual(data.attrs["table_id"], "yearmean_masked")
+        self.assertTrue(data.attrs["history"].endswith(" 2000-01-02T00:00:00Z ; Applied mask "))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import importlib.util
+import tempfile
+import xarray as xr
+import cftime
+import numpy as np
+
+from climtools import stat
+from climtools import writer
+
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        start = cftime.datetime(1850,1,1,0,0,0, calendar = "proleptic_gregorian")
+        end = cftime.datetime(1860,1,1,0,0,0, calendar ="proleptic_gregorian")
+        self.data = stat.generate_timeseries(start, end, "month").to_dataset(name="time_bnds")
+        self.data = self.data.assign_coords(lat = np.linspace(-87.5, 87.5, 36), lon = np.arange(2.5, 360, 5.))
+        self.data["tas"] = (("time", "lat", "lon"), np.random.rand(self.data.sizes["time"], 36, 72).round(2))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_gen_dim_chunks(self):
+        self.assertEqual(writer.gen_dim_chunks(self.data, "map"), {"time": 1, "lat": 36, "lon": 72})
+        self.assertEqual(writer.gen_dim_chunks(self.data, "timeseries", chunk_bytes = 120*8*100), {"time": 120, "lat": 10, "lon": 10})
+        self.assertEqual(writer.gen_dim_chunks(self.data, None), {})
+
+    def test_save_dataset_netcdf(self):
+        path = os.path.join(self.folder.name, "tas.nc")
+        self.assertEqual(writer.save_dataset(self.data, path, preset = "timeseries"), path)
+
+        data = xr.open_dataset(path, use_cftime = True)
+        xr.testing.assert_allclose(data, self.data)
+        self.assertTrue(data.tas.encoding["zlib"])
+        self.assertEqual(data.tas.encoding["chunksizes"], (120, 36, 66))
+        self.assertEqual(os.listdir(self.folder.name), ["tas.nc"])
+
+    def test_save_dataset_keep_encoding(self):
+        path_packed = os.path.join(self.folder.name, "tas_packed.nc")
+        self.data.to_netcdf(path_packed, encoding = {"tas": dict(dtype = "int16", scale_factor = 0.01, _FillValue = -9999, zlib = True, complevel = 4)})
+        data_packed = xr.open_dataset(path_packed, use_cftime = True)
+
+        for preset in [None, "map"]:
+            path = os.path.join(self.folder.name, "tas_{}.nc".format(preset))
+            writer.save_dataset(data_packed, path, preset = preset)
+            data = xr.open_dataset(path, use_cftime = True)
+            xr.testing.assert_allclose(data, self.data)
+            self.assertEqual(data.tas.encoding["dtype"], np.dtype("int16"))
+            self.assertEqual(data.tas.encoding["scale_factor"], 0.01)
+            self.assertTrue(data.tas.encoding["zlib"])
+        self.assertEqual(data.tas.encoding["chunksizes"], (1, 36, 72))
+
+    def test_save_dataset_delayed(self):
+        path = os.path.join(self.folder.name, "tas.nc")
+        delayed = writer.save_dataset(self.data.chunk({"time": 24}), path, preset = "map", compute = False)
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(delayed.compute(), path)
+        xr.testing.assert_allclose(xr.open_dataset(path, use_cftime = True), self.data)
+
+    def test_save_dataset_failure(self):
+        def fail(block):
+            raise ValueError("failed block")
+
+        data = self.data.chunk({"time": 24})
+        data["tas"] = data["tas"].copy(data = data["tas"].data.map_blocks(fail, dtype = float))
+        path = os.path.join(self.folder.name, "tas.nc")
+        engines = ["netcdf", "zarr"] if importlib.util.find_spec("zarr") else ["netcdf"]
+        for engine in engines:
+            with self.assertRaisesRegex(ValueError, "failed block"):
+                writer.save_dataset(data, path, engine = engine)
+            with self.assertRaisesRegex(ValueError, "failed block"):
+                writer.save_dataset(data, path, engine = engine, compute = False).compute()
+            self.assertEqual(os.listdir(self.folder.name), [])
+
+    @unittest.skipUnless(importlib.util.find_spec("zarr"), "zarr is not installed")
+    def test_save_dataset_zarr(self):
+        path = os.path.join(self.folder.name, "tas.zarr")
+        for preset in ["blosc", "timeseries"]:
+            writer.save_dataset(self.data.chunk({"time": 24}), path, preset = preset, engine = "zarr")
+            xr.testing.assert_allclose(xr.open_zarr(path, use_cftime = True).load(), self.data)
+        self.assertEqual(xr.open_zarr(path).tas.encoding["chunks"], (120, 36, 66))
+
+
+if __name__ == '__main__':
+    unittest.main()
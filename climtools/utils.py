@@ -1,8 +1,112 @@
 import xarray as xr
 import logging
 import datetime
+import weakref
+from . import provenance
 xr.set_options(keep_attrs = True)
 
+_object_cache = {}
+
+
+def get_object_cache(data):
+    """Returns a dictionary for caching derived quantities that is bound to the identity of a given object.
+    The dictionary is dropped as soon as the object is garbage collected.
+
+    Args:
+        data (xarray.Dataset or xarray.DataArray): Object the cache is attached to
+
+    Returns:
+        dict: Cache of the object
+    """
+    key = id(data)
+    entry = _object_cache.get(key)
+    if entry is not None and entry[0]() is data:
+        return entry[1]
+
+    def remove_entry(reference):
+        if key in _object_cache and _object_cache[key][0] is reference:
+            del _object_cache[key]
+
+    cache = {}
+    _object_cache[key] = (weakref.ref(data, remove_entry), cache)
+    return cache
+
+
+def clear_object_cache():
+    """Removes all cached quantities of all objects
+    """
+    _object_cache.clear()
+
+
+def is_dask_array(array):
+    """Checks whether an array is a dask array without requiring dask to be installed
+
+    Args:
+        array (array_like): Array to check
+
+    Returns:
+        bool: True for dask arrays
+    """
+    try:
+        import dask.array
+    except ImportError:
+        return False
+    return isinstance(array, dask.array.Array)
+
+
+def get_dims_index(data):
+    """Returns the names of the data variables of a dataset and an inverted index from each dimension to the data variables depending on it.
+    The index is cached per dataset and only rebuilt when a data variable is added, removed or replaced.
+
+    Args:
+        data (xarray.Dataset): Dataset to be analysed
+
+    Returns:
+        list: Names of the data variables
+        dict: Set of the names of the dependent data variables for each dimension
+    """
+    variables = data.variables
+    data_vars = [(name, variables[name]) for name in data.data_vars]
+
+    cache = get_object_cache(data)
+    if "dims_index" in cache:
+        cached_data_vars, names, index = cache["dims_index"]
+        if len(cached_data_vars) == len(data_vars) and all(name == cached_name and variable is cached_variable
+                                                           for (name, variable), (cached_name, cached_variable) in zip(data_vars, cached_data_vars)):
+            return names, index
+
+    names = [name for name, variable in data_vars]
+    index = {}
+    for name, variable in data_vars:
+        for dim in variable.dims:
+            index.setdefault(dim, set()).add(name)
+    
+    cache["dims_index"] = (data_vars, names, index)
+    return names, index
+
+
+def select_dependent_variables(data, dimensions):
+    """Splits the data variables of a dataset into the variables depending on all given dimensions and the remaining ones, using the cached dims index
+
+    Args:
+        data (xarray.Dataset): Dataset to be analysed
+        dimensions (str or tuple): Name(s) of the dimension(s)
+
+    Returns:
+        list: Names of the dependent variables
+        list: Names of the independent variables
+    """
+    dimensions = [dimensions] if isinstance(dimensions, str) else dimensions
+    names, index = get_dims_index(data)
+    
+    dependent_names = set(names)
+    for dim in dimensions:
+        dependent_names = dependent_names & index.get(dim, set())
+    
+    dependent = [name for name in names if name in dependent_names]
+    independent = [name for name in names if name not in dependent_names]
+    return dependent, independent
+
 
 def decompose_dependent_variables(data, dimensions):
     """Returns all variables of a dataset that depend on a specified dimension
@@ -14,18 +118,8 @@ def decompose_dependent_variables(data, dimensions):
     Returns:
         dict: dictionary containing the names of dependent and independent variables 
     """
-
-    dependent_variables = []
-    independent_variables = []
-    
-    for variable in data.data_vars:
-        data_dimensions = data.data_vars[variable].dims
-        if set(dimensions).issubset(set(data_dimensions)):
-            dependent_variables.append(variable)
-        else:
-            independent_variables.append(variable)
-            
-    logging.info("Dependent variables {} Independent Variables {}".format(dependent_variables, independent_variables))
+    dependent_variables, independent_variables = select_dependent_variables(data, dimensions)
+    logging.info("Dependent variables %s Independent Variables %s", dependent_variables, independent_variables)
         
     return {"dependent": dependent_variables, "independent": independent_variables}
 
@@ -42,24 +136,25 @@ def cal_weighting_factor(data, dimensions):
     xr.testing.assert_allclose(weights_sum , xr.ones_like(weights_sum))
     return weights    
 
-def add_history(data, processing_message):
-    """Appends  a new message with timestamp to the history attribute of a dataset
+def add_history(data, processing_message, timestamp=None):
+    """Appends  a new message with timestamp to the history attribute of a dataset. A missing history attribute is created.
 
     Args:
         data (xarray.Dataset or xarray.DataArray): dataset or dataarray for which history is to be changed
         processing_message (str): Message describing the processing step
+        timestamp (str, optional): Timestamp of the processing step. Defaults to the current time.
     """
-    now = datetime.datetime.now()
-    timestamp = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+    if timestamp is None:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
     message_timestamped = " {} ; {} ".format(timestamp, processing_message)
     
     if "history" in data.attrs.keys():
         data.attrs["history"] = data.attrs["history"] + message_timestamped
     else:
-        data.assign_attrs({"history":message_timestamped})
+        data.attrs["history"] = message_timestamped
 
 def add_table_id(data, processing_id):
-    """_summary_
+    """Appends the id of a processing step to the table_id attribute of a dataset. A missing table_id attribute is set to the id.
 
     Args:
         data (xarray,Dataset or xarray.DataArray): Dataset or array for which the table_id needs to be changed
@@ -68,19 +163,19 @@ def add_table_id(data, processing_id):
     if "table_id" in data.attrs.keys():
         data.attrs["table_id"] = "_".join([data.attrs["table_id"], processing_id])
     else:
-        data.assign_attrs({"table_id": processing_id})
+        data.attrs["table_id"] = processing_id
 
 def add_processing_attributes(data, processing_message, processing_id):
-    """Changes history and table_id attributes
+    """Records a processing step in the provenance log of the data. The step is rendered into the history and table_id attributes
+    when the data is written by writer.save_dataset or cmor.cmor_save (see provenance.render). Until then the history and table_id
+    attributes of the returned data are those of the input and the attribute provenance_id holds the token of the step.
 
     Args:
         data (xarray.Dataset or xarray.DataArray): 
         processing_message (string): Message describing the processing step
         processing_id (string): ID indicative of the processing step
     """
-
-    add_table_id(data, processing_id)
-    add_history(data, processing_message)
+    provenance.add_step(data, processing_message, processing_id)
 
 
 def pre_attrs_to_dims(ds,attribute_keys):
@@ -0,0 +1,282 @@
+import xarray as xr
+xr.set_options(keep_attrs = True)
+import os
+import shutil
+import logging
+import functools
+import numpy as np
+from . import utils
+from . import profiling
+from . import provenance
+
+encoding_presets = dict(
+    none = dict(compressor = None, level = None, shuffle = False, layout = None),
+    zlib = dict(compressor = "zlib", level = 4, shuffle = True, layout = None),
+    blosc = dict(compressor = "blosc", level = 5, shuffle = True, layout = None),
+    timeseries = dict(compressor = "zlib", level = 4, shuffle = True, layout = "timeseries"),
+    map = dict(compressor = "zlib", level = 4, shuffle = True, layout = "map"),
+)
+
+engines = ("netcdf", "zarr")
+engine_extensions = dict(netcdf = ".nc", zarr = ".zarr")
+default_chunk_bytes = 2**22
+packing_encoding_keys = ("dtype", "scale_factor", "add_offset", "_FillValue")
+
+
+def get_encoding_preset(preset):
+    """Returns the settings of an encoding preset
+
+    Args:
+        preset (str or dict): Name of one of the encoding_presets or dictionary with the keys compressor, level, shuffle and layout
+
+    Returns:
+        dict: Settings of the preset
+    """
+    if preset is None:
+        return encoding_presets["none"]
+    if isinstance(preset, str):
+        assert preset in encoding_presets, "Encoding preset must be one of the following: {}".format(list(encoding_presets))
+        return encoding_presets[preset]
+    return dict(encoding_presets["none"], **preset)
+
+
+def gen_dim_chunks(data, layout, time_dim = "time", chunk_bytes = default_chunk_bytes):
+    """Generates chunk sizes for the dimensions of a dataset tuned for an access pattern. The chunk sizes are derived from the largest variable.
+    For time-series access ("timeseries") a chunk covers the full time axis and a small spatial tile, for map access ("map") a chunk covers one time step and the full remaining dimensions.
+
+    Args:
+        data (xarray.Dataset): Dataset to be written
+        layout (str): "timeseries", "map" or None
+        time_dim (str, optional): Name of the time dimension. Defaults to "time".
+        chunk_bytes (int, optional): Targeted size of a chunk of time-series layouts in bytes. Defaults to default_chunk_bytes.
+
+    Returns:
+        dict: Chunk size for each dimension, empty if layout is None
+    """
+    if layout is None or len(data.data_vars) == 0:
+        return {}
+    assert layout in ["timeseries", "map"], "Layout must be timeseries or map"
+
+    variable = max(data.data_vars.values(), key = lambda variable: variable.size)
+    other_dims = [dim for dim in variable.dims if dim != time_dim]
+
+    if layout == "map":
+        dim_chunks = {dim: variable.sizes[dim] for dim in other_dims}
+        if time_dim in variable.dims:
+            dim_chunks[time_dim] = 1
+        return dim_chunks
+
+    n_time = variable.sizes.get(time_dim, 1)
+    n_point = max(chunk_bytes // (variable.dtype.itemsize * n_time), 1)
+    side = int(max(np.floor(n_point ** (1/max(len(other_dims), 1))), 1))
+    dim_chunks = {dim: min(side, variable.sizes[dim]) for dim in other_dims}
+    if time_dim in variable.dims:
+        dim_chunks[time_dim] = n_time
+    return dim_chunks
+
+
+def gen_compressor(compressor, level, shuffle):
+    """Generates a numcodecs compressor for the zarr backend
+
+    Args:
+        compressor (str): "zlib", "blosc" or None
+        level (int): Compression level
+        shuffle (bool): Whether to apply the byte shuffle filter
+
+    Returns:
+        numcodecs.abc.Codec: Compressor or None
+    """
+    if compressor is None:
+        return None
+    import numcodecs
+    if compressor == "blosc":
+        return numcodecs.Blosc(cname = "zstd", clevel = level, shuffle = numcodecs.Blosc.SHUFFLE if shuffle else numcodecs.Blosc.NOSHUFFLE)
+    return numcodecs.Zlib(level = level)
+
+
+def gen_encoding(data, preset = "zlib", engine = "netcdf", dim_chunks = None):
+    """Generates the encoding of all numeric variables of a dataset for an encoding preset. The packing of the variables (dtype, scale_factor,
+    add_offset and _FillValue) is kept from their current encoding.
+
+    Args:
+        data (xarray.Dataset): Dataset to be written
+        preset (str or dict, optional): Encoding preset. Defaults to "zlib".
+        engine (str, optional): "netcdf" or "zarr". Defaults to "netcdf".
+        dim_chunks (dict, optional): Chunk sizes of the dimensions, if None they are generated from the layout of the preset. Defaults to None.
+
+    Returns:
+        dict: Encoding for each variable
+    """
+    assert engine in engines, "Engine must be one of the following: {}".format(engines)
+    settings = get_encoding_preset(preset)
+    dim_chunks = gen_dim_chunks(data, settings["layout"]) if dim_chunks is None else dim_chunks
+
+    compressor = settings["compressor"]
+    if engine == "netcdf" and compressor == "blosc":
+        logging.warning("Blosc is not supported for netcdf output, zlib is used instead")
+        compressor = "zlib"
+
+    encoding = {}
+    for name, variable in data.data_vars.items():
+        if variable.ndim == 0 or variable.dtype.kind not in "iuf":
+            continue
+        variable_encoding = {key: variable.encoding[key] for key in packing_encoding_keys if key in variable.encoding}
+        chunks = None
+        if all(dim in dim_chunks for dim in variable.dims):
+            chunks = tuple(min(dim_chunks[dim], variable.sizes[dim]) for dim in variable.dims)
+
+        if engine == "netcdf":
+            if compressor is not None:
+                variable_encoding.update(zlib = True, complevel = settings["level"], shuffle = settings["shuffle"])
+            if chunks is not None:
+                variable_encoding["chunksizes"] = chunks
+        else:
+            variable_encoding["compressor"] = gen_compressor(compressor, settings["level"], settings["shuffle"])
+            if chunks is not None and not utils.is_dask_array(variable.data):
+                variable_encoding["chunks"] = chunks
+        encoding[name] = variable_encoding
+    return encoding
+
+
+def set_extension(filename, engine = "netcdf"):
+    """Replaces the extension of a filename by the extension of an engine
+
+    Args:
+        filename (str): Filename, e.g. generated by cmor.gen_cmor_filename
+        engine (str, optional): "netcdf" or "zarr". Defaults to "netcdf".
+
+    Returns:
+        str: Filename with the extension of the engine
+    """
+    return os.path.splitext(filename)[0] + engine_extensions[engine]
+
+
+def gen_tmp_path(path):
+    """Generates a temporary path next to the target path so that the final rename stays on the same file system
+
+    Args:
+        path (str): Target path
+
+    Returns:
+        str: Temporary path
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, ".{}.{}.tmp".format(filename, os.getpid()))
+
+
+def finalize_write(tmp_path, path, written = None):
+    """Moves a completely written temporary output to its target path. Files are replaced atomically, existing zarr stores are removed first.
+
+    Args:
+        tmp_path (str): Temporary path
+        path (str): Target path
+        written (object, optional): Result of a delayed write, only used to make the rename depend on the write. Defaults to None.
+
+    Returns:
+        str: Target path
+    """
+    if os.path.isdir(tmp_path) and os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def remove_output(path):
+    """Removes a netcdf file or zarr store if it exists
+
+    Args:
+        path (str): Path of the output
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors = True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def compute_and_finalize_write(written, tmp_path, path):
+    """Computes a delayed write and moves its temporary output to the target path. The temporary output is removed if the write fails.
+
+    Args:
+        written (dask.delayed.Delayed): Delayed write to the temporary path
+        tmp_path (str): Temporary path
+        path (str): Target path
+
+    Returns:
+        str: Target path
+    """
+    try:
+        written.compute()
+        return finalize_write(tmp_path, path)
+    except BaseException:
+        remove_output(tmp_path)
+        raise
+
+
+@profiling.profiled
+def save_dataset(data, path, preset = None, engine = "netcdf", compute = True):
+    """Writes a dataset as netcdf or zarr with the encoding of a preset. The dataset is written to a temporary path and renamed afterwards,
+    so that the target path never contains a partially written file and the temporary output is removed if the write fails. Dask backed variables are written in parallel by dask.
+    The recorded processing steps are rendered into the history and table_id attributes before writing (see provenance.render).
+
+    Args:
+        data (xarray.Dataset): Dataset to be written
+        path (str): Target path
+        preset (str or dict, optional): Encoding preset, None keeps the encoding of the variables, e.g. of the input file. Defaults to None.
+        engine (str, optional): "netcdf" or "zarr". Defaults to "netcdf".
+        compute (bool, optional): If False the write is returned as dask.delayed object which writes and renames when computed. Defaults to True.
+
+    Returns:
+        str or dask.delayed.Delayed: Target path or delayed write
+    """
+    assert engine in engines, "Engine must be one of the following: {}".format(engines)
+    if isinstance(data, xr.DataArray):
+        data = data.to_dataset()
+    data = provenance.render(data)
+
+    if preset is None:
+        encoding = {}
+    else:
+        settings = get_encoding_preset(preset)
+        dim_chunks = gen_dim_chunks(data, settings["layout"])
+        if engine == "zarr" and len(dim_chunks) > 0 and any(utils.is_dask_array(variable.data) for variable in data.data_vars.values()):
+            # zarr chunks of dask backed variables are taken from the dask chunks
+            data = data.chunk(dim_chunks)
+        encoding = gen_encoding(data, preset, engine, dim_chunks = dim_chunks)
+
+    tmp_path = gen_tmp_path(path)
+    logging.info("Writing {} with preset {}".format(path, preset))
+    try:
+        if engine == "zarr":
+            data = data.copy()
+            for variable in data.variables.values():
+                variable.encoding.pop("chunks", None)
+            delayed = data.to_zarr(tmp_path, mode = "w", encoding = encoding, compute = compute)
+        else:
+            delayed = data.to_netcdf(tmp_path, encoding = encoding, compute = compute)
+
+        if compute:
+            return finalize_write(tmp_path, path)
+    except BaseException:
+        remove_output(tmp_path)
+        raise
+
+    import dask
+    # the write is computed inside the returned task, so that the task can remove the temporary output if the write fails
+    return dask.delayed(functools.partial(compute_and_finalize_write, delayed, tmp_path, path), pure = False)()
+
+
+def save_datasets(datasets, paths, preset = None, engine = "netcdf"):
+    """Writes several datasets in one parallel dask computation
+
+    Args:
+        datasets (list): Datasets to be written
+        paths (list): Target paths
+        preset (str or dict, optional): Encoding preset. Defaults to None.
+        engine (str, optional): "netcdf" or "zarr". Defaults to "netcdf".
+
+    Returns:
+        list: Target paths
+    """
+    import dask
+    delayed = [save_dataset(data, path, preset = preset, engine = engine, compute = False) for data, path in zip(datasets, paths)]
+    return list(dask.compute(*delayed))